@@ -1,6 +1,9 @@
 from typing import List, Dict
 
+from apps.server.utils.spans import timed
 
+
+@timed("agent.analyste")
 def propose_answer(query: str, sources: List[Dict]) -> Dict:
     citations = [{"doc": s["doc"], "loc": s["loc"]} for s in sources[:2]]
     answer = f"Réponse (draft) à: '{query}'. " f"Basée sur {len(sources)} source(s)."
@@ -0,0 +1,160 @@
+"""Ordonnanceur du parlement : agents concurrents sous échéance et budget.
+
+Chaque agent est une tâche (fonction synchrone exécutée dans un thread) avec
+ses dépendances et un coût unitaire. Une tâche démarre dès que ses
+dépendances ont abouti, si son coût tient dans le budget restant ; les
+tâches indépendantes tournent donc en parallèle. À l'échéance, les tâches
+en cours sont abandonnées (le thread finit en arrière-plan, son résultat est
+ignoré) et on répond avec les votes arrivés.
+
+Statuts d'un vote : ok, error, timeout (échéance atteinte en cours),
+over_budget (coût refusé), skipped (dépendance manquante ou échéance
+atteinte avant le démarrage).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+from agents.analyste import propose_answer
+from agents.archiviste import propose_sources
+from agents.securite import review_answer, review_sources
+from apps.server.utils.filters import DocFilter
+
+DEADLINE_MS = float(os.getenv("LOUMINA_PARLIAMENT_DEADLINE_MS", "2000"))
+
+# pool dédié : une tâche abandonnée n'occupe pas les threads de Starlette
+_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LOUMINA_PARLIAMENT_WORKERS", "16")),
+    thread_name_prefix="parliament",
+)
+
+# coût (unités arbitraires) imputé au budget `max_cost` par agent lancé
+AGENT_COSTS = {
+    "Archiviste": 1.0,
+    "Analyste": 0.5,
+    "Securite": 0.2,
+    "SecuriteReponse": 0.2,
+}
+
+
+@dataclass
+class Task:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]  # reçoit les résultats des dépendances
+    deps: Tuple[str, ...] = ()
+    cost: float = 1.0
+
+
+async def run(
+    tasks: List[Task], deadline_ms: float, max_cost: Optional[float] = None
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Exécute le graphe `tasks` ; renvoie (résultats des tâches ok, votes).
+
+    Les tâches sont admises dans l'ordre de la liste (priorité) ; les votes
+    sont rendus dans ce même ordre.
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + deadline_ms / 1000.0
+    results: Dict[str, Any] = {}
+    votes: Dict[str, Dict[str, Any]] = {}
+    loop = asyncio.get_running_loop()
+    running: Dict[asyncio.Future, Task] = {}
+    started: Dict[str, float] = {}
+    spent = 0.0
+
+    def vote(t: Task, status: str, ms: float = 0.0, cost: float = 0.0) -> None:
+        votes[t.name] = {
+            "agent": t.name,
+            "status": status,
+            "ms": round(ms, 3),
+            "cost": cost,
+        }
+
+    while True:
+        for t in tasks:
+            if t.name in votes or t.name in started:
+                continue
+            if any(d in votes and votes[d]["status"] != "ok" for d in t.deps):
+                vote(t, "skipped")
+            elif all(d in results for d in t.deps):
+                if max_cost is not None and spent + t.cost > max_cost:
+                    vote(t, "over_budget")
+                    continue
+                spent += t.cost
+                started[t.name] = time.perf_counter()
+                inputs = {d: results[d] for d in t.deps}
+                # copy_context : les spans de l'agent comptent dans la requête
+                fut = loop.run_in_executor(_POOL, copy_context().run, t.fn, inputs)
+                running[fut] = t
+        if not running:
+            break
+        remaining = deadline - time.perf_counter()
+        done = set()
+        if remaining > 0:
+            done, _ = await asyncio.wait(
+                running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+        if not done:  # échéance : on abandonne tout ce qui tourne encore
+            now = time.perf_counter()
+            for fut, t in running.items():
+                fut.cancel()
+                vote(t, "timeout", (now - started[t.name]) * 1000.0, t.cost)
+            break
+        for fut in done:
+            t = running.pop(fut)
+            ms = (time.perf_counter() - started[t.name]) * 1000.0
+            try:
+                results[t.name] = fut.result()
+            except Exception as exc:
+                vote(t, "error", ms, t.cost)
+                votes[t.name]["error"] = repr(exc)
+            else:
+                vote(t, "ok", ms, t.cost)
+    for t in tasks:
+        if t.name not in votes:
+            vote(t, "skipped")  # jamais démarrée avant l'échéance
+    return results, [votes[t.name] for t in tasks]
+
+
+def agents(
+    query: str,
+    k: int = 5,
+    alpha: float = 0.6,
+    half_life_days: Optional[float] = None,
+    flt: Optional[DocFilter] = None,
+) -> List[Task]:
+    """Graphe par défaut : Archiviste, puis Analyste et Securite (sources) en
+    parallèle, puis SecuriteReponse (brouillon de l'Analyste)."""
+    return [
+        Task(
+            "Archiviste",
+            lambda _: propose_sources(
+                query, k=k, alpha=alpha, half_life_days=half_life_days, flt=flt
+            ),
+            cost=AGENT_COSTS["Archiviste"],
+        ),
+        Task(
+            "Analyste",
+            lambda r: propose_answer(query, r["Archiviste"]),
+            deps=("Archiviste",),
+            cost=AGENT_COSTS["Analyste"],
+        ),
+        Task(
+            "Securite",
+            lambda r: review_sources(query, r["Archiviste"]),
+            deps=("Archiviste",),
+            cost=AGENT_COSTS["Securite"],
+        ),
+        Task(
+            "SecuriteReponse",
+            # copie : le brouillon de l'Analyste reste tel quel dans les résultats
+            lambda r: review_answer(dict(r["Analyste"])),
+            deps=("Analyste",),
+            cost=AGENT_COSTS["SecuriteReponse"],
+        ),
+    ]
@@ -1,13 +1,243 @@
-from typing import Dict
+"""Agent sécurité : deny-list compilée (Aho-Corasick) appliquée aux réponses.
+
+Les motifs viennent d'un fichier texte (LOUMINA_DENYLIST, par défaut
+`agents/denylist.txt`), relu quand il change. Une ligne par motif :
+
+    motif[<TAB>poids]        # phrase littérale (poids 1.0 par défaut)
+    re:expression[<TAB>poids]
+
+Texte et motifs sont comparés après repli casse + accents. Les phrases
+littérales (l'essentiel de la liste) sont compilées en un automate
+Aho-Corasick : un seul passage sur le texte, quel que soit leur nombre ; les
+expressions régulières sont essayées une à une. Le risque combine les poids
+des motifs trouvés en « ou bruité » : 1 - prod(1 - poids).
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import os
+import pathlib
+import re
+import threading
+import time
+import unicodedata
+
+from apps.server.utils.spans import timed
 
 FORBIDDEN = ["delete all", "rm -rf", "format /"]
 
+DENYLIST_PATH = pathlib.Path(
+    os.getenv("LOUMINA_DENYLIST", str(pathlib.Path(__file__).with_name("denylist.txt")))
+)
+RELOAD_SECS = 2.0  # intervalle minimal entre deux stat() du fichier
+REGEX_TAIL = 256  # contexte gardé entre morceaux pour les regex (flux)
+
+
+def fold(text: str) -> str:
+    """Minuscules sans accents (NFKD, marques combinantes retirées)."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def fold_accents(pattern: str) -> str:
+    """Accents retirés d'une regex (la casse est gérée par re.IGNORECASE)."""
+    decomposed = unicodedata.normalize("NFKD", pattern)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+@dataclass(frozen=True)
+class Pattern:
+    text: str
+    weight: float = 1.0
+    regex: bool = False
+
+
+def parse_patterns(lines: Iterable[str]) -> List[Pattern]:
+    out: List[Pattern] = []
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        text, _, weight = line.partition("\t")
+        regex = text.startswith("re:")
+        if regex:
+            text = text[3:]
+        out.append(Pattern(text, float(weight) if weight.strip() else 1.0, regex))
+    return out
+
+
+class Matcher:
+    """Deny-list compilée (immuable) : automate pour les littéraux + regex."""
+
+    def __init__(self, patterns: List[Pattern]):
+        self.patterns = patterns
+        # trie : goto[état][car] -> état ; fail / out calculés en largeur
+        self._goto: List[Dict[str, int]] = [{}]
+        out: List[Tuple[int, ...]] = [()]
+        for pid, p in enumerate(patterns):
+            if p.regex:
+                continue
+            key = fold(p.text)
+            if not key:
+                continue
+            s = 0
+            for c in key:
+                nxt = self._goto[s].get(c)
+                if nxt is None:
+                    nxt = self._goto[s][c] = len(self._goto)
+                    self._goto.append({})
+                    out.append(())
+                s = nxt
+            out[s] += (pid,)
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for s in queue:  # parcours en largeur (la liste grandit)
+            for c, t in self._goto[s].items():
+                f = self._fail[s]
+                while f and c not in self._goto[f]:
+                    f = self._fail[f]
+                g = self._goto[f].get(c, 0)
+                self._fail[t] = g if g != t else 0
+                out[t] += out[self._fail[t]]
+                queue.append(t)
+        self._out = out
+        self._alphabet = frozenset(c for g in self._goto for c in g)
+        self._regexes = [
+            (pid, re.compile(fold_accents(p.text), re.IGNORECASE))
+            for pid, p in enumerate(patterns)
+            if p.regex
+        ]
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path) -> "Matcher":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(parse_patterns(f))
+
+    def _step(self, state: int, folded: str, found: Set[int]) -> int:
+        goto, fail, out, alphabet = self._goto, self._fail, self._out, self._alphabet
+        for c in folded:
+            if c not in alphabet:
+                state = 0
+                continue
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                found.update(out[state])
+        return state
+
+    def _regex_scan(self, folded: str, found: Set[int]) -> None:
+        for pid, rx in self._regexes:
+            if pid not in found and rx.search(folded):
+                found.add(pid)
+
+    def scan(self, text: str) -> "ScanResult":
+        found: Set[int] = set()
+        folded = fold(text)
+        self._step(0, folded, found)
+        self._regex_scan(folded, found)
+        return ScanResult.of(self, found)
 
+    def stream(self) -> "StreamScan":
+        return StreamScan(self)
+
+    def risk(self, found: Iterable[int]) -> float:
+        keep = 1.0
+        for pid in found:
+            keep *= 1.0 - min(1.0, max(0.0, self.patterns[pid].weight))
+        return 1.0 - keep
+
+
+@dataclass
+class ScanResult:
+    matches: List[Pattern]
+    risk: float
+
+    @classmethod
+    def of(cls, matcher: Matcher, found: Set[int]) -> "ScanResult":
+        return cls([matcher.patterns[i] for i in sorted(found)], matcher.risk(found))
+
+
+class StreamScan:
+    """Analyse incrémentale d'un texte reçu par morceaux (réponse en génération).
+
+    L'état de l'automate est conservé d'un morceau à l'autre ; les regex voient
+    les REGEX_TAIL derniers caractères du morceau précédent en plus du courant.
+    """
+
+    def __init__(self, matcher: Matcher):
+        self.matcher = matcher
+        self.found: Set[int] = set()
+        self._state = 0
+        self._tail = ""
+
+    def feed(self, chunk: str) -> List[Pattern]:
+        """Ajoute un morceau ; renvoie les motifs trouvés pour la première fois."""
+        before = set(self.found)
+        folded = fold(chunk)
+        self._state = self.matcher._step(self._state, folded, self.found)
+        if self.matcher._regexes:
+            window = self._tail + folded
+            self.matcher._regex_scan(window, self.found)
+            self._tail = window[-REGEX_TAIL:]
+        return [self.matcher.patterns[i] for i in sorted(self.found - before)]
+
+    def result(self) -> ScanResult:
+        return ScanResult.of(self.matcher, self.found)
+
+
+_LOCK = threading.Lock()
+_CURRENT: Optional[Matcher] = None
+_MTIME: Optional[float] = None
+_CHECKED = 0.0
+
+
+def matcher() -> Matcher:
+    """Matcher courant, recompilé si le fichier de motifs a changé."""
+    global _CURRENT, _MTIME, _CHECKED
+    now = time.monotonic()
+    cur = _CURRENT
+    if cur is not None and now - _CHECKED < RELOAD_SECS:
+        return cur
+    with _LOCK:
+        _CHECKED = now
+        try:
+            mtime: Optional[float] = DENYLIST_PATH.stat().st_mtime
+        except OSError:
+            mtime = None
+        if _CURRENT is None or mtime != _MTIME:
+            try:
+                if mtime is None:
+                    _CURRENT = Matcher([Pattern(p) for p in FORBIDDEN])
+                else:
+                    _CURRENT = Matcher.from_file(DENYLIST_PATH)
+            except (OSError, ValueError, re.error):
+                if _CURRENT is None:
+                    raise
+                # fichier invalide (édition en cours ?) : on garde l'ancien
+            _MTIME = mtime
+        return _CURRENT
+
+
+def reload() -> Matcher:
+    """Force la relecture du fichier de motifs."""
+    global _CURRENT
+    with _LOCK:
+        _CURRENT = None
+    return matcher()
+
+
+@timed("agent.securite")
 def review_answer(draft: Dict) -> Dict:
-    risk = 0.0
-    for kw in FORBIDDEN:
-        if kw in draft["answer"]:
-            risk = 1.0
-            break
-    draft["risk"] = risk
+    res = matcher().scan(draft["answer"])
+    draft["risk"] = res.risk
+    draft["risk_matches"] = [p.text for p in res.matches]
     return draft
+
+
+@timed("agent.securite")
+def review_sources(query: str, sources: List[Dict]) -> Dict:
+    """Risque de la question et des snippets retrouvés (un seul passage)."""
+    text = "\n".join([query] + [s.get("snippet", "") for s in sources])
+    res = matcher().scan(text)
+    return {"risk": res.risk, "risk_matches": [p.text for p in res.matches]}
@@ -1,37 +1,136 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import os
 import time
-from typing import Dict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
 
 from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 
-from apps.server.middleware.trace import TraceMiddleware
+from apps.server.middleware.trace import TraceMiddleware, render_metrics
+from apps.server.routers.jobs import router as jobs_router
 from apps.server.routers.parliament import router as parliament_router
 from apps.server.routers.rag import router as rag_router
+from apps.server.utils import hybrid
+from apps.server.utils.cache import RESULTS
+from apps.server.utils.indexer import INDEX
+from apps.server.utils.spans import span
+from apps.server.utils.tokens import VOCAB
+from apps.server.utils.vector_index import VSTORE
+
+log = logging.getLogger("uvicorn.error")
+
+# préchargement des index au démarrage (0 : chargement paresseux)
+WARMUP = os.getenv("LOUMINA_WARMUP", "1") != "0"
+WARMUP_QUERIES = 4
+_WARMUP: Dict[str, Any] = {"state": "idle"}
 
 
 def _now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%S%z", time.gmtime())
 
 
+class _TimedORJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        with span("serialize"):
+            return super().render(content)
+
+
+def warmup() -> Dict[str, Any]:
+    """Charge INDEX et VSTORE puis lance quelques requêtes (pages mmap chaudes).
+
+    Les requêtes sont des termes du vocabulaire ; elles ne passent pas par
+    le cache de résultats.
+    """
+    t0 = time.perf_counter()
+    bm25 = INDEX.ensure_loaded()
+    dense = VSTORE.ensure_loaded()
+    load_secs = time.perf_counter() - t0
+    words = VOCAB.words()
+    queries: List[str] = words[:: max(1, len(words) // WARMUP_QUERIES)][:WARMUP_QUERIES]
+    if queries:
+        INDEX.search_rerank_batch(queries, 5)
+        hybrid.candidates(queries, 10)
+    return {
+        "bm25": bm25,
+        "dense": dense,
+        "load_secs": round(load_secs, 3),
+        "warmup_secs": round(time.perf_counter() - t0 - load_secs, 3),
+        "queries": len(queries),
+    }
+
+
+async def _warm() -> None:
+    _WARMUP["state"] = "warming"
+    try:
+        stats = await asyncio.to_thread(warmup)
+    except Exception:
+        _WARMUP["state"] = "failed"
+        log.exception("warm-up des index en échec (chargement à la demande)")
+    else:
+        _WARMUP.update(stats, state="ready")
+        log.info(
+            "index chargés en %.3f s (bm25=%s, dense=%s), warm-up %.3f s",
+            stats["load_secs"],
+            stats["bm25"],
+            stats["dense"],
+            stats["warmup_secs"],
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warm-up en tâche de fond : le serveur accepte les connexions tout de
+    # suite et /healthz répond 503 jusqu'à ce que les index soient chauds
+    task = asyncio.create_task(_warm()) if WARMUP else None
+    yield
+    if task is not None:
+        task.cancel()
+
+
 app = FastAPI(
-    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+    default_response_class=_TimedORJSONResponse,
     title="Loumina API",
     version="0.1.0-alpha",
 )
 
-# 🔔 active le middleware de traces (p50/p95)
+# 🔔 active le middleware de traces (p50/p95/p99, /metrics)
 app.add_middleware(TraceMiddleware)
 
 # Routers
 app.include_router(rag_router)
 app.include_router(parliament_router)
+app.include_router(jobs_router)
 
 
 @app.get("/healthz")
-def healthz() -> Dict[str, str]:
-    return {"status": "ok", "ts": _now_iso()}
+def healthz():
+    """Prêt (200) sauf pendant le warm-up de démarrage (503, cf. `lifespan`)."""
+    if _WARMUP["state"] == "warming":
+        return JSONResponse({"status": "starting", "ts": _now_iso()}, status_code=503)
+    return {"status": "ok", "ts": _now_iso(), "warmup": _WARMUP}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Métriques au format texte Prometheus (latences, débit, cache)."""
+    cache = RESULTS.stats()
+    lines = [render_metrics()]
+    for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        lines.append(
+            f"# TYPE loumina_cache_{name}_total counter\n"
+            f"loumina_cache_{name}_total {cache[name]}\n"
+        )
+    lines.append(
+        f"# TYPE loumina_cache_entries gauge\nloumina_cache_entries {cache['size']}\n"
+    )
+    return PlainTextResponse(
+        "".join(lines), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 if __name__ == "__main__":
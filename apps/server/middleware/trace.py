@@ -1,108 +1,347 @@
+"""Middleware ASGI de traces : logs JSON hors boucle + latences par sketch.
+
+Le middleware n'écrit rien lui-même : chaque requête pousse un dict dans
+une file bornée, vidée par lots par un thread d'écriture (une seule
+écriture + flush par lot). Les latences alimentent des sketchs de quantiles
+à mémoire fixe (histogramme log-linéaire façon HDR), par route et classe de
+statut, exposés au format texte Prometheus par `render_metrics`. Les durées
+par étape (cf. `apps.server.utils.spans`) vont dans le log, dans l'en-tête
+`Server-Timing` et dans un sketch par étape.
+"""
+
+import atexit
+import math
+import os
+import queue
+import sys
+import threading
 import time
 import uuid
+from typing import Dict, List, Optional, Tuple
+
 import orjson
-import sys
-import os
-from typing import Callable
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
-from collections import deque
+
+from apps.server.utils import spans
 
 
 def _now_iso():
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
 
-class _LatencyStats:
-    def __init__(self, window: int = 200, every: int = 10):
+# --------- écriture des logs hors boucle d'événements ---------
+
+
+class _LogWriter:
+    """File bornée vidée par un thread démon ; au-delà de `maxsize`, on jette."""
+
+    def __init__(self, maxsize: int = 4096, batch: int = 256, stream=None):
+        self.batch = batch
+        self.stream = stream
+        self.dropped = 0
+        self._q: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="trace-writer", daemon=True
+                    )
+                    self._thread.start()
+
+    def put(self, record: dict) -> None:
+        self._ensure_started()
+        try:
+            self._q.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            rec = self._q.get()
+            recs = [rec]
+            while len(recs) < self.batch:
+                try:
+                    recs.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [orjson.dumps(r) + b"\n" for r in recs if r is not None]
+            if lines:
+                out = self.stream or sys.stdout
+                out.write(b"".join(lines).decode())
+                out.flush()
+            for _ in recs:
+                self._q.task_done()
+            if any(r is None for r in recs):
+                return
+
+    def flush(self) -> None:
+        """Attend que tous les records en file soient écrits."""
+        if self._thread is not None:
+            self._q.join()
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout=2.0)
+
+
+_WRITER = _LogWriter(maxsize=int(os.getenv("LOUMINA_LOG_QUEUE", "4096")))
+atexit.register(_WRITER.close)
+
+
+# --------- sketch de quantiles ---------
+
+
+class LatencySketch:
+    """Histogramme log-linéaire : erreur relative <= `precision` / 2.
+
+    Mémoire fixe (un compteur par bucket entre `lo_ms` et `hi_ms`), ajout en
+    O(1), quantile en O(nombre de buckets). Les valeurs hors bornes sont
+    rabattues sur le premier / dernier bucket.
+    """
+
+    __slots__ = ("lo", "log_gamma", "counts", "count", "sum")
+
+    def __init__(
+        self, lo_ms: float = 0.01, hi_ms: float = 60_000.0, precision: float = 0.02
+    ):
+        self.lo = lo_ms
+        self.log_gamma = math.log1p(precision)
+        n = int(math.ceil(math.log(hi_ms / lo_ms) / self.log_gamma)) + 1
+        self.counts: List[int] = [0] * n
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, ms: float) -> None:
+        i = int(math.log(ms / self.lo) / self.log_gamma) if ms > self.lo else 0
+        self.counts[min(i, len(self.counts) - 1)] += 1
+        self.count += 1
+        self.sum += ms
+
+    def merge(self, other: "LatencySketch") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen > rank:
+                # milieu géométrique du bucket [lo*g^i, lo*g^(i+1))
+                return self.lo * math.exp((i + 0.5) * self.log_gamma)
+        return self.lo * math.exp((len(self.counts) - 0.5) * self.log_gamma)
+
+
+class _Windowed:
+    """Deux sketchs tournants : quantiles sur les ~`window` dernières requêtes."""
+
+    def __init__(self, window: int):
         self.window = window
+        self.cur = LatencySketch()
+        self.prev = LatencySketch()
+
+    def add(self, ms: float) -> None:
+        if self.cur.count >= self.window:
+            self.prev, self.cur = self.cur, LatencySketch()
+        self.cur.add(ms)
+
+    def snapshot(self) -> LatencySketch:
+        s = LatencySketch()
+        s.merge(self.prev)
+        s.merge(self.cur)
+        return s
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Metrics:
+    def __init__(self, window: int = 200, every: int = 10):
         self.every = every
-        self.buf = deque(maxlen=window)
+        self.started = time.time()
+        self.recent = _Windowed(window)
+        # (route, classe de statut) -> sketch cumulatif
+        self.latency: Dict[Tuple[str, str], LatencySketch] = {}
+        # (méthode, route, statut) -> nombre de requêtes
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        # étape (bm25, hnsw, fusion...) -> sketch cumulatif
+        self.stages: Dict[str, LatencySketch] = {}
         self.n = 0
 
-    def add(self, ms: float):
-        self.buf.append(ms)
+    def observe(self, method: str, route: str, status: int, ms: float) -> None:
+        key = (route, f"{status // 100}xx")
+        sk = self.latency.get(key)
+        if sk is None:
+            sk = self.latency[key] = LatencySketch()
+        sk.add(ms)
+        rk = (method, route, status)
+        self.requests[rk] = self.requests.get(rk, 0) + 1
+        self.recent.add(ms)
         self.n += 1
-        if self.n % self.every == 0 and self.buf:
-            arr = sorted(self.buf)
-
-            def pct(p):
-                if len(arr) == 1:
-                    return arr[0]
-                i = max(0, min(len(arr) - 1, int(round(p * (len(arr) - 1)))))
-                return arr[i]
-
-            p50 = pct(0.50)
-            p95 = pct(0.95)
-            sys.stdout.write(
-                orjson.dumps(
-                    {
-                        "ts": _now_iso(),
-                        "lvl": "info",
-                        "type": "metrics",
-                        "window": self.window,
-                        "count": len(arr),
-                        "p50_ms": round(p50, 2),
-                        "p95_ms": round(p95, 2),
-                    }
-                ).decode()
-                + "\n"
+        if self.n % self.every == 0:
+            snap = self.recent.snapshot()
+            _WRITER.put(
+                {
+                    "ts": _now_iso(),
+                    "lvl": "info",
+                    "type": "metrics",
+                    "window": self.recent.window,
+                    "count": snap.count,
+                    "p50_ms": round(snap.quantile(0.50), 2),
+                    "p95_ms": round(snap.quantile(0.95), 2),
+                    "p99_ms": round(snap.quantile(0.99), 2),
+                }
             )
-            sys.stdout.flush()
 
+    def observe_stages(self, stages: Dict[str, float]) -> None:
+        for name, ms in stages.items():
+            sk = self.stages.get(name)
+            if sk is None:
+                sk = self.stages[name] = LatencySketch()
+            sk.add(ms)
 
-_LAT = _LatencyStats(
+    def render(self) -> str:
+        """Exposition texte Prometheus (version 0.0.4)."""
+        lines = [
+            "# HELP loumina_http_request_duration_ms Latence HTTP (ms).",
+            "# TYPE loumina_http_request_duration_ms summary",
+        ]
+        for (route, cls), sk in sorted(self.latency.items()):
+            labels = f'route="{route}",status_class="{cls}"'
+            for q in QUANTILES:
+                lines.append(
+                    f'loumina_http_request_duration_ms{{{labels},quantile="{q}"}} '
+                    f"{sk.quantile(q):.3f}"
+                )
+            lines.append(
+                f"loumina_http_request_duration_ms_sum{{{labels}}} {sk.sum:.3f}"
+            )
+            lines.append(
+                f"loumina_http_request_duration_ms_count{{{labels}}} {sk.count}"
+            )
+        lines += [
+            "# HELP loumina_stage_duration_ms Durée par étape de recherche (ms).",
+            "# TYPE loumina_stage_duration_ms summary",
+        ]
+        for name, sk in sorted(self.stages.items()):
+            for q in QUANTILES:
+                lines.append(
+                    f'loumina_stage_duration_ms{{stage="{name}",quantile="{q}"}} '
+                    f"{sk.quantile(q):.3f}"
+                )
+            lines.append(
+                f'loumina_stage_duration_ms_sum{{stage="{name}"}} {sk.sum:.3f}'
+            )
+            lines.append(
+                f'loumina_stage_duration_ms_count{{stage="{name}"}} {sk.count}'
+            )
+        lines += [
+            "# HELP loumina_http_requests_total Requêtes HTTP servies.",
+            "# TYPE loumina_http_requests_total counter",
+        ]
+        for (method, route, status), n in sorted(self.requests.items()):
+            lines.append(
+                f'loumina_http_requests_total{{method="{method}",route="{route}",'
+                f'status="{status}"}} {n}'
+            )
+        lines += [
+            "# HELP loumina_trace_log_dropped_total Logs jetés (file pleine).",
+            "# TYPE loumina_trace_log_dropped_total counter",
+            f"loumina_trace_log_dropped_total {_WRITER.dropped}",
+            "# HELP loumina_process_start_time_seconds Démarrage du process (epoch).",
+            "# TYPE loumina_process_start_time_seconds gauge",
+            f"loumina_process_start_time_seconds {self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = _Metrics(
     window=int(os.getenv("LOUMINA_METRICS_WINDOW", "200")),
     every=int(os.getenv("LOUMINA_METRICS_EVERY", "10")),
 )
 
 
-class TraceMiddleware(BaseHTTPMiddleware):
+def render_metrics() -> str:
+    return METRICS.render()
+
+
+# --------- middleware ---------
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for k, v in scope.get("headers", ()):
+        if k == name:
+            return v.decode("latin-1")
+    return None
+
+
+class TraceMiddleware:
+    """Middleware ASGI pur (pas de BaseHTTPMiddleware : ni tâche ni flux en plus)."""
+
     def __init__(self, app):
-        super().__init__(app)
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         t0 = time.perf_counter()
-        trace_id = request.headers.get("x-trace-id") or uuid.uuid4().hex
-        request.state.trace_id = trace_id
+        trace_id = _header(scope, b"x-trace-id") or uuid.uuid4().hex
+        scope.setdefault("state", {})["trace_id"] = trace_id
+        status = 500
+        raw_id = trace_id.encode("latin-1")
+        rec, token = spans.begin(trace_id)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-trace-id", raw_id))
+                if rec is not None and rec.stages:
+                    timing = rec.server_timing()
+                    headers.append((b"server-timing", timing.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        err = None
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception as exc:
+            err = exc
+            status = 500
+            raise
+        finally:
+            spans.end(token)
             dt = (time.perf_counter() - t0) * 1000.0
+            route = scope.get("route")
+            # gabarit de route (cardinalité bornée), pas le chemin brut
+            route_path = getattr(route, "path", None) or "<unmatched>"
+            METRICS.observe(scope["method"], route_path, status, dt)
             log = {
                 "ts": _now_iso(),
-                "lvl": "error",
+                "lvl": "error" if err is not None else "info",
                 "type": "http",
                 "trace_id": trace_id,
-                "method": request.method,
-                "path": request.url.path,
-                "status": 500,
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status,
                 "ms": round(dt, 2),
-                "err": repr(exc),
             }
-            sys.stdout.write(orjson.dumps(log).decode() + "\n")
-            sys.stdout.flush()
-            raise
-
-        dt = (time.perf_counter() - t0) * 1000.0
-        response.headers["X-Trace-Id"] = trace_id
-        _LAT.add(dt)
-
-        client = request.client.host if request.client else None
-        ua = request.headers.get("user-agent")
-        log = {
-            "ts": _now_iso(),
-            "lvl": "info",
-            "type": "http",
-            "trace_id": trace_id,
-            "method": request.method,
-            "path": request.url.path,
-            "status": response.status_code,
-            "ms": round(dt, 2),
-            "ip": client,
-            "ua": ua,
-        }
-        sys.stdout.write(orjson.dumps(log).decode() + "\n")
-        sys.stdout.flush()
-        return response
+            if rec is not None and rec.stages:
+                METRICS.observe_stages(rec.stages)
+                log["stages"] = {k: round(v, 3) for k, v in rec.stages.items()}
+            if err is not None:
+                log["err"] = repr(err)
+            else:
+                client = scope.get("client")
+                log["ip"] = client[0] if client else None
+                log["ua"] = _header(scope, b"user-agent")
+            _WRITER.put(log)
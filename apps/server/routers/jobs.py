@@ -0,0 +1,31 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from typing import Any, Dict
+
+from apps.server.utils.jobs import JOBS
+
+router = APIRouter()
+
+
+def _unknown(job_id: str) -> JSONResponse:
+    return JSONResponse({"ok": False, "error": f"job inconnu: {job_id}"}, 404)
+
+
+@router.get("/jobs")
+def list_jobs() -> Dict[str, Any]:
+    """Jobs d'ingestion connus (en file, en cours, terminés récemment)."""
+    return {"jobs": [job.info() for job in JOBS.list()]}
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """Statut et progression d'un job (fichiers, octets, débit, ETA)."""
+    job = JOBS.get(job_id)
+    return _unknown(job_id) if job is None else job.info()
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """Annule un job en file, ou l'arrête avant sa publication s'il tourne."""
+    job = JOBS.cancel(job_id)
+    return _unknown(job_id) if job is None else job.info()
@@ -1,33 +1,54 @@
 from fastapi import APIRouter
-from pydantic import BaseModel
+from pydantic import Field
 from typing import Dict, Any, Optional
 import uuid
 import os
-from agents.archiviste import propose_sources
+from agents import parliament
+from apps.server.routers.rag import Filtered
 
 router = APIRouter()
 
 
-class AskReq(BaseModel):
+class AskReq(Filtered):
     query: str
     mode: Optional[str] = "answer"
-    max_cost: Optional[float] = None
+    max_cost: Optional[float] = None  # budget (cf. parliament.AGENT_COSTS)
     k: int = 5
     alpha: float = 0.6
     half_life_days: float = float(os.getenv("LOUMINA_FRESHNESS_HALFLIFE", "30"))
+    deadline_ms: float = Field(parliament.DEADLINE_MS, gt=0)
 
 
 @router.post("/parliament/ask")
-def ask(req: AskReq) -> Dict[str, Any]:
+async def ask(req: AskReq) -> Dict[str, Any]:
     trace_id = str(uuid.uuid4())
-    sources = propose_sources(
-        req.query, k=req.k, alpha=req.alpha, half_life_days=req.half_life_days
+    tasks = parliament.agents(
+        req.query,
+        k=req.k,
+        alpha=req.alpha,
+        half_life_days=req.half_life_days,
+        flt=req.doc_filter(),
     )
-    votes = [{"agent": "Archiviste", "score": s["scores"]["final"]} for s in sources]
+    results, votes = await parliament.run(tasks, req.deadline_ms, req.max_cost)
+    sources = results.get("Archiviste", [])
+    for v in votes:
+        if v["agent"] == "Archiviste" and v["status"] == "ok":
+            v["scores"] = [s["scores"]["final"] for s in sources]
+    draft = results.get("Analyste")
+    # relectures des sources et du brouillon : le risque le plus élevé l'emporte
+    reviews = [results[n] for n in ("Securite", "SecuriteReponse") if n in results]
+    risk = max((r["risk"] for r in reviews), default=None)
+    risk_matches = list(dict.fromkeys(m for r in reviews for m in r["risk_matches"]))
     return {
         "trace_id": trace_id,
-        "answer": f"Propositions (hybride, alpha={req.alpha}, t½={req.half_life_days} j).",
+        "answer": (
+            draft["answer"]
+            if draft
+            else f"Propositions (hybride, alpha={req.alpha}, t½={req.half_life_days} j)."
+        ),
         "sources": sources,
         "votes": votes,
+        "risk": risk,
+        "risk_matches": risk_matches,
         "audit_trace_id": trace_id,
     }
@@ -1,13 +1,18 @@
 from fastapi import APIRouter
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from pydantic import BaseModel, Field
+from typing import Dict, Any, List, Literal, Optional
 import uuid
 import pathlib
 import os
 
+from apps.server.utils import hybrid
+from apps.server.utils.cache import RESULTS, normalize
+from apps.server.utils.filters import DocFilter
+from apps.server.utils.hybrid import RRF_K, Fusion
 from apps.server.utils.indexer import INDEX, rebuild
-from apps.server.utils.rerank import rerank_cosine
+from apps.server.utils.jobs import JOBS
 from apps.server.utils.vector_index import VSTORE
+from rag.pipelines.ingest import ingest_all
 
 router = APIRouter()
 
@@ -19,32 +24,60 @@ ALLOWED_EXTS = set(os.getenv("LOUMINA_EXTS", ".md,.txt,.py").split(","))
 class IngestReq(BaseModel):
     exts: Optional[List[str]] = None
     path: Optional[str] = None  # ex: "/data"
+    full: bool = False  # ignore le manifeste et relit tout
 
 
-class Query(BaseModel):
+class Filtered(BaseModel):
+    """Filtres appliqués dans les index, avant la sélection du top-k."""
+
+    path_prefix: Optional[str] = None  # dossier relatif à la racine, ex. "docs"
+    exts: Optional[List[str]] = None  # ex. [".md", ".py"]
+    min_mtime: Optional[float] = None  # epoch secondes
+    max_mtime: Optional[float] = None
+
+    def doc_filter(self) -> Optional[DocFilter]:
+        return DocFilter.of(self.path_prefix, self.exts, self.min_mtime, self.max_mtime)
+
+
+class Query(Filtered):
     query: str
     k: int = 5
 
 
-@router.post("/ingest")
+def _submit(kind: str, root: pathlib.Path, allowed: set, opts: Dict[str, Any], fn):
+    """Met l'ingest en file (cf. utils.jobs) ; stats dans le résultat du job."""
+    params = {"root": str(root), "exts": sorted(allowed), **opts}
+    job = JOBS.submit(kind, params, fn)
+    return {"ok": True, "root": str(root), "exts": sorted(allowed), "job": job.info()}
+
+
+@router.post("/ingest", status_code=202)
 def rag_ingest(req: IngestReq) -> Dict[str, Any]:
     root = pathlib.Path(req.path).resolve() if req.path else DEFAULT_ROOT
     allowed = set(req.exts) if req.exts else ALLOWED_EXTS
-    stats = rebuild(root, allowed)
-    return {"ok": True, "root": str(root), "exts": list(allowed), "stats": stats}
+    return _submit(
+        "ingest",
+        root,
+        allowed,
+        {"full": req.full},
+        lambda progress: rebuild(root, allowed, full=req.full, progress=progress),
+    )
 
 
 @router.post("/query")
 def rag_query(body: Query) -> Dict[str, Any]:
     trace_id = str(uuid.uuid4())
-    hits = INDEX.search(body.query, body.k)
-    if not hits:
+    flt = body.doc_filter()
+    reranked = RESULTS.get_or_compute(
+        ("bm25", normalize(body.query), body.k, flt),
+        lambda: INDEX.search_rerank(body.query, body.k, alpha=0.6, flt=flt),
+    )
+    if not reranked:
         return {
             "trace_id": trace_id,
             "answer": "Index vide. Lance /ingest d'abord.",
             "sources": [],
         }
-    reranked = rerank_cosine(body.query, hits, alpha=0.6)
     answer = f"Top {len(reranked)} sources locales pour: “{body.query}”."
     return {"trace_id": trace_id, "answer": answer, "sources": reranked}
 
@@ -56,17 +89,46 @@ class IngestDenseReq(BaseModel):
     exts: Optional[List[str]] = None
     path: Optional[str] = None
     max_vocab: int = 4096
+    full: bool = False
+    # "bow" : sac de mots sur max_vocab termes ; "hash" : hashing + projection
+    # aléatoire creuse sur `dim` dimensions (128–256 recommandé)
+    embedding: Literal["bow", "hash"] = "bow"
+    dim: int = Field(256, ge=8, le=4096)
+    recall_queries: int = 0  # >0 : mesure recall@10 vs cosinus BoW exact
+    # cible de recall@k pour le réglage de ef (défaut : LOUMINA_HNSW_RECALL)
+    recall_target: Optional[float] = Field(None, gt=0.0, le=1.0)
 
 
-@router.post("/ingest_dense")
+@router.post("/ingest_dense", status_code=202)
 def ingest_dense(req: IngestDenseReq) -> Dict[str, Any]:
     root = pathlib.Path(req.path).resolve() if req.path else DEFAULT_ROOT
     allowed = set(req.exts) if req.exts else ALLOWED_EXTS
-    stats = VSTORE.build(root, allowed, max_vocab=req.max_vocab)
-    return {"ok": True, "root": str(root), "stats": stats}
+    opts = req.model_dump(exclude={"path", "exts"})
+    return _submit(
+        "ingest_dense",
+        root,
+        allowed,
+        opts,
+        lambda progress: VSTORE.build(root, allowed, progress=progress, **opts),
+    )
 
 
-class DenseQuery(BaseModel):
+@router.post("/ingest_all", status_code=202)
+def rag_ingest_all(req: IngestDenseReq) -> Dict[str, Any]:
+    """Ingest unifié : une seule lecture du corpus pour BM25 + dense."""
+    root = pathlib.Path(req.path).resolve() if req.path else DEFAULT_ROOT
+    allowed = set(req.exts) if req.exts else ALLOWED_EXTS
+    opts = req.model_dump(exclude={"path", "exts"})
+    return _submit(
+        "ingest_all",
+        root,
+        allowed,
+        opts,
+        lambda progress: ingest_all(root, allowed, progress=progress, **opts),
+    )
+
+
+class DenseQuery(Filtered):
     query: str
     k: int = 5
 
@@ -74,7 +136,11 @@ class DenseQuery(BaseModel):
 @router.post("/query_dense")
 def query_dense(body: DenseQuery) -> Dict[str, Any]:
     trace_id = str(uuid.uuid4())
-    hits = VSTORE.search(body.query, body.k)
+    flt = body.doc_filter()
+    hits = RESULTS.get_or_compute(
+        ("dense", normalize(body.query), body.k, flt),
+        lambda: VSTORE.search(body.query, body.k, flt),
+    )
     if not hits:
         return {
             "trace_id": trace_id,
@@ -91,72 +157,107 @@ def query_dense(body: DenseQuery) -> Dict[str, Any]:
 # --------- Hybride (BM25 + Dense + fraîcheur) ---------
 
 
-class HybridQuery(BaseModel):
+class HybridQuery(Filtered):
     query: str
     k: int = 5
-    alpha: float = 0.6  # poids BM25_n
+    alpha: float = 0.6  # poids BM25_n (ou de la jambe BM25 en RRF)
     half_life_days: float = float(os.getenv("LOUMINA_FRESHNESS_HALFLIFE", "30"))
+    fusion: Fusion = "weighted"  # "rrf" : Reciprocal Rank Fusion
+    rrf_k: int = Field(RRF_K, ge=1)
 
 
 @router.post("/query_hybrid")
 def query_hybrid(body: HybridQuery) -> Dict[str, Any]:
     trace_id = str(uuid.uuid4())
-    kx = max(10, body.k * 2)
-
-    bm_hits = INDEX.search(body.query, kx) or []
-    dn_hits = VSTORE.search(body.query, kx) or []
-
-    if not bm_hits and not dn_hits:
+    out = hybrid.search(
+        body.query,
+        body.k,
+        alpha=body.alpha,
+        half_life_days=body.half_life_days,
+        fusion=body.fusion,
+        rrf_k=body.rrf_k,
+        flt=body.doc_filter(),
+    )
+    if not out:
         return {
             "trace_id": trace_id,
             "answer": "Index(s) vide(s). Lance /ingest et/ou /ingest_dense.",
             "sources": [],
         }
 
-    bm_by = {h["doc"]: h for h in bm_hits}
-    dn_by = {h["doc"]: h for h in dn_hits}
-    docs = set(bm_by) | set(dn_by)
-
-    max_bm = max((h.get("score", 0.0) for h in bm_hits), default=1.0) or 1.0
-
-    out: List[Dict[str, Any]] = []
-    for doc in docs:
-        bm = bm_by.get(doc, {})
-        dn = dn_by.get(doc, {})
-
-        bm25_raw = float(bm.get("score", 0.0))
-        bm25_n = bm25_raw / max_bm if max_bm else 0.0
-        dense = float(dn.get("score", 0.0))
-
-        # fraîcheur (demi-vie) : on prend l'âge (jours) le plus informatif
-        age_b = float(bm.get("age_days", 1e9))
-        age_d = float(dn.get("age_days", 1e9))
-        age = min(age_b, age_d)
-        if age == 1e9:
-            age = float(bm.get("age_days", dn.get("age_days", 0.0)))
-
-        decay = pow(0.5, (age / max(1e-6, body.half_life_days)))
-        final = (body.alpha * bm25_n + (1.0 - body.alpha) * dense) * decay
-
-        snippet = bm.get("snippet") or dn.get("snippet") or ""
-        out.append(
-            {
-                "doc": doc,
-                "snippet": snippet,
-                "scores": {
-                    "bm25": bm25_raw,
-                    "bm25_n": bm25_n,
-                    "dense": dense,
-                    "decay": decay,
-                    "final": final,
-                },
-            }
-        )
-
-    out.sort(key=lambda x: x["scores"]["final"], reverse=True)
-    out = out[: body.k]
-
     answer = (
         f"Hybride: top {len(out)} (alpha={body.alpha}, t½={body.half_life_days} j)."
     )
     return {"trace_id": trace_id, "answer": answer, "sources": out}
+
+
+# --------- Lots de requêtes ---------
+
+QUERY_BATCH_MAX = int(os.getenv("LOUMINA_QUERY_BATCH_MAX", "1000"))
+
+
+class BatchQuery(Filtered):
+    queries: List[str] = Field(..., min_length=1, max_length=QUERY_BATCH_MAX)
+    k: int = 5
+
+
+class HybridBatchQuery(BatchQuery):
+    alpha: float = 0.6
+    half_life_days: float = float(os.getenv("LOUMINA_FRESHNESS_HALFLIFE", "30"))
+    fusion: Fusion = "weighted"
+    rrf_k: int = Field(RRF_K, ge=1)
+
+
+def _batch_response(queries: List[str], results: List[List[Dict]]) -> Dict[str, Any]:
+    return {
+        "trace_id": str(uuid.uuid4()),
+        "results": [{"query": q, "sources": r} for q, r in zip(queries, results)],
+    }
+
+
+@router.post("/query_batch")
+def query_batch(body: BatchQuery) -> Dict[str, Any]:
+    """BM25 + rerank pour un lot : postings partagés, un seul passage de scoring."""
+    qs = body.queries
+    flt = body.doc_filter()
+
+    def compute(positions: List[int]) -> List[List[Dict]]:
+        return INDEX.search_rerank_batch(
+            [qs[p] for p in positions], body.k, alpha=0.6, flt=flt
+        )
+
+    keys = [("bm25", normalize(q), body.k, flt) for q in qs]
+    return _batch_response(qs, RESULTS.get_or_compute_many(keys, compute))
+
+
+@router.post("/query_dense_batch")
+def query_dense_batch(body: BatchQuery) -> Dict[str, Any]:
+    """Dense pour un lot : une matrice de requêtes, un seul knn_query multi-thread."""
+    qs = body.queries
+    flt = body.doc_filter()
+    keys = [("dense", normalize(q), body.k, flt) for q in qs]
+    results = RESULTS.get_or_compute_many(
+        keys,
+        lambda positions: VSTORE.search_batch([qs[p] for p in positions], body.k, flt),
+    )
+    return _batch_response(qs, results)
+
+
+@router.post("/query_hybrid_batch")
+def query_hybrid_batch(body: HybridBatchQuery) -> Dict[str, Any]:
+    results = hybrid.search_batch(
+        body.queries,
+        body.k,
+        alpha=body.alpha,
+        half_life_days=body.half_life_days,
+        fusion=body.fusion,
+        rrf_k=body.rrf_k,
+        flt=body.doc_filter(),
+    )
+    return _batch_response(body.queries, results)
+
+
+@router.get("/cache_stats")
+def cache_stats() -> Dict[str, Any]:
+    """Compteurs du cache de résultats (hits, misses, évictions, invalidations)."""
+    return RESULTS.stats()
@@ -0,0 +1,182 @@
+"""Cache LRU/TTL des résultats de recherche, invalidé par génération d'index.
+
+Les clés portent la requête normalisée (tokens) et les paramètres de la
+recherche ; toute publication de INDEX ou VSTORE (nouvelle génération) vide
+le cache. La fraîcheur est recalculée à chaque hit : `age_days` avance du
+temps écoulé depuis la mise en cache et, pour les résultats hybrides, la
+décroissance (et donc le score final) est ré-appliquée.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+import os
+import threading
+import time
+
+from apps.server.utils.generation import Generational
+from apps.server.utils.indexer import INDEX
+from apps.server.utils.tokens import tokenize
+from apps.server.utils.vector_index import VSTORE
+
+CACHE_SIZE = int(os.getenv("LOUMINA_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("LOUMINA_CACHE_TTL", "300"))
+
+
+def normalize(query: str) -> str:
+    """Forme canonique d'une requête : seuls les tokens influent sur la recherche."""
+    return " ".join(tokenize(query))
+
+
+def age_hits(
+    hits: List[Dict], elapsed: float, half_life_days: Optional[float] = None
+) -> List[Dict]:
+    """Copie des hits vieillis de `elapsed` secondes.
+
+    L'âge de tous les docs avance du même delta : la décroissance est
+    multipliée par un facteur commun, ce qui préserve le classement.
+    """
+    days = max(0.0, elapsed) / 86400.0
+    factor = None
+    if half_life_days is not None:
+        factor = pow(0.5, days / max(1e-6, half_life_days))
+    out: List[Dict] = []
+    for h in hits:
+        hh = dict(h)
+        if "age_days" in hh:
+            hh["age_days"] = hh["age_days"] + days
+        if factor is not None and "scores" in hh:
+            sc = dict(hh["scores"])
+            sc["decay"] *= factor
+            sc["final"] *= factor
+            hh["scores"] = sc
+        out.append(hh)
+    return out
+
+
+@dataclass
+class _Entry:
+    value: List[Dict]
+    stored_at: float  # epoch seconds
+
+
+class ResultCache:
+    """LRU borné (`maxsize` entrées) avec TTL ; `maxsize <= 0` le désactive."""
+
+    def __init__(
+        self,
+        *stores: Generational,
+        maxsize: int = CACHE_SIZE,
+        ttl: float = CACHE_TTL,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._stores = stores
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._seen: Tuple[int, ...] = ()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _gens(self) -> Tuple[int, ...]:
+        return tuple(s.generation for s in self._stores)
+
+    def _sync(self, gens: Tuple[int, ...]) -> None:
+        # appelé sous self._lock
+        if gens != self._seen:
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._seen = gens
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], List[Dict]],
+        half_life_days: Optional[float] = None,
+    ) -> List[Dict]:
+        """Résultat en cache (vieilli) ou `compute()` mis en cache."""
+        return self.get_or_compute_many([key], lambda _: [compute()], half_life_days)[0]
+
+    def get_or_compute_many(
+        self,
+        keys: Sequence[Hashable],
+        compute: Callable[[List[int]], List[List[Dict]]],
+        half_life_days: Optional[float] = None,
+    ) -> List[List[Dict]]:
+        """Version lot : `compute(positions)` ne reçoit que les clés absentes.
+
+        Les clés répétées dans le lot ne sont calculées qu'une fois. Les
+        résultats calculés ne sont stockés que si aucune génération n'a été
+        publiée pendant le calcul.
+        """
+        if self.maxsize <= 0:
+            return compute(list(range(len(keys))))
+        gens = self._gens()
+        now = time.time()
+        out: List[Optional[List[Dict]]] = [None] * len(keys)
+        missing: Dict[Hashable, List[int]] = {}
+        with self._lock:
+            self._sync(gens)
+            for pos, key in enumerate(keys):
+                if key in missing:
+                    missing[key].append(pos)
+                    continue
+                entry = self._data.get(key)
+                if entry is not None and now - entry.stored_at > self.ttl:
+                    del self._data[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is not None:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    out[pos] = age_hits(
+                        entry.value, now - entry.stored_at, half_life_days
+                    )
+                else:
+                    self.misses += 1
+                    missing[key] = [pos]
+        if not missing:
+            return out  # type: ignore[return-value]
+
+        values = compute([group[0] for group in missing.values()])
+        for group, value in zip(missing.values(), values):
+            for pos in group:
+                out[pos] = value
+        if self._gens() == gens:
+            with self._lock:
+                self._sync(gens)
+                for key, value in zip(missing, values):
+                    self._data[key] = _Entry(value, now)
+                    self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return out  # type: ignore[return-value]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "generations": list(self._seen),
+            }
+
+
+# cache partagé par /query, /query_dense, /query_hybrid et /parliament/ask
+RESULTS = ResultCache(INDEX, VSTORE)
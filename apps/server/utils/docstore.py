@@ -0,0 +1,690 @@
+"""Store de documents partagé : texte empaqueté sur disque, lu par mmap.
+
+Le texte (UTF-8) de chaque version de document ingérée est ajouté en fin
+d'un unique fichier `text.<epoch>.bin` ; des colonnes NumPy (offset, octets,
+caractères, mtime) et une table de chemins décrivent chaque doc par son id.
+Les index ne gardent que des ids et lisent snippets / texte à la demande :
+la mémoire résidente reste celle des structures d'index, le texte brut ne
+vit que dans le cache de pages.
+
+Chaque doc a aussi son index positionnel (terme, début, fin, ligne par
+token, trié par terme) dans `pos.<epoch>.bin` : `passage` y trouve par
+dichotomie les occurrences des termes d'une requête et ne lit du texte que
+la fenêtre retenue.
+
+Les ids ne sont jamais réutilisés : un `DocTable` (vue figée, tenue par un
+snapshot d'index) reste valide pendant les ajouts. Une reconstruction
+démarre une nouvelle époque (nouveau fichier, cf. `rebuilding`) où l'index
+reconstruit range ses docs et où les autres index qui partagent le store
+recopient leurs seuls docs vivants (`prepare_rebase`) : c'est ce qui
+récupère la place des versions remplacées.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import json
+import mmap
+import os
+import pathlib
+import shutil
+import threading
+import weakref
+
+import numpy as np
+
+from apps.server.utils.generation import PUBLISH_LOCK, next_generation
+from apps.server.utils.packed import StringTable
+from apps.server.utils.tokens import (
+    SNIPPET_CHARS,
+    VOCAB,
+    TermDoc,
+    Vocab,
+    positions,
+    snippet,
+    tokenize_spans,
+)
+
+# pos / ntok : bloc positionnel du doc (en int32) dans pos.<epoch>.bin
+_COLUMNS = ("off", "nbytes", "chars", "mtime", "pos", "ntok")
+_DTYPES = {
+    "off": np.int64,
+    "nbytes": np.int64,
+    "chars": np.int64,
+    "mtime": np.float64,
+    "pos": np.int64,
+    "ntok": np.int64,
+}
+# attributs d'un DocStore propres à son époque (cf. reset / restore)
+_EPOCH_STATE = (
+    "_epoch",
+    "_n",
+    "_size",
+    "_pos_size",
+    "_cols",
+    "_paths",
+    "_extra",
+    "_mem",
+    "_map",
+    "_pos_mem",
+    "_pos_map",
+    "_legacy",
+)
+
+Text = Union[bytearray, mmap.mmap, bytes]
+Loc = Dict[str, List[int]]
+
+
+def _is_word(byte: int) -> bool:
+    # octets non ASCII comptés comme lettres : on ne coupe pas un caractère
+    return byte >= 0x80 or byte == 0x5F or chr(byte).isalnum()
+
+
+class _Legacy:
+    """Docs chargés dont les term ids viennent d'un vocabulaire divergent."""
+
+    __slots__ = ("n", "remap", "inv")
+
+    def __init__(self, n: int, remap: np.ndarray, vocab_size: int) -> None:
+        self.n = n  # docs < n : ids anciens
+        self.remap = remap  # ancien id -> id courant
+        self.inv = np.full(vocab_size, -1, dtype=np.int64)  # id courant -> ancien
+        self.inv[remap] = np.arange(len(remap))
+
+
+class DocTable:
+    """Vue en lecture seule des `n` premiers docs d'un store."""
+
+    __slots__ = (
+        "store",
+        "epoch",
+        "_text",
+        "_pos",
+        "_cols",
+        "_paths",
+        "_base",
+        "_n",
+        "_legacy",
+    )
+
+    def __init__(
+        self,
+        store: Optional["DocStore"],
+        epoch: int,
+        text: Text,
+        pos: Text,
+        cols: dict,
+        paths: StringTable,
+        extra: List[str],
+        n: int,
+        legacy: Optional[_Legacy] = None,
+    ) -> None:
+        self.store = store
+        self.epoch = epoch
+        self._text = text
+        self._pos = pos
+        self._cols = cols
+        self._paths = (paths, extra)
+        self._base = len(paths)
+        self._n = n
+        self._legacy = legacy
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, doc_id: int) -> "DocRecord":
+        if not 0 <= doc_id < self._n:
+            raise IndexError(doc_id)
+        return DocRecord(self, doc_id)
+
+    def path(self, doc_id: int) -> str:
+        base, extra = self._paths
+        if doc_id < self._base:
+            return base[doc_id]
+        return extra[doc_id - self._base]
+
+    def mtime(self, doc_id: int) -> float:
+        return float(self._cols["mtime"][doc_id])
+
+    def mtimes(self, ids: np.ndarray) -> np.ndarray:
+        """mtimes d'un tableau d'ids (vectorisé)."""
+        return np.asarray(self._cols["mtime"])[ids]
+
+    def chars(self, doc_id: int) -> int:
+        return int(self._cols["chars"][doc_id])
+
+    def _bytes(self, doc_id: int, limit: Optional[int] = None) -> bytes:
+        lo = int(self._cols["off"][doc_id])
+        n = int(self._cols["nbytes"][doc_id])
+        return bytes(self._text[lo : lo + (n if limit is None else min(n, limit))])
+
+    def text(self, doc_id: int) -> str:
+        return self._bytes(doc_id).decode("utf-8")
+
+    def snippet(self, doc_id: int) -> str:
+        # au plus 4 octets par caractère : seul le début du doc est lu
+        raw = self._bytes(doc_id, 4 * SNIPPET_CHARS)
+        return snippet(raw.decode("utf-8", errors="ignore"))
+
+    def _block(self, doc_id: int) -> np.ndarray:
+        """Bloc positionnel (4, n) du doc, sans copie quand il est mappé."""
+        n = int(self._cols["ntok"][doc_id])
+        lo = int(self._cols["pos"][doc_id])
+        if isinstance(self._pos, mmap.mmap):
+            flat = np.frombuffer(self._pos, dtype=np.int32, count=4 * n, offset=4 * lo)
+        else:  # bytearray en croissance : copie (pas d'export de buffer)
+            flat = np.frombuffer(bytes(self._pos[4 * lo : 4 * (lo + 4 * n)]), np.int32)
+        return flat.reshape(4, n)
+
+    def positions(self, doc_id: int) -> np.ndarray:
+        """Index positionnel du doc, en term ids du vocabulaire courant."""
+        block = self._block(doc_id)
+        legacy = self._legacy
+        if legacy is None or doc_id >= legacy.n:
+            return block
+        return positions(legacy.remap[block[0]], block[1:])
+
+    @property
+    def vocab(self) -> Vocab:
+        """Vocabulaire des term ids de `positions`."""
+        return self.store.vocab if self.store is not None else VOCAB
+
+    def window_terms(self, doc_id: int, a: int, b: int) -> np.ndarray:
+        """Term ids des tokens du doc compris dans les octets [a, b).
+
+        Appliqué au `loc` d'un passage, donne ses termes (avec répétitions)
+        sans relire ni retokeniser le texte.
+        """
+        block = self.positions(doc_id)
+        inside = (block[1] >= a) & (block[2] <= b)
+        return np.asarray(block[0][inside], dtype=np.int64)
+
+    def passage(self, doc_id: int, terms: Sequence[str]) -> Tuple[str, Loc]:
+        """Snippet centré sur le groupe le plus dense de termes de `terms`.
+
+        Parmi les fenêtres d'au plus SNIPPET_CHARS octets qui commencent sur
+        une occurrence, on garde celle de plus grand poids (chaque terme pèse
+        1 / son nombre d'occurrences : un terme rare compte plus qu'une
+        répétition). Sans occurrence : début du doc. Renvoie aussi `loc` :
+        lignes (incluses, à partir de 1) et octets [début, fin) de la fenêtre.
+        """
+        block = self._block(doc_id)
+        tids = [self.vocab.get(t) for t in terms]
+        q = np.unique(np.array([t for t in tids if t is not None], dtype=np.int64))
+        legacy = self._legacy
+        if legacy is not None and doc_id < legacy.n:
+            q = legacy.inv[q[q < len(legacy.inv)]]
+            q = np.sort(q[q >= 0])
+        lo = np.searchsorted(block[0], q, "left")
+        hi = np.searchsorted(block[0], q, "right")
+        cnt = hi - lo
+        if not cnt.sum():
+            return self._window(doc_id, 0, 0, 1, 1)
+        hit = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi) if b > a])
+        weight = np.repeat(1.0 / cnt[cnt > 0], cnt[cnt > 0])
+        order = np.argsort(block[1][hit], kind="stable")
+        hit, weight = hit[order], weight[order]
+        starts, ends = block[1][hit], block[2][hit]
+        cum = np.concatenate([[0.0], np.cumsum(weight)])
+        last = np.searchsorted(ends, starts.astype(np.int64) + SNIPPET_CHARS, "right")
+        last = np.maximum(last - 1, np.arange(len(hit)))
+        i = int(np.argmax(cum[last + 1] - cum[:-1]))
+        j = int(last[i])
+        lines = block[3][hit]
+        return self._window(
+            doc_id, int(starts[i]), int(ends[j]), int(lines[i]), int(lines[j])
+        )
+
+    def _window(
+        self, doc_id: int, cs: int, ce: int, line_cs: int, line_ce: int
+    ) -> Tuple[str, Loc]:
+        """Fenêtre de SNIPPET_CHARS octets autour de [cs, ce) (mots entiers)."""
+        size = int(self._cols["nbytes"][doc_id])
+        pad = max(0, SNIPPET_CHARS - (ce - cs)) // 2
+        a = max(0, min(cs - pad, size - SNIPPET_CHARS))
+        b = min(size, max(ce, a + SNIPPET_CHARS))
+        base = int(self._cols["off"][doc_id])
+        # un octet de marge de chaque côté : mot coupé ou non
+        pre, post = int(a > 0), int(b < size)
+        raw = bytes(self._text[base + a - pre : base + b + post])
+        s, e = pre, len(raw) - post
+        if pre and _is_word(raw[0]):
+            while s < e and s - pre + a < cs and _is_word(raw[s]):
+                s += 1
+        if post and _is_word(raw[-1]):
+            while e > s and e - pre + a > ce and _is_word(raw[e - 1]):
+                e -= 1
+        while s < e and s - pre + a < cs and raw[s] in b" \t\r\n":
+            s += 1
+        while e > s and e - pre + a > ce and raw[e - 1] in b" \t\r\n":
+            e -= 1
+        a, b = a + s - pre, a + e - pre
+        body = raw[s:e]
+        lines = [
+            line_cs - body[: max(0, cs - a)].count(b"\n"),
+            line_ce + body[max(0, ce - a) :].count(b"\n"),
+        ]
+        text = body.decode("utf-8", errors="ignore").replace("\n", " ")
+        return text, {"lines": lines, "bytes": [a, b]}
+
+
+class DocRecord:
+    """Document vu par son id (rien n'est décodé avant l'accès)."""
+
+    __slots__ = ("table", "id")
+
+    def __init__(self, table: DocTable, doc_id: int) -> None:
+        self.table = table
+        self.id = doc_id
+
+    @property
+    def path(self) -> str:
+        return self.table.path(self.id)
+
+    @property
+    def mtime(self) -> float:
+        return self.table.mtime(self.id)
+
+    @property
+    def chars(self) -> int:
+        return self.table.chars(self.id)
+
+    @property
+    def snippet(self) -> str:
+        return self.table.snippet(self.id)
+
+    @property
+    def text(self) -> str:
+        return self.table.text(self.id)
+
+
+def _map(path: pathlib.Path) -> Text:
+    with open(path, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return b""  # mmap refuse les fichiers vides
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+EMPTY_TABLE = DocTable(
+    None,
+    0,
+    b"",
+    b"",
+    {c: np.zeros(0, dtype=_DTYPES[c]) for c in _COLUMNS},
+    StringTable.from_list([]),
+    [],
+    0,
+)
+
+
+class DocStore:
+    """Textes des documents en ajout seul ; persistant si `dirpath` est donné.
+
+    Sans répertoire, le texte est gardé dans un bytearray (tests, index
+    éphémères). Les colonnes sont persistées dans `dirpath/cols` (remplacé
+    atomiquement) et rechargées par mmap ; le premier ajout qui suit un
+    chargement les recopie en mémoire. Les positions sont exprimées en term
+    ids de `vocab` (persisté avec les colonnes, réconcilié au chargement).
+    """
+
+    def __init__(
+        self, dirpath: Optional[pathlib.Path] = None, vocab: Optional[Vocab] = None
+    ) -> None:
+        self.dirpath = dirpath
+        self.vocab = vocab or VOCAB
+        self._lock = threading.RLock()
+        self._loaded = dirpath is None
+        self._tenants: "weakref.WeakSet[Any]" = weakref.WeakSet()  # cf. attach
+        self._epoch = 0
+        self._n = 0
+        self._cols = {c: np.zeros(0, dtype=_DTYPES[c]) for c in _COLUMNS}
+        self._paths = StringTable.from_list([])
+        self._extra: List[str] = []
+        self._mem = bytearray()
+        self._fh: Optional[Any] = None
+        self._size = 0  # octets écrits dans le fichier texte
+        self._map: Text = b""
+        self._pos_mem = bytearray()
+        self._pos_fh: Optional[Any] = None
+        self._pos_size = 0  # int32 écrits dans le fichier de positions
+        self._pos_map: Text = b""
+        self._legacy: Optional[_Legacy] = None
+
+    def __len__(self) -> int:
+        self.ensure_loaded()
+        return self._n
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def _text_path(self, epoch: int) -> pathlib.Path:
+        assert self.dirpath is not None
+        return self.dirpath / f"text.{epoch}.bin"
+
+    def _pos_path(self, epoch: int) -> pathlib.Path:
+        assert self.dirpath is not None
+        return self.dirpath / f"pos.{epoch}.bin"
+
+    def _open(self, path: pathlib.Path, size: int) -> Any:
+        assert self.dirpath is not None
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        fh = open(path, "ab")
+        if fh.tell() != size:
+            fh.truncate(size)  # reste d'un ingest avorté
+        return fh
+
+    # --------- écriture ---------
+
+    def add(
+        self,
+        path: str,
+        text: str,
+        mtime: float,
+        positions_: Optional[np.ndarray] = None,
+    ) -> int:
+        """Ajoute une version de document ; renvoie son id.
+
+        `positions_` : index positionnel (4, n) déjà calculé (TermDoc), en
+        term ids de `self.vocab` ; sinon le texte est tokenisé ici.
+        """
+        data = text.encode("utf-8")
+        if positions_ is None:
+            toks, spans = tokenize_spans(text)
+            positions_ = positions(self.vocab.intern(toks), spans)
+        block = np.ascontiguousarray(positions_, dtype=np.int32).tobytes()
+        self.ensure_loaded()
+        with self._lock:
+            i = self._n
+            self._grow(i + 1)
+            self._cols["off"][i] = self._size
+            self._cols["nbytes"][i] = len(data)
+            self._cols["chars"][i] = len(text)
+            self._cols["mtime"][i] = mtime
+            self._cols["pos"][i] = self._pos_size
+            self._cols["ntok"][i] = positions_.shape[1]
+            self._extra.append(path)
+            if self.dirpath is None:
+                self._mem += data
+                self._pos_mem += block
+            else:
+                if self._fh is None:
+                    self._fh = self._open(self._text_path(self._epoch), self._size)
+                if self._pos_fh is None:
+                    self._pos_fh = self._open(
+                        self._pos_path(self._epoch), 4 * self._pos_size
+                    )
+                self._fh.write(data)
+                self._pos_fh.write(block)
+            self._size += len(data)
+            self._pos_size += len(block) // 4
+            self._n = i + 1
+            return i
+
+    def put(self, doc: Any, vocab: Optional[Vocab] = None) -> int:
+        """Range le texte (et les positions) d'un ParsedDoc/TermDoc et les
+        libère ; renvoie l'id.
+
+        Un doc déjà rangé dans ce store n'est pas recopié ; rangé ailleurs,
+        son texte est relu dans l'autre store. Les positions d'un TermDoc
+        sont reprises si elles sont en ids de ce store (`vocab` : celui qui
+        a produit le TermDoc, par défaut `self.vocab`).
+        """
+        if doc.store is self and doc.doc_id >= 0:
+            return doc.doc_id
+        text = doc.text
+        pos = getattr(doc, "positions", None)
+        if (vocab or self.vocab) is not self.vocab:
+            pos = None
+        if text is None:
+            other = doc.store.view()
+            text = other.text(doc.doc_id)
+            if other.store is not None and other.store.vocab is self.vocab:
+                pos = other.positions(doc.doc_id)
+        doc.doc_id = self.add(doc.path, text, doc.mtime, pos)
+        doc.store, doc.text = self, None
+        if isinstance(doc, TermDoc):
+            doc.positions = None  # relues au besoin dans pos.<epoch>.bin
+        return doc.doc_id
+
+    def adopt(self, table: DocTable, ids: np.ndarray) -> np.ndarray:
+        """Ids dans ce store des docs `ids` de `table` (recopiés si besoin).
+
+        Sans copie dans le cas courant (vue de l'époque courante de ce
+        store) ; sinon, après un `reset`, les textes sont recopiés.
+        """
+        if table.store is self and table.epoch == self._epoch:
+            return ids
+        same = table.store is not None and table.store.vocab is self.vocab
+        return np.array(
+            [
+                self.add(
+                    table.path(i),
+                    table.text(i),
+                    table.mtime(i),
+                    table.positions(i) if same else None,
+                )
+                for i in ids.tolist()
+            ],
+            dtype=np.int64,
+        )
+
+    def touch(self, ids: np.ndarray, mtimes: np.ndarray) -> None:
+        """Met à jour le mtime de docs dont le contenu n'a pas changé.
+
+        La colonne est recopiée : les vues déjà publiées ne bougent pas.
+        """
+        if not len(ids):
+            return
+        with self._lock:
+            mtime = np.array(self._cols["mtime"])
+            mtime[ids] = mtimes
+            self._cols = {**self._cols, "mtime": mtime}
+
+    def _grow(self, n: int) -> None:
+        cols = self._cols
+        cap = len(cols["off"])
+        if n <= cap and cols["off"].flags.writeable:
+            return
+        cap = max(n, 2 * cap, 1024)
+        grown = {}
+        for c in _COLUMNS:
+            grown[c] = np.zeros(cap, dtype=_DTYPES[c])
+            grown[c][: self._n] = cols[c][: self._n]
+        # nouveau dict : les vues existantes gardent les anciens tableaux
+        self._cols = grown
+
+    def reset(self) -> Dict[str, Any]:
+        """Nouvelle époque, vide (les vues existantes restent lisibles).
+
+        Renvoie l'état de l'époque quittée, pour `restore` si la
+        reconstruction qui suit n'aboutit pas.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            self._close()
+            prev = {name: getattr(self, name) for name in _EPOCH_STATE}
+            self._epoch += 1
+            self._n = 0
+            self._size = 0
+            self._pos_size = 0
+            self._cols = {c: np.zeros(0, dtype=_DTYPES[c]) for c in _COLUMNS}
+            self._paths = StringTable.from_list([])
+            self._extra = []
+            self._mem = bytearray()
+            self._map = b""
+            self._pos_mem = bytearray()
+            self._pos_map = b""
+            self._legacy = None
+            return prev
+
+    def restore(self, prev: Dict[str, Any]) -> None:
+        """Revient à l'époque quittée par `reset` (reconstruction abandonnée).
+
+        Les docs ajoutés depuis le `reset` sont oubliés ; les fichiers de
+        l'époque abandonnée seront supprimés au prochain `save`.
+        """
+        with self._lock:
+            self._close()
+            for name, value in prev.items():
+                setattr(self, name, value)
+
+    def attach(self, index: Any) -> None:
+        """Déclare un index dont les snapshots référencent des docs du store
+        (suivi par référence faible, cf. `rebuild`)."""
+        self._tenants.add(index)
+
+    def rebuild(
+        self,
+        index: Any,
+        prepare: Callable[[], Any],
+        publishing: Callable[[], None],
+    ) -> Dict[str, Any]:
+        """Reconstruction complète de `index`, l'un des index du store.
+
+        `prepare()` range les docs dans une nouvelle époque (cf.
+        `rebuilding`) ; les autres index du store y recopient leurs seuls
+        docs vivants (`prepare_rebase`). `publishing()` est le dernier point
+        d'annulation. Tous sont publiés sous une même génération puis
+        persistés ; renvoie les stats de `index`.
+        """
+        with self.rebuilding():
+            state = prepare()
+            others = [
+                (t, t.prepare_rebase()) for t in list(self._tenants) if t is not index
+            ]
+            others = [(t, s) for t, s in others if s is not None]
+            publishing()
+        with PUBLISH_LOCK:
+            gen = next_generation()
+            stats = index.install(state, gen, persist=False)
+            for t, s in others:
+                t.install(s, gen, persist=False)
+        index.save()
+        for t, _ in others:
+            t.save()
+        return stats
+
+    @contextmanager
+    def rebuilding(self) -> Iterator[None]:
+        """Nouvelle époque (cf. `reset`), abandonnée (`restore`) si le bloc
+        lève : annulation ou échec d'une reconstruction avant publication."""
+        prev = self.reset()
+        try:
+            yield
+        except BaseException:
+            self.restore(prev)
+            raise
+
+    def _close(self) -> None:
+        for fh in (self._fh, self._pos_fh):
+            if fh is not None:
+                fh.close()
+        self._fh = self._pos_fh = None
+
+    # --------- lecture ---------
+
+    def view(self) -> DocTable:
+        """Vue figée des docs ajoutés jusqu'ici (à publier avec un index)."""
+        self.ensure_loaded()
+        with self._lock:
+            if self.dirpath is None:
+                text: Text = self._mem
+                pos: Text = self._pos_mem
+            else:
+                for fh in (self._fh, self._pos_fh):
+                    if fh is not None:
+                        fh.flush()
+                if len(self._map) < self._size:
+                    self._map = _map(self._text_path(self._epoch))
+                if len(self._pos_map) < 4 * self._pos_size:
+                    self._pos_map = _map(self._pos_path(self._epoch))
+                text, pos = self._map, self._pos_map
+            return DocTable(
+                self,
+                self._epoch,
+                text,
+                pos,
+                self._cols,
+                self._paths,
+                self._extra,
+                self._n,
+                self._legacy,
+            )
+
+    # --------- persistance ---------
+
+    def save(self) -> None:
+        if self.dirpath is None:
+            return
+        self.ensure_loaded()
+        with self._lock:
+            for fh in (self._fh, self._pos_fh):
+                if fh is not None:
+                    fh.flush()
+                    os.fsync(fh.fileno())
+            final = self.dirpath / "cols"
+            tmp = self.dirpath / "cols.tmp"
+            old = self.dirpath / "cols.old"
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir(parents=True)
+            for c in _COLUMNS:
+                np.save(tmp / f"{c}.npy", self._cols[c][: self._n])
+            view = self.view()
+            StringTable.from_list(view.path(i) for i in range(self._n)).save(
+                tmp, "paths"
+            )
+            StringTable.from_list(self.vocab.words()).save(tmp, "terms")
+            with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+                json.dump({"epoch": self._epoch, "docs": self._n}, f)
+            shutil.rmtree(old, ignore_errors=True)
+            if final.exists():
+                os.replace(final, old)
+            os.replace(tmp, final)
+            shutil.rmtree(old, ignore_errors=True)
+            # fichiers texte des époques précédentes : les mmap ouverts
+            # restent valides après unlink
+            keep = (self._text_path(self._epoch), self._pos_path(self._epoch))
+            for pattern in ("text.*.bin", "pos.*.bin"):
+                for p in self.dirpath.glob(pattern):
+                    if p not in keep:
+                        p.unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        assert self.dirpath is not None
+        d = self.dirpath / "cols"
+        try:
+            with open(d / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            cols = {c: np.load(d / f"{c}.npy", mmap_mode="r") for c in _COLUMNS}
+            paths = StringTable.load(d, "paths")
+            terms = StringTable.load(d, "terms")
+        except (OSError, ValueError, KeyError):
+            return  # absent, ou d'un format sans positions : reconstruit
+        n = int(meta["docs"])
+        epoch = int(meta["epoch"])
+        if len(paths) != n:
+            return
+        end = int(cols["off"][-1] + cols["nbytes"][-1]) if n else 0
+        pos_end = int(cols["pos"][-1] + 4 * cols["ntok"][-1]) if n else 0
+        ends = {self._text_path(epoch): end, self._pos_path(epoch): 4 * pos_end}
+        sizes = {p: p.stat().st_size if p.exists() else 0 for p in ends}
+        if any(sizes[p] < e for p, e in ends.items()):
+            return  # fichier tronqué : store ignoré
+        for p, e in ends.items():
+            if sizes[p] > e:
+                os.truncate(p, e)  # ajouts jamais référencés (crash)
+        remap = self.vocab.adopt(terms.tolist())
+        if remap is not None:
+            self._legacy = _Legacy(n, remap, len(self.vocab))
+        self._epoch, self._n = epoch, n
+        self._size, self._pos_size = end, pos_end
+        self._cols, self._paths = cols, paths
+
+    def ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
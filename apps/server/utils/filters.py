@@ -0,0 +1,118 @@
+"""Filtres de recherche (dossier, extensions, fenêtre de mtime) évalués dans les index.
+
+Un filtre devient un masque booléen sur les docs d'un snapshot : BM25
+l'applique avant la sélection du top-k, le store dense le passe à hnswlib
+(ou cherche exactement parmi les docs admis s'ils sont peu nombreux). La
+partie « chemin » du masque (dossier + extensions) ne dépend que des chemins
+d'une génération : elle est mise en cache par index et par génération. La
+fenêtre de mtime est appliquée à chaque requête (comparaisons vectorisées).
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Iterable, Optional, Sequence, Tuple
+import os
+import threading
+
+import numpy as np
+
+FILTER_CACHE_SIZE = int(os.getenv("LOUMINA_FILTER_CACHE", "32"))
+
+
+@dataclass(frozen=True)
+class DocFilter:
+    """Restriction des documents candidats (hashable : entre dans les clés de cache).
+
+    `prefix` désigne un dossier (ou un fichier) relatif à la racine indexée :
+    "projet" admet "projet/a.md" mais pas "projet2/a.md".
+    """
+
+    prefix: Optional[str] = None
+    exts: Optional[Tuple[str, ...]] = None  # triées, minuscules, avec le point
+    min_mtime: Optional[float] = None
+    max_mtime: Optional[float] = None
+
+    @classmethod
+    def of(
+        cls,
+        prefix: Optional[str] = None,
+        exts: Optional[Iterable[str]] = None,
+        min_mtime: Optional[float] = None,
+        max_mtime: Optional[float] = None,
+    ) -> Optional["DocFilter"]:
+        """Filtre normalisé, ou None s'il n'exclut rien."""
+        prefix = (prefix or "").strip()
+        if prefix.startswith("./"):
+            prefix = prefix[2:]
+        prefix = prefix.strip("/") or None
+        norm = None
+        if exts:
+            norm = tuple(
+                sorted(
+                    {e.lower() if e.startswith(".") else "." + e.lower() for e in exts}
+                )
+            )
+        if prefix is None and norm is None and min_mtime is None and max_mtime is None:
+            return None
+        return cls(prefix, norm, min_mtime, max_mtime)
+
+    @property
+    def path_key(self) -> Tuple[Optional[str], Optional[Tuple[str, ...]]]:
+        return self.prefix, self.exts
+
+    def path_mask(self, paths: Sequence[str]) -> np.ndarray:
+        """Docs admis par dossier et extension (un chemin vide n'est jamais admis)."""
+        prefix, exts = self.prefix, self.exts
+        under = prefix + "/" if prefix else ""
+
+        def ok(p: str) -> bool:
+            if not p:
+                return False
+            if prefix and p != prefix and not p.startswith(under):
+                return False
+            return exts is None or p.lower().endswith(exts)
+
+        return np.fromiter((ok(p) for p in paths), dtype=bool, count=len(paths))
+
+    def mask(self, path_mask: np.ndarray, mtimes: np.ndarray) -> np.ndarray:
+        """`path_mask` restreint à la fenêtre de mtime (copie)."""
+        out = path_mask.copy()
+        if self.min_mtime is not None:
+            out &= mtimes >= self.min_mtime
+        if self.max_mtime is not None:
+            out &= mtimes <= self.max_mtime
+        return out
+
+
+class MaskCache:
+    """Masques « chemin » d'un index, par génération (LRU borné).
+
+    Une nouvelle génération vide le cache : les masques décrivent les docs
+    d'un snapshot précis.
+    """
+
+    def __init__(self, maxsize: int = FILTER_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._generation: Optional[int] = None
+        self._data: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+
+    def get(
+        self, generation: int, key: Hashable, compute: Callable[[], np.ndarray]
+    ) -> np.ndarray:
+        with self._lock:
+            if generation == self._generation and key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        mask = compute()
+        mask.setflags(write=False)
+        with self._lock:
+            if self._generation is None or generation > self._generation:
+                self._generation = generation
+                self._data.clear()
+            if generation == self._generation and self.maxsize > 0:
+                self._data[key] = mask
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return mask
@@ -0,0 +1,48 @@
+"""Numéros de génération des index et publication cohérente BM25 + dense.
+
+Chaque publication d'un index (build, update) reçoit un numéro croissant ;
+un ingest unifié publie les deux index sous le même numéro, en tenant
+PUBLISH_LOCK. Les lecteurs ne prennent pas de verrou : `consistent` relance
+la lecture si une publication est intervenue pendant l'appel (seqlock).
+"""
+
+from __future__ import annotations
+from typing import Callable, Protocol, Tuple, TypeVar
+import threading
+
+T = TypeVar("T")
+
+PUBLISH_LOCK = threading.RLock()
+_last = 0
+
+
+class Generational(Protocol):
+    @property
+    def generation(self) -> int: ...
+
+
+def next_generation() -> int:
+    global _last
+    with PUBLISH_LOCK:
+        _last += 1
+        return _last
+
+
+def observe(gen: int) -> None:
+    """Garantit que les prochains numéros dépassent `gen` (index rechargé)."""
+    global _last
+    with PUBLISH_LOCK:
+        _last = max(_last, gen)
+
+
+def consistent(
+    fn: Callable[[], T], *stores: Generational, retries: int = 3
+) -> Tuple[T, Tuple[int, ...]]:
+    """Exécute `fn` sur un état cohérent des `stores` ; renvoie aussi les générations."""
+    for _ in range(retries):
+        before = tuple(s.generation for s in stores)
+        out = fn()
+        if tuple(s.generation for s in stores) == before:
+            return out, before
+    with PUBLISH_LOCK:  # dernier recours : on bloque les publications
+        return fn(), tuple(s.generation for s in stores)
@@ -0,0 +1,165 @@
+"""Moteur de recherche hybride BM25 + dense (HNSW) avec fraîcheur.
+
+Les deux jambes tournent en parallèle (la jambe BM25 sur un pool de
+threads, la jambe dense dans le thread appelant) : la latence devient
+max(bm25, dense) + fusion. La fusion se fait sur des tableaux NumPy alignés
+sur l'union des candidats, soit par somme pondérée (`alpha` * BM25 normalisé
++ (1 - alpha) * cosinus), soit par Reciprocal Rank Fusion.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Dict, List, Literal, Optional, Tuple
+import os
+
+import numpy as np
+
+from apps.server.utils.cache import RESULTS, normalize
+from apps.server.utils.filters import DocFilter
+from apps.server.utils.generation import consistent
+from apps.server.utils.indexer import INDEX
+from apps.server.utils.spans import span
+from apps.server.utils.vector_index import VSTORE
+
+Fusion = Literal["weighted", "rrf"]
+
+RRF_K = 60  # constante usuelle de Cormack et al.
+DEFAULT_HALF_LIFE = float(os.getenv("LOUMINA_FRESHNESS_HALFLIFE", "30"))
+
+_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LOUMINA_HYBRID_WORKERS", "8")),
+    thread_name_prefix="hybrid",
+)
+
+
+def candidates(
+    queries: List[str], kx: int, flt: Optional[DocFilter] = None
+) -> List[Tuple[List[Dict], List[Dict]]]:
+    """Hits BM25 et dense (kx chacun) de chaque requête, issus de générations
+    publiées ensemble ; chaque jambe traite tout le lot en un appel et
+    applique `flt` avant sa sélection du top-k."""
+
+    def both() -> Tuple[List[List[Dict]], List[List[Dict]]]:
+        # copy_context : les spans de la jambe BM25 restent dans la requête
+        bm = _POOL.submit(copy_context().run, INDEX.search_batch, queries, kx, flt)
+        dn = VSTORE.search_batch(queries, kx, flt)
+        return bm.result(), dn
+
+    (bm_hits, dn_hits), _ = consistent(both, INDEX, VSTORE)
+    return list(zip(bm_hits, dn_hits))
+
+
+def fuse(
+    bm_hits: List[Dict],
+    dn_hits: List[Dict],
+    k: int,
+    alpha: float = 0.6,
+    half_life_days: float = DEFAULT_HALF_LIFE,
+    fusion: Fusion = "weighted",
+    rrf_k: int = RRF_K,
+) -> List[Dict[str, Any]]:
+    """Fusionne deux listes de hits (triées par score décroissant).
+
+    En mode "rrf", chaque jambe contribue 1 / (rrf_k + rang), pondérée par
+    `alpha` / (1 - alpha) ; alpha=0.5 donne le classement RRF classique.
+    """
+    pos: Dict[str, int] = {}
+    for h in bm_hits + dn_hits:
+        pos.setdefault(h["doc"], len(pos))
+    n = len(pos)
+    if not n:
+        return []
+    bm_idx = np.array([pos[h["doc"]] for h in bm_hits], dtype=np.int64)
+    dn_idx = np.array([pos[h["doc"]] for h in dn_hits], dtype=np.int64)
+
+    bm25 = np.zeros(n)
+    dense = np.zeros(n)
+    bm25[bm_idx] = [float(h.get("score", 0.0)) for h in bm_hits]
+    dense[dn_idx] = [float(h.get("score", 0.0)) for h in dn_hits]
+    # fraîcheur (demi-vie) : on prend l'âge (jours) le plus informatif
+    age = np.full(n, np.inf)
+    age[bm_idx] = [float(h.get("age_days", np.inf)) for h in bm_hits]
+    np.minimum.at(
+        age, dn_idx, np.array([float(h.get("age_days", np.inf)) for h in dn_hits])
+    )
+    age[np.isinf(age)] = 0.0
+
+    max_bm = float(bm25[bm_idx].max()) if len(bm_idx) else 1.0
+    bm25_n = bm25 / (max_bm or 1.0)
+    decay = np.power(0.5, age / max(1e-6, half_life_days))
+    if fusion == "rrf":
+        rrf = np.zeros(n)
+        rrf[bm_idx] += alpha / (rrf_k + np.arange(1, len(bm_idx) + 1))
+        rrf[dn_idx] += (1.0 - alpha) / (rrf_k + np.arange(1, len(dn_idx) + 1))
+        final = rrf * decay
+    else:
+        final = (alpha * bm25_n + (1.0 - alpha) * dense) * decay
+
+    # tri stable : à score égal, ordre de première apparition
+    top = np.argsort(-final, kind="stable")[: max(0, k)]
+    snippets: Dict[int, str] = {}
+    locs: Dict[int, Dict] = {}
+    for h in dn_hits + bm_hits:  # le passage BM25 (et sa loc) l'emporte
+        if h.get("snippet"):
+            snippets[pos[h["doc"]]] = h["snippet"]
+            locs[pos[h["doc"]]] = h.get("loc")
+    docs = list(pos)
+    return [
+        {
+            "doc": docs[i],
+            "snippet": snippets.get(i, ""),
+            "loc": locs.get(i),
+            "age_days": float(age[i]),
+            "scores": {
+                "bm25": float(bm25[i]),
+                "bm25_n": float(bm25_n[i]),
+                "dense": float(dense[i]),
+                "decay": float(decay[i]),
+                "final": float(final[i]),
+            },
+        }
+        for i in top.tolist()
+    ]
+
+
+def search(
+    query: str,
+    k: int = 5,
+    alpha: float = 0.6,
+    half_life_days: float = DEFAULT_HALF_LIFE,
+    fusion: Fusion = "weighted",
+    rrf_k: int = RRF_K,
+    flt: Optional[DocFilter] = None,
+) -> List[Dict[str, Any]]:
+    """Recherche hybride : 2k candidats par jambe (au moins 10), puis fusion."""
+    return search_batch([query], k, alpha, half_life_days, fusion, rrf_k, flt)[0]
+
+
+def search_batch(
+    queries: List[str],
+    k: int = 5,
+    alpha: float = 0.6,
+    half_life_days: float = DEFAULT_HALF_LIFE,
+    fusion: Fusion = "weighted",
+    rrf_k: int = RRF_K,
+    flt: Optional[DocFilter] = None,
+) -> List[List[Dict[str, Any]]]:
+    """Recherche hybride d'un lot de requêtes (résultats dans l'ordre).
+
+    Les résultats passent par le cache partagé (clé : requête normalisée et
+    paramètres de fusion et filtre) ; seules les requêtes absentes sont calculées.
+    """
+
+    def compute(positions: List[int]) -> List[List[Dict[str, Any]]]:
+        legs = candidates([queries[p] for p in positions], max(10, k * 2), flt)
+        with span("fusion"):
+            return [
+                fuse(bm, dn, k, alpha, half_life_days, fusion, rrf_k) for bm, dn in legs
+            ]
+
+    keys = [
+        ("hybrid", normalize(q), k, alpha, half_life_days, fusion, rrf_k, flt)
+        for q in queries
+    ]
+    return RESULTS.get_or_compute_many(keys, compute, half_life_days)
@@ -1,11 +1,48 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import List, Dict, Iterable, Optional
+from dataclasses import dataclass, replace
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Union
+import heapq
+import itertools
+import json
+import math
+import os
 import pathlib
-import re
+import shutil
 import threading
 import time
-from rank_bm25 import BM25Okapi
+
+import numpy as np
+
+from apps.server.utils.docstore import EMPTY_TABLE, DocStore, DocTable
+from apps.server.utils.filters import DocFilter, MaskCache
+from apps.server.utils.generation import PUBLISH_LOCK, next_generation, observe
+from apps.server.utils.packed import StringTable
+from apps.server.utils.rerank import (
+    passage_vectors,
+    query_vector,
+    rerank_cosine,
+    snippet_cosines,
+)
+from apps.server.utils.shards import SHARDS, fan_out, shard_of, split
+from apps.server.utils.spans import span
+from apps.server.utils.tokens import (
+    VOCAB,
+    ParsedDoc,
+    TermDoc,
+    Vocab,
+    tokenize,
+    tokenize_spans,
+)
+
+# Paramètres identiques à rank_bm25.BM25Okapi (classement inchangé)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+BM25_FORMAT_VERSION = 6
+
+_POSTINGS = ("ptr", "post_doc", "post_tf")
 
 
 @dataclass
@@ -15,70 +52,757 @@ class Doc:
     mtime: float  # epoch seconds
 
 
+def parse_doc(doc: Doc) -> ParsedDoc:
+    toks, spans = tokenize_spans(doc.text)
+    return ParsedDoc(doc.path, doc.mtime, toks, doc.text, spans=spans)
+
+
+def _topk(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k par score décroissant, égalités départagées par id croissant.
+
+    `ids` doit être trié par ordre croissant (sortie de np.unique) : c'est ce
+    qui reproduit l'ordre stable de `sorted(..., reverse=True)`.
+    """
+    if len(ids) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[: k - len(above)]
+        keep = np.concatenate([above, ties])
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))
+    return ids[order], scores[order]
+
+
+@dataclass(frozen=True)
+class _Postings:
+    """Postings CSR d'un shard : terme t = [ptr[t], ptr[t + 1]) (doc ids globaux)."""
+
+    ptr: np.ndarray
+    post_doc: np.ndarray
+    post_tf: np.ndarray
+
+    def triplets(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(terme, doc, tf) de chaque posting."""
+        t = np.repeat(np.arange(len(self.ptr) - 1, dtype=np.int32), np.diff(self.ptr))
+        return t, np.asarray(self.post_doc), np.asarray(self.post_tf)
+
+
+@dataclass(frozen=True)
+class _BM25Snapshot:
+    """Génération immuable de l'index BM25 (publiée par échange de référence)."""
+
+    paths: List[str]
+    # doc i -> id dans le DocStore (texte, passages, mtime lus dans `docs`)
+    store_ids: np.ndarray
+    docs: DocTable
+    n_terms: int  # seuls les ids < n_terms ont des postings ici
+    # un jeu de postings par shard (docs répartis par hash du chemin)
+    shards: Tuple[_Postings, ...]
+    idf: np.ndarray  # globaux : un score ne dépend pas du shard
+    norm: np.ndarray  # k1 * (1 - b + b * dl / avgdl)
+    doc_len: np.ndarray
+    built_at: float = 0.0
+    generation: int = 0
+
+    def df(self) -> np.ndarray:
+        return sum(np.diff(p.ptr) for p in self.shards)
+
+    def n_postings(self) -> int:
+        return sum(len(p.post_doc) for p in self.shards)
+
+
+_EMPTY_BM25 = _BM25Snapshot(
+    paths=[],
+    store_ids=np.zeros(0, dtype=np.int64),
+    docs=EMPTY_TABLE,
+    n_terms=0,
+    shards=(
+        _Postings(
+            ptr=np.zeros(1, dtype=np.int64),
+            post_doc=np.zeros(0, dtype=np.int32),
+            post_tf=np.zeros(0, dtype=np.int32),
+        ),
+    ),
+    idf=np.zeros(0, dtype=np.float64),
+    norm=np.zeros(0, dtype=np.float64),
+    doc_len=np.zeros(0, dtype=np.int64),
+)
+
+
 class BM25Index:
-    def __init__(self) -> None:
-        self._lock = threading.Lock()
-        self._docs: List[Doc] = []
-        self._tokens: List[List[str]] = []
-        self._bm25: Optional[BM25Okapi] = None
-        self._built_at: float = 0.0
+    """Index inversé BM25 (Okapi) : postings CSR terme -> (doc ids, tf).
+
+    Seuls les documents contenant au moins un terme de la requête sont
+    scorés ; la sélection top-k se fait par `np.partition` au lieu d'un tri
+    complet du corpus. Avec `state_dir`, l'index est persisté en `.npy`
+    (postings, normes, table de chaînes) et rechargé par mmap.
+
+    Chaque (re)construction produit un `_BM25Snapshot` immuable, à côté de
+    celui en service, puis le publie par une simple affectation : les
+    recherches lisent `self._snap` une fois et ne prennent aucun verrou.
+
+    Avec `shards` > 1, les postings sont découpés par hash du chemin ; chaque
+    shard est construit et interrogé en parallèle (cf. `shards.fan_out`) et
+    les top-k partiels sont fusionnés par tas. IDF et normes restent
+    calculées sur tout le corpus : les scores sont ceux d'un index unique.
+    """
+
+    def __init__(
+        self,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+        state_dir: Optional[pathlib.Path] = None,
+        vocab: Optional[Vocab] = None,
+        store: Optional[DocStore] = None,
+        shards: int = SHARDS,
+    ) -> None:
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.n_shards = max(1, shards)
+        self._state_dir = state_dir
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        # vocabulaire éventuellement partagé (append-only)
+        self._vocab = vocab if vocab is not None else Vocab()
+        # textes des docs (partagé avec VSTORE pour l'index global)
+        self._owns_store = store is None
+        if store is None:
+            store = DocStore(
+                state_dir.with_name(state_dir.name + "_docs") if state_dir else None,
+                vocab=self._vocab,
+            )
+        self._store = store
+        store.attach(self)
+        self._masks = MaskCache()
+        self._snap = _EMPTY_BM25
+
+    @property
+    def generation(self) -> int:
+        return self._snap.generation
 
     @staticmethod
     def _tok(txt: str) -> List[str]:
-        return re.findall(r"\w{2,}", txt.lower())
-
-    def build(self, docs: Iterable[Doc]):
-        with self._lock:
-            self._docs = list(docs)
-            self._tokens = [self._tok(d.text) for d in self._docs]
-            self._bm25 = BM25Okapi(self._tokens) if self._tokens else None
-            self._built_at = time.time()
-            return {"docs": len(self._docs), "tokens_lists": len(self._tokens)}
-
-    def search(self, query: str, k: int = 5) -> List[Dict]:
-        with self._lock:
-            if not self._bm25 or not self._docs:
-                return []
-            q = self._tok(query)
-            scores = self._bm25.get_scores(q)
-            top = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
-            now = time.time()
-            res = []
-            for i in top:
-                d = self._docs[i]
-                age_days = max(0.0, (now - d.mtime) / 86400.0)
-                snippet = d.text[:280].replace("\n", " ")
-                res.append(
-                    {
-                        "doc": d.path,
-                        "score": float(scores[i]),
-                        "snippet": snippet,
-                        "age_days": age_days,
-                    }
+        return tokenize(txt)
+
+    def _collect(self, docs: Iterable[Union[Doc, ParsedDoc, TermDoc]]) -> Tuple[
+        List[str],
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+        np.ndarray,
+    ]:
+        """Consomme `docs` en flux -> métadonnées + triplets (terme, doc, tf).
+
+        Seuls les tableaux d'ids sont conservés : le texte part dans le
+        DocStore. Les doc ids partent de 0 ; le vocabulaire est complété au
+        passage (les positions des TermDoc partent avec le texte).
+        """
+        paths: List[str] = []
+        store_ids: List[int] = []
+        lens: List[int] = []
+        doc_ids: List[np.ndarray] = []
+        term_ids: List[np.ndarray] = []
+        tfs: List[np.ndarray] = []
+        for i, d in enumerate(docs):
+            if isinstance(d, Doc):
+                d = parse_doc(d)
+            if isinstance(d, ParsedDoc):
+                d = self._vocab.term_doc(d)
+            paths.append(d.path)
+            store_ids.append(self._store.put(d, self._vocab))
+            lens.append(d.length)
+            term_ids.append(d.tids)
+            tfs.append(d.tfs)
+            doc_ids.append(np.full(len(d.tids), i, dtype=np.int32))
+        empty = np.zeros(0, dtype=np.int32)
+        return (
+            paths,
+            np.array(store_ids, dtype=np.int64),
+            np.concatenate(term_ids) if term_ids else empty,
+            np.concatenate(doc_ids) if doc_ids else empty,
+            np.concatenate(tfs) if tfs else empty,
+            np.array(lens, dtype=np.int64),
+        )
+
+    def _assemble(
+        self,
+        paths: List[str],
+        store_ids: np.ndarray,
+        all_t: np.ndarray,
+        all_d: np.ndarray,
+        all_tf: np.ndarray,
+        doc_len: np.ndarray,
+    ) -> _BM25Snapshot:
+        """Construit (hors verrou) le snapshot d'une nouvelle génération.
+
+        Les postings de chaque shard sont triés en parallèle ; df (donc
+        l'IDF) et la longueur moyenne sont calculés sur tout le corpus.
+        """
+        n_terms = len(self._vocab)
+        df = np.bincount(all_t, minlength=n_terms)
+        n_docs = len(paths)
+
+        def postings(sel: np.ndarray) -> _Postings:
+            t = all_t[sel]
+            order = np.argsort(t, kind="stable")  # par doc id dans chaque terme
+            ptr = np.zeros(n_terms + 1, dtype=np.int64)
+            np.cumsum(np.bincount(t, minlength=n_terms), out=ptr[1:])
+            return _Postings(
+                ptr=ptr,
+                post_doc=all_d[sel][order].astype(np.int32),
+                post_tf=all_tf[sel][order].astype(np.int32),
+            )
+
+        owner = shard_of(paths, self.n_shards)
+        shards = fan_out(postings, split(owner[all_d], self.n_shards))
+
+        idf = self._calc_idf(n_docs, df.tolist())
+        total = int(doc_len.sum())
+        avgdl = total / n_docs if n_docs else 0.0
+        if avgdl > 0:
+            norm = self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+        else:
+            norm = np.full(n_docs, self.k1 * (1 - self.b), dtype=np.float64)
+        return _BM25Snapshot(
+            paths=paths,
+            store_ids=store_ids,
+            docs=self._store.view(),
+            n_terms=n_terms,
+            shards=tuple(shards),
+            idf=idf,
+            norm=norm,
+            doc_len=doc_len,
+        )
+
+    def install(
+        self,
+        state: _BM25Snapshot,
+        generation: Optional[int] = None,
+        persist: bool = True,
+    ):
+        """Publie un snapshot préparé par `prepare_build`/`prepare_update`.
+
+        Sans `generation`, un nouveau numéro est tiré ; un ingest unifié passe
+        le même numéro à INDEX et VSTORE (sous PUBLISH_LOCK). La publication
+        est une affectation de référence : les recherches en cours terminent
+        sur l'ancien snapshot.
+        """
+        with PUBLISH_LOCK:
+            gen = generation if generation is not None else next_generation()
+            snap = replace(state, built_at=time.time(), generation=gen)
+            self._snap = snap
+            self._loaded = True
+        if persist:
+            self.save()
+        return {
+            "docs": len(snap.paths),
+            "tokens_lists": len(snap.paths),
+            "terms": int((snap.df() > 0).sum()),
+            "postings": snap.n_postings(),
+            "shards": len(snap.shards),
+            "generation": gen,
+        }
+
+    def prepare_build(
+        self, docs: Iterable[Union[Doc, ParsedDoc, TermDoc]]
+    ) -> _BM25Snapshot:
+        if self._owns_store:
+            self._store.reset()  # reconstruction : les anciens textes partent
+        return self._assemble(*self._collect(docs))
+
+    def build(self, docs: Iterable[Union[Doc, ParsedDoc, TermDoc]]):
+        return self.install(self.prepare_build(docs))
+
+    def prepare_rebase(self) -> Optional[_BM25Snapshot]:
+        """Snapshot inchangé, docs recopiés dans l'époque courante du store.
+
+        Après le `reset` du store partagé par un autre index (cf.
+        `DocStore.rebuild`) : seuls les docs vivants de cet index passent
+        dans la nouvelle époque. None si l'index est vide.
+        """
+        self.ensure_loaded()
+        if not self._snap.paths:
+            return None
+        return self.prepare_update(())
+
+    def prepare_update(
+        self,
+        added: Iterable[Union[Doc, ParsedDoc, TermDoc]],
+        removed: Iterable[str] = (),
+        mtimes: Optional[Dict[str, float]] = None,
+    ) -> _BM25Snapshot:
+        self.ensure_loaded()
+        (
+            new_paths,
+            new_ids,
+            new_t,
+            new_d,
+            new_tf,
+            new_len,
+        ) = self._collect(added)
+        gone = set(removed) | set(new_paths)
+        snap = self._snap
+        paths = snap.paths
+        old_t, post_doc, post_tf = (
+            np.concatenate(c) for c in zip(*(p.triplets() for p in snap.shards))
+        )
+
+        keep = np.array([p not in gone for p in paths], dtype=bool)
+        remap = np.cumsum(keep, dtype=np.int64) - 1
+        idx = np.flatnonzero(keep).tolist()
+        kept_paths = [paths[i] for i in idx]
+        kept_ids = self._store.adopt(snap.docs, snap.store_ids[keep])
+        if mtimes:
+            hit = [j for j, p in enumerate(kept_paths) if p in mtimes]
+            self._store.touch(
+                kept_ids[hit], np.array([mtimes[kept_paths[j]] for j in hit])
+            )
+
+        mask = keep[post_doc] if len(post_doc) else np.zeros(0, dtype=bool)
+        old_t, old_d, old_tf = old_t[mask], remap[post_doc[mask]], post_tf[mask]
+
+        return self._assemble(
+            kept_paths + new_paths,
+            np.concatenate([kept_ids, new_ids]),
+            np.concatenate([old_t, new_t]),
+            np.concatenate([old_d, new_d + len(kept_paths)]),
+            np.concatenate([old_tf, new_tf]),
+            np.concatenate([snap.doc_len[keep], new_len]),
+        )
+
+    def update(
+        self,
+        added: Iterable[Union[Doc, ParsedDoc, TermDoc]],
+        removed: Iterable[str] = (),
+        mtimes: Optional[Dict[str, float]] = None,
+    ):
+        """Mise à jour incrémentale : retire `removed`, indexe `added`.
+
+        Seuls les documents ajoutés sont tokenisés ; les postings existants
+        sont filtrés/renumérotés puis fusionnés. `mtimes` met à jour la date
+        des documents touchés mais inchangés. `removed` et `mtimes` ne sont
+        lus qu'après avoir consommé `added` (ils peuvent être remplis par le
+        flux d'ingestion).
+        """
+        return self.install(self.prepare_update(added, removed, mtimes))
+
+    def paths(self) -> List[str]:
+        self.ensure_loaded()
+        return list(self._snap.paths)
+
+    # --------- persistance ---------
+
+    def save(self) -> None:
+        """Écrit l'index dans `state_dir` (répertoire remplacé atomiquement)."""
+        if self._state_dir is None:
+            return
+        snap = self._snap
+        self._store.save()
+        arrays = {
+            f"{name}.{s}": getattr(p, name)
+            for s, p in enumerate(snap.shards)
+            for name in _POSTINGS
+        }
+        arrays.update(
+            idf=snap.idf,
+            norm=snap.norm,
+            doc_len=snap.doc_len,
+            store_ids=snap.store_ids,
+        )
+        tables = {
+            "vocab": StringTable.from_list(self._vocab.words(snap.n_terms)),
+            "paths": StringTable.from_list(snap.paths),
+        }
+        meta = {
+            "version": BM25_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "docs": len(snap.paths),
+            "shards": len(snap.shards),
+            "built_at": snap.built_at,
+            "generation": snap.generation,
+            "docs_epoch": snap.docs.epoch,
+        }
+        final = self._state_dir
+        tmp = final.with_name(final.name + ".tmp")
+        old = final.with_name(final.name + ".old")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name, arr in arrays.items():
+            np.save(tmp / f"{name}.npy", arr)
+        for name, table in tables.items():
+            table.save(tmp, name)
+        with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # les fichiers déjà mappés restent valides après le rename/unlink
+        shutil.rmtree(old, ignore_errors=True)
+        if final.exists():
+            os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _load(self) -> bool:
+        d = self._state_dir
+        if d is None or not (d / "meta.json").exists():
+            return False
+        try:
+            with open(d / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != BM25_FORMAT_VERSION or (
+                meta["k1"],
+                meta["b"],
+                meta["epsilon"],
+            ) != (self.k1, self.b, self.epsilon):
+                return False
+            shards = [
+                _Postings(
+                    *(
+                        np.load(d / f"{name}.{s}.npy", mmap_mode="r")
+                        for name in _POSTINGS
+                    )
                 )
-            return res
+                for s in range(int(meta["shards"]))
+            ]
+            arrays = {
+                name: np.load(d / f"{name}.npy", mmap_mode="r")
+                for name in ("idf", "norm", "doc_len", "store_ids")
+            }
+            vocab = StringTable.load(d, "vocab").tolist()
+            paths = StringTable.load(d, "paths").tolist()
+        except (OSError, ValueError, KeyError):
+            return False
+        self._store.ensure_loaded()
+        docs = self._store.view()
+        ids = arrays["store_ids"]
+        if meta.get("docs_epoch") != docs.epoch or (
+            len(ids) and ids.max() >= len(docs)
+        ):
+            return False  # store de documents d'une autre époque
+        remap = self._vocab.adopt(vocab)
+        if remap is not None:
+            # vocabulaire partagé divergent : renumérotation des postings
+            n_terms = len(self._vocab)
+            for s, p in enumerate(shards):
+                old_t = np.repeat(remap, np.diff(p.ptr))
+                order = np.argsort(old_t, kind="stable")
+                ptr = np.zeros(n_terms + 1, dtype=np.int64)
+                np.cumsum(np.bincount(old_t, minlength=n_terms), out=ptr[1:])
+                shards[s] = _Postings(
+                    ptr=ptr,
+                    post_doc=np.asarray(p.post_doc)[order],
+                    post_tf=np.asarray(p.post_tf)[order],
+                )
+            idf = np.zeros(n_terms, dtype=np.float64)
+            idf[remap] = arrays["idf"]
+            arrays.update(idf=idf)
+        gen = int(meta.get("generation", 0))
+        observe(gen)
+        self._snap = _BM25Snapshot(
+            paths=paths,
+            docs=docs,
+            n_terms=len(shards[0].ptr) - 1,
+            shards=tuple(shards),
+            built_at=float(meta.get("built_at", 0.0)),
+            generation=gen,
+            **arrays,
+        )
+        return True
+
+    def ensure_loaded(self) -> bool:
+        if self._loaded:
+            return bool(self._snap.paths)
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+        return bool(self._snap.paths)
+
+    def _calc_idf(self, n_docs: int, df: List[int]) -> np.ndarray:
+        # même formule (et même ordre de sommation) que BM25Okapi._calc_idf ;
+        # les termes orphelins (df=0 après suppressions) sont ignorés
+        idf = [
+            math.log(n_docs - f + 0.5) - math.log(f + 0.5) if f else None for f in df
+        ]
+        present = [v for v in idf if v is not None]
+        if not present:
+            return np.zeros(len(df), dtype=np.float64)
+        eps = self.epsilon * (sum(present) / len(present))
+        return np.array(
+            [0.0 if v is None else (v if v >= 0 else eps) for v in idf],
+            dtype=np.float64,
+        )
+
+    def _term_ids(self, snap: _BM25Snapshot, toks: List[str]) -> List[int]:
+        """Ids des termes de la requête qui ont des postings dans `snap`."""
+        ids = [self._vocab.get(w) for w in toks]
+        return [t for t in ids if t is not None and t < snap.n_terms]
+
+    def _score_batch(
+        self, snap: _BM25Snapshot, post: _Postings, qs: List[List[int]]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Scores BM25 des seuls documents du shard `post` qui matchent.
+
+        Les poids d'un terme (postings x idf x tf normalisé) sont calculés une
+        fois et partagés par toutes les requêtes qui le contiennent ; un seul
+        unique/bincount score ensuite tout le lot sur des clés (requête, doc).
+        """
+        n = len(snap.paths)
+        k1p1 = self.k1 + 1
+        weights: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        keys: List[np.ndarray] = []
+        w_parts: List[np.ndarray] = []
+        for qi, q in enumerate(qs):
+            for t in q:
+                if t not in weights:
+                    lo, hi = post.ptr[t], post.ptr[t + 1]
+                    d = post.post_doc[lo:hi]
+                    tf = post.post_tf[lo:hi].astype(np.float64)
+                    weights[t] = (d, snap.idf[t] * (tf * k1p1 / (tf + snap.norm[d])))
+                d, w = weights[t]
+                keys.append(d + np.int64(qi) * n)
+                w_parts.append(w)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not keys:
+            return [empty] * len(qs)
+        uniq, inv = np.unique(np.concatenate(keys), return_inverse=True)
+        # bincount additionne dans l'ordre des termes de chaque requête
+        scores = np.bincount(inv, weights=np.concatenate(w_parts), minlength=len(uniq))
+        bounds = np.searchsorted(uniq, np.arange(len(qs) + 1, dtype=np.int64) * n)
+        return [
+            (uniq[lo:hi] - qi * n, scores[lo:hi])
+            for qi, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+
+    def _shard_top(
+        self,
+        snap: _BM25Snapshot,
+        post: _Postings,
+        qs: List[List[int]],
+        k: int,
+        allowed: Optional[np.ndarray],
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """Par requête : docs scorés admis du shard et leur top-k positif."""
+        out = []
+        for ids, scores in self._score_batch(snap, post, qs):
+            if allowed is not None:  # filtre : docs exclus avant le top-k
+                keep = allowed[ids]
+                ids, scores = ids[keep], scores[keep]
+            pos = scores > 0
+            out.append((ids, scores, *_topk(ids[pos], scores[pos], k)))
+        return out
+
+    @classmethod
+    def _merge(
+        cls,
+        n: int,
+        parts: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]],
+        k: int,
+        allowed: Optional[np.ndarray],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k global à partir des top-k de chaque shard (fusion par tas).
+
+        Même ordre que `_topk` sur l'index entier : score décroissant, puis
+        doc id croissant. Moins de k docs positifs : complété par `_select`.
+        """
+        if len(parts) == 1 and len(parts[0][2]) >= k:
+            return parts[0][2], parts[0][3]
+        if sum(len(p[2]) for p in parts) < k:
+            return cls._select(
+                n,
+                np.concatenate([p[0] for p in parts]),
+                np.concatenate([p[1] for p in parts]),
+                k,
+                allowed,
+            )
+        merged = heapq.merge(
+            *(zip((-p[3]).tolist(), p[2].tolist()) for p in parts if len(p[2]))
+        )
+        best = list(itertools.islice(merged, k))
+        return (
+            np.array([i for _, i in best], dtype=np.int64),
+            np.array([-sc for sc, _ in best], dtype=np.float64),
+        )
+
+    @staticmethod
+    def _select(
+        n: int,
+        ids: np.ndarray,
+        scores: np.ndarray,
+        k: int,
+        allowed: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if allowed is not None:  # filtre : docs exclus avant le top-k
+            keep = allowed[ids]
+            ids, scores = ids[keep], scores[keep]
+        pos = scores > 0
+        if int(pos.sum()) >= k:
+            return _topk(ids[pos], scores[pos], k)
+        # moins de k documents positifs : on complète avec les scores nuls
+        # (et négatifs) exactement comme un tri complet du corpus
+        full = np.zeros(n, dtype=np.float64)
+        full[ids] = scores
+        if allowed is None:
+            top = np.argsort(-full, kind="stable")[:k]
+        else:
+            cand = np.flatnonzero(allowed)
+            top = cand[np.argsort(-full[cand], kind="stable")[:k]]
+        return top, full[top]
+
+    def _allowed(
+        self, snap: _BM25Snapshot, flt: Optional[DocFilter]
+    ) -> Optional[np.ndarray]:
+        """Masque des docs admis par `flt` (partie chemin en cache par génération)."""
+        if flt is None:
+            return None
+        paths = self._masks.get(
+            snap.generation, flt.path_key, lambda: flt.path_mask(snap.paths)
+        )
+        if flt.min_mtime is None and flt.max_mtime is None:
+            return paths
+        return flt.mask(paths, snap.docs.mtimes(snap.store_ids))
+
+    def search(
+        self, query: str, k: int = 5, flt: Optional[DocFilter] = None
+    ) -> List[Dict]:
+        return self.search_batch([query], k, flt)[0]
+
+    def search_batch(
+        self, queries: List[str], k: int = 5, flt: Optional[DocFilter] = None
+    ) -> List[List[Dict]]:
+        """Recherche d'un lot de requêtes sur un même snapshot (résultats dans l'ordre)."""
+        return self._search(queries, k, flt)[0]
+
+    def search_rerank(
+        self,
+        query: str,
+        k: int = 5,
+        alpha: float = 0.6,
+        flt: Optional[DocFilter] = None,
+    ) -> List[Dict]:
+        return self.search_rerank_batch([query], k, alpha, flt)[0]
+
+    def search_rerank_batch(
+        self,
+        queries: List[str],
+        k: int = 5,
+        alpha: float = 0.6,
+        flt: Optional[DocFilter] = None,
+    ) -> List[List[Dict]]:
+        """BM25 puis rerank cosinus (cf. `rerank_cosine`) pour un lot.
+
+        Le cosinus porte sur le passage de chaque hit (centré sur les termes
+        de sa requête) : ses termes sont pris dans l'index positionnel du
+        DocStore (octets du `loc`), sans retokeniser le texte ; tout le lot
+        est scoré en une passe.
+        """
+        hits, toks, tops, snap = self._search(queries, k, flt)
+        with span("rerank"):
+            docs = snap.docs
+            windows = [
+                docs.window_terms(int(snap.store_ids[i]), *h["loc"]["bytes"])
+                for top, hs in zip(tops, hits)
+                for i, h in zip(top.tolist(), hs)
+            ]
+            bounds = np.cumsum([0] + [len(hs) for hs in hits])
+            cos = snippet_cosines(
+                [query_vector(t, docs.vocab.get) for t in toks],
+                [np.arange(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])],
+                *passage_vectors(windows),
+            )
+        return [rerank_cosine(h, c, alpha=alpha) for h, c in zip(hits, cos)]
+
+    def _search(
+        self, queries: List[str], k: int, flt: Optional[DocFilter] = None
+    ) -> Tuple[List[List[Dict]], List[List[str]], List[np.ndarray], _BM25Snapshot]:
+        """Hits, tokens et doc ids retenus de chaque requête, et le snapshot lu.
+
+        Avec `flt`, seuls les docs admis entrent dans le top-k (k résultats
+        dès que k docs sont admis).
+        """
+        self.ensure_loaded()
+        snap = self._snap  # une seule lecture : cohérent même pendant un swap
+        if not snap.paths or k <= 0:
+            none = np.zeros(0, dtype=np.int64)
+            return (
+                [[] for _ in queries],
+                [[] for _ in queries],
+                [none] * len(queries),
+                snap,
+            )
+        n = len(snap.paths)
+        with span("tokenize"):
+            toks = [self._tok(q) for q in queries]
+        with span("filter"):
+            allowed = self._allowed(snap, flt)
+        with span("bm25"):
+            qs = [self._term_ids(snap, q) for q in toks]
+            parts = fan_out(
+                lambda post: self._shard_top(snap, post, qs, k, allowed), snap.shards
+            )
+            now = time.time()
+            out: List[List[Dict]] = []
+            tops: List[np.ndarray] = []
+            for qi in range(len(queries)):
+                top, top_scores = self._merge(n, [p[qi] for p in parts], k, allowed)
+                res = []
+                for i, sc in zip(top.tolist(), top_scores.tolist()):
+                    sid = int(snap.store_ids[i])
+                    text, loc = snap.docs.passage(sid, toks[qi])
+                    age_days = max(0.0, (now - snap.docs.mtime(sid)) / 86400.0)
+                    res.append(
+                        {
+                            "doc": snap.paths[i],
+                            "score": float(sc),
+                            "snippet": text,
+                            "loc": loc,
+                            "age_days": age_days,
+                        }
+                    )
+                out.append(res)
+                tops.append(top)
+        return out, toks, tops, snap
 
     def stats(self) -> Dict[str, float]:
-        with self._lock:
-            return {"docs": len(self._docs), "built_at": self._built_at}
+        snap = self._snap
+        return {
+            "docs": len(snap.paths),
+            "terms": snap.n_terms,
+            "built_at": snap.built_at,
+            "generation": snap.generation,
+        }
 
 
 DEFAULT_EXTS = {".md", ".txt", ".py"}
+EXCLUDED_DIRS = {".venv", "node_modules", "dist", "build", ".git"}
 
+STATE_DIR = pathlib.Path(os.getenv("LOUMINA_STATE", "/app/state"))
+STATE_DIR.mkdir(parents=True, exist_ok=True)
+BM25_DIR = STATE_DIR / "bm25"
+BM25_MANIFEST_PATH = STATE_DIR / "bm25_manifest.json"
 
-def load_corpus(root: pathlib.Path, exts: Optional[Iterable[str]] = None) -> List[Doc]:
+
+def iter_files(
+    root: pathlib.Path, exts: Optional[Iterable[str]] = None
+) -> Iterator[pathlib.Path]:
+    """Fichiers indexables sous `root` (extension autorisée, hors dossiers exclus)."""
     exts = set(exts or DEFAULT_EXTS)
-    docs: List[Doc] = []
     for p in root.rglob("*"):
         if not p.is_file():
             continue
         if p.suffix.lower() not in exts:
             continue
-        if any(
-            part in {".venv", "node_modules", "dist", "build", ".git"}
-            for part in p.parts
-        ):
+        if any(part in EXCLUDED_DIRS for part in p.parts):
             continue
+        yield p
+
+
+def load_corpus(root: pathlib.Path, exts: Optional[Iterable[str]] = None) -> List[Doc]:
+    docs: List[Doc] = []
+    for p in iter_files(root, exts):
         try:
             txt = p.read_text(encoding="utf-8", errors="ignore")
             rel = str(p.relative_to(root))
@@ -89,12 +813,40 @@ def load_corpus(root: pathlib.Path, exts: Optional[Iterable[str]] = None) -> Lis
     return docs
 
 
-# index global
-INDEX = BM25Index()
+# textes des documents, partagés par INDEX et VSTORE
+DOCS = DocStore(STATE_DIR / "docs")
+# index global (vocabulaire partagé avec VSTORE)
+INDEX = BM25Index(state_dir=BM25_DIR, vocab=VOCAB, store=DOCS)
+
+
+def rebuild(
+    root: pathlib.Path,
+    allowed_exts: Optional[Iterable[str]] = None,
+    full: bool = False,
+    progress=None,
+):
+    """(Ré)indexe `root` dans INDEX, en incrémental si le manifeste le permet.
 
+    `progress` (rag.pipelines.ingest.Progress) suit l'avancement ; une
+    annulation avant la publication laisse INDEX inchangé.
+    """
+    from rag.pipelines.ingest import scan
 
-def rebuild(root: pathlib.Path, allowed_exts: Optional[Iterable[str]] = None):
-    from .indexer import load_corpus  # self-import safe
+    from .manifest import Manifest
 
-    docs = load_corpus(root, allowed_exts)
-    return INDEX.build(docs)
+    prev = None if full else Manifest.load(BM25_MANIFEST_PATH)
+    if prev is not None and set(prev.files) != set(INDEX.paths()):
+        prev = None  # manifeste désynchronisé de l'index en mémoire
+    res = scan(root, allowed_exts or DEFAULT_EXTS, prev, progress=progress)
+    if res.incremental:
+        state = INDEX.prepare_update(res.changed, res.removed, res.mtimes)
+        res.progress.publishing()
+        stats = INDEX.install(state)
+    else:
+        # nouvelle époque de DOCS, où VSTORE recopie ses docs vivants
+        stats = DOCS.rebuild(
+            INDEX, lambda: INDEX.prepare_build(res.changed), res.progress.publishing
+        )
+    res.manifest.save(BM25_MANIFEST_PATH)
+    stats.update(res.stats())
+    return stats
@@ -0,0 +1,162 @@
+"""Jobs d'ingestion en tâche de fond : file unique, progression, annulation.
+
+Un ingest soumis par l'API devient un `Job` : la requête rend son id tout de
+suite et `/jobs/{id}` expose statut et progression (fichiers parcourus, lus,
+indexés, octets, débit, ETA). Un seul thread exécute les jobs, l'un après
+l'autre : tous écrivent dans INDEX, VSTORE, DOCS et le vocabulaire partagé,
+deux ingests simultanés se marcheraient dessus.
+
+Une demande identique (même type, même racine, mêmes options) à un job
+encore en attente est fusionnée avec lui. Un job déjà en cours n'absorbe
+rien : la nouvelle demande attend son tour et verra les fichiers modifiés
+entre-temps. L'annulation est coopérative (cf. `Progress`) : un job annulé
+avant sa publication laisse les index servis inchangés.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from rag.pipelines.ingest import Cancelled, Progress
+
+log = logging.getLogger("uvicorn.error")
+
+# jobs terminés gardés pour /jobs (les plus anciens partent d'abord)
+JOBS_KEEP = int(os.getenv("LOUMINA_JOBS_KEEP", "50"))
+
+Runner = Callable[[Progress], Dict[str, Any]]
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    kind: str  # "ingest", "ingest_dense", "ingest_all"
+    params: Dict[str, Any]
+    fn: Runner
+    status: str = "queued"  # queued, running, done, failed, cancelled
+    progress: Progress = field(default_factory=Progress)
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    coalesced: int = 0  # demandes identiques fusionnées dans ce job
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    done: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.kind, json.dumps(self.params, sort_keys=True)
+
+    def info(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "params": self.params,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "secs": round(end - self.started_at, 3) if self.started_at else None,
+            "coalesced": self.coalesced,
+            "cancel_requested": self.progress.cancelled,
+            "progress": self.progress.info(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class Scheduler:
+    """File FIFO de jobs, exécutés un par un par un thread dédié (démarré au
+    premier `submit`)."""
+
+    def __init__(self, keep: int = JOBS_KEEP) -> None:
+        self.keep = keep
+        self._cond = threading.Condition()
+        self._queue: Deque[Job] = deque()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, kind: str, params: Dict[str, Any], fn: Runner) -> Job:
+        """Met un job en file, ou renvoie le job en attente identique."""
+        job = Job(uuid.uuid4().hex, kind, params, fn)
+        with self._cond:
+            for queued in self._queue:
+                if queued.key == job.key:
+                    queued.coalesced += 1
+                    return queued
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._trim()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="ingest-jobs", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        """Jobs connus, du plus récent au plus ancien."""
+        with self._cond:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Annule un job : retiré de la file s'il attend, arrêté au prochain
+        point d'annulation s'il tourne (sans effet une fois terminé)."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done.is_set():
+                return job
+            job.progress.cancel()
+            if job.status == "queued":
+                self._queue.remove(job)
+                self._finish(job, "cancelled")
+        return job
+
+    def _finish(self, job: Job, status: str) -> None:
+        job.status = job.progress.phase = status
+        job.finished_at = time.time()
+        job.done.set()
+
+    def _trim(self) -> None:
+        finished = [j for j in self._jobs.values() if j.done.is_set()]
+        for j in finished[: max(0, len(finished) - self.keep)]:
+            del self._jobs[j.id]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self._queue.popleft()
+                job.status = "running"
+                job.started_at = time.time()
+            try:
+                result = job.fn(job.progress)
+            except Cancelled:
+                status = "cancelled"
+            except Exception as exc:
+                log.exception("job %s (%s) en échec", job.id, job.kind)
+                job.error = repr(exc)
+                status = "failed"
+            else:
+                job.result = result
+                status = "done"
+            with self._cond:
+                self._finish(job, status)
+
+
+# file unique du processus (les index servis sont globaux)
+JOBS = Scheduler()
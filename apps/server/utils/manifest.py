@@ -0,0 +1,82 @@
+"""Manifeste d'ingestion : taille, mtime et hash de contenu par fichier.
+
+Permet de ne relire/retokeniser que les fichiers ajoutés ou modifiés lors
+d'un ré-ingest, et de retirer des index les fichiers supprimés. Le parcours
+lui-même est dans `rag.pipelines.ingest.scan`.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import json
+import os
+import pathlib
+
+from apps.server.utils.tokens import ParsedDoc
+
+MANIFEST_VERSION = 1
+
+
+@dataclass
+class FileEntry:
+    size: int
+    mtime: float
+    sha1: str
+
+
+@dataclass
+class Manifest:
+    root: str
+    exts: List[str]
+    files: Dict[str, FileEntry] = field(default_factory=dict)
+
+    def matches(self, root: pathlib.Path, exts: Iterable[str]) -> bool:
+        return self.root == str(root) and self.exts == sorted(set(exts))
+
+    def save(self, path: pathlib.Path) -> None:
+        data = {
+            "version": MANIFEST_VERSION,
+            "root": self.root,
+            "exts": self.exts,
+            "files": {
+                p: [e.size, e.mtime, e.sha1] for p, e in sorted(self.files.items())
+            },
+        }
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> Optional["Manifest"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MANIFEST_VERSION:
+            return None
+        files = {
+            p: FileEntry(int(s), float(m), h) for p, (s, m, h) in data["files"].items()
+        }
+        return cls(root=data["root"], exts=data["exts"], files=files)
+
+
+@dataclass
+class ScanResult:
+    manifest: Manifest
+    incremental: bool
+    changed: Iterator[ParsedDoc]  # ajoutés + modifiés, produits en flux
+    removed: List[str]  # supprimés + modifiés (à retirer des index)
+    mtimes: Dict[str, float]  # touchés : mtime changé, contenu identique
+    counts: Dict[str, int]
+    progress: Any = None  # rag.pipelines.ingest.Progress (avancement, annulation)
+
+    def stats(self) -> Dict[str, object]:
+        return {"mode": "incremental" if self.incremental else "full", **self.counts}
+
+
+def decode(data: bytes) -> str:
+    # équivalent de read_text(encoding="utf-8", errors="ignore")
+    txt = data.decode("utf-8", errors="ignore")
+    return txt.replace("\r\n", "\n").replace("\r", "\n")
@@ -0,0 +1,48 @@
+"""Tables de chaînes compactes (blob UTF-8 + offsets) mappables en mémoire."""
+
+from __future__ import annotations
+from typing import Iterable, List
+import pathlib
+
+import numpy as np
+
+
+class StringTable:
+    """Séquence de chaînes en lecture seule, décodées à la demande."""
+
+    __slots__ = ("_blob", "_off")
+
+    def __init__(self, blob: np.ndarray, off: np.ndarray) -> None:
+        self._blob = blob
+        self._off = off
+
+    @classmethod
+    def from_list(cls, items: Iterable[str]) -> "StringTable":
+        enc = [s.encode("utf-8") for s in items]
+        off = np.zeros(len(enc) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in enc], out=off[1:])
+        return cls(np.frombuffer(b"".join(enc), dtype=np.uint8), off)
+
+    def __len__(self) -> int:
+        return len(self._off) - 1
+
+    def __getitem__(self, i: int) -> str:
+        lo, hi = self._off[i], self._off[i + 1]
+        return self._blob[lo:hi].tobytes().decode("utf-8")
+
+    def tolist(self) -> List[str]:
+        data = self._blob.tobytes()
+        off = self._off.tolist()
+        return [data[off[i] : off[i + 1]].decode("utf-8") for i in range(len(self))]
+
+    def save(self, dirpath: pathlib.Path, name: str) -> None:
+        np.save(dirpath / f"{name}.npy", np.asarray(self._blob))
+        np.save(dirpath / f"{name}_off.npy", self._off)
+
+    @classmethod
+    def load(cls, dirpath: pathlib.Path, name: str, mmap: bool = True) -> "StringTable":
+        mode = "r" if mmap else None
+        return cls(
+            np.load(dirpath / f"{name}.npy", mmap_mode=mode),
+            np.load(dirpath / f"{name}_off.npy", mmap_mode=mode),
+        )
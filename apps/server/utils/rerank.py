@@ -1,42 +1,115 @@
 from __future__ import annotations
-from typing import List, Dict
-from collections import Counter
+from typing import List, Dict, Sequence, Tuple
 import math
-import re
 
+import numpy as np
 
-def _tok(t: str) -> List[str]:
-    """Tokenisation simple (mots de 2+ lettres, minuscules)."""
-    return re.findall(r"\w{2,}", t.lower())
+from apps.server.utils.spans import timed
 
+_KEY = np.int64(1) << 32  # clé (requête, terme) = qi * _KEY + term id
 
-def _cosine_dict(a: Dict[str, float], b: Dict[str, float]) -> float:
-    if not a or not b:
-        return 0.0
-    dot = sum(a[t] * b.get(t, 0.0) for t in a.keys())
-    na = math.sqrt(sum(v * v for v in a.values()))
-    nb = math.sqrt(sum(v * v for v in b.values()))
-    return (dot / (na * nb)) if (na and nb) else 0.0
 
+def query_vector(toks: List[str], term_id) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Vecteur TF creux d'une requête : (ids triés, comptes, norme).
 
-def _tf(text: str) -> Dict[str, float]:
-    c = Counter(_tok(text))
-    if not c:
-        return {}
-    n = sum(c.values())
-    return {k: v / n for k, v in c.items()}
+    Les termes sans id (`term_id` renvoie None) comptent dans la norme mais
+    ne peuvent matcher aucun snippet.
+    """
+    words, counts = np.unique(np.array(toks, dtype=str), return_counts=True)
+    norm = math.sqrt(float((counts.astype(np.float64) ** 2).sum()))
+    known = sorted(
+        (t, int(v))
+        for t, v in zip((term_id(w) for w in words.tolist()), counts)
+        if t is not None
+    )
+    tids = np.array([t for t, _ in known], dtype=np.int64)
+    cnts = np.array([v for _, v in known], dtype=np.float64)
+    return tids, cnts, norm
 
 
-def rerank_cosine(query: str, hits: List[Dict], alpha: float = 0.6) -> List[Dict]:
-    """Combine BM25 normalisé + cosinus TF(simple) sur le snippet."""
+def passage_vectors(
+    windows: Sequence[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vecteurs TF de passages donnés par leurs term ids (cf.
+    `DocTable.window_terms`), en CSR : (ptr, tids, tfs, norms).
+
+    Un seul `np.unique` sur les clés (passage, terme) compte tous les termes
+    du lot ; aucun texte n'est relu ni tokenisé.
+    """
+    n = len(windows)
+    lens = [len(w) for w in windows]
+    hit = np.repeat(np.arange(n, dtype=np.int64), lens)
+    tids = np.concatenate(windows) if n else np.zeros(0, dtype=np.int64)
+    keys, tfs = np.unique(hit * _KEY + tids.astype(np.int64), return_counts=True)
+    owner = keys // _KEY
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owner, minlength=n), out=ptr[1:])
+    tfs = tfs.astype(np.float64)
+    norms = np.sqrt(np.bincount(owner, weights=tfs**2, minlength=n))
+    return ptr, keys % _KEY, tfs, norms
+
+
+def snippet_cosines(
+    queries: Sequence[Tuple[np.ndarray, np.ndarray, float]],
+    rows: Sequence[np.ndarray],
+    ptr: np.ndarray,
+    tids: np.ndarray,
+    tfs: np.ndarray,
+    norms: np.ndarray,
+) -> List[np.ndarray]:
+    """Cosinus TF requête/snippet pour tous les hits d'un lot, en une passe.
+
+    Les snippets sont en CSR (`ptr`, `tids`, `tfs`, `norms` par doc) ; `rows[i]`
+    liste les docs à scorer pour `queries[i]`. Les termes de chaque snippet
+    sont cherchés (searchsorted) dans les clés (requête, terme) triées, puis
+    un bincount somme les produits par hit : le coût ne dépend que du nombre
+    de termes distincts des snippets, pas de leur texte.
+    """
+    sizes = [len(r) for r in rows]
+    if not sum(sizes):
+        return [np.zeros(0, dtype=np.float64) for _ in rows]
+    ids = np.concatenate(rows).astype(np.int64)
+    owner = np.repeat(np.arange(len(rows), dtype=np.int64), sizes)
+    starts = np.asarray(ptr[ids], dtype=np.int64)
+    lens = np.asarray(ptr[ids + 1], dtype=np.int64) - starts
+    hit = np.repeat(np.arange(len(ids)), lens)
+    ends = np.cumsum(lens)
+    flat = np.arange(int(ends[-1]), dtype=np.int64) + np.repeat(
+        starts - ends + lens, lens
+    )
+    keys = owner[hit] * _KEY + np.asarray(tids[flat], dtype=np.int64)
+    qkeys = np.concatenate([qi * _KEY + q[0] for qi, q in enumerate(queries)])
+    qw = np.concatenate([q[1] for q in queries])
+    dot = np.zeros(len(ids), dtype=np.float64)
+    if len(qkeys) and len(keys):
+        pos = np.minimum(np.searchsorted(qkeys, keys), len(qkeys) - 1)
+        match = qkeys[pos] == keys
+        dot = np.bincount(
+            hit[match],
+            weights=qw[pos[match]] * tfs[flat[match]],
+            minlength=len(ids),
+        )
+    qn = np.array([q[2] for q in queries], dtype=np.float64)[owner]
+    denom = qn * np.asarray(norms[ids], dtype=np.float64)
+    cos = np.divide(dot, denom, out=np.zeros_like(dot), where=denom > 0)
+    return np.split(cos, np.cumsum(sizes)[:-1])
+
+
+@timed("rerank")
+def rerank_cosine(
+    hits: List[Dict], cosines: np.ndarray, alpha: float = 0.6
+) -> List[Dict]:
+    """Combine BM25 normalisé + cosinus TF(simple) sur le snippet.
+
+    `cosines` (un par hit) est calculé pour tout un lot par
+    `snippet_cosines` (cf. `BM25Index.search_rerank_batch`).
+    """
     if not hits:
         return hits
-    qtf = _tf(query)
     max_bm25 = max(h.get("score", 0.0) for h in hits) or 1.0
     out: List[Dict] = []
-    for h in hits:
+    for h, cos in zip(hits, cosines.tolist()):
         bm25n = h.get("score", 0.0) / max_bm25
-        cos = _cosine_dict(qtf, _tf(h.get("snippet", "")))
         sc = alpha * bm25n + (1 - alpha) * cos
         hh = dict(h)
         hh["rerank"] = {"bm25_n": bm25n, "cosine": cos, "score": sc}
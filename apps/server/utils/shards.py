@@ -0,0 +1,63 @@
+"""Mode shardé optionnel : index découpés en N shards par hash du chemin.
+
+Avec LOUMINA_SHARDS=N > 1, les postings BM25 et le graphe HNSW sont
+partitionnés en N shards selon un hash stable du chemin de chaque document.
+Une requête est évaluée sur tous les shards dans un pool de threads (NumPy
+et hnswlib relâchent le GIL sur l'essentiel du calcul), puis les top-k
+partiels sont fusionnés. La construction des shards se fait aussi en
+parallèle. Les statistiques BM25 (IDF, longueur moyenne) restent globales :
+les scores ne dépendent pas du découpage.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, List, Sequence, TypeVar
+import os
+import zlib
+
+import numpy as np
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+SHARDS = max(1, int(os.getenv("LOUMINA_SHARDS", "1")))
+
+# BM25 et dense peuvent fan-out en même temps (requête hybride)
+_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LOUMINA_SHARD_WORKERS", str(2 * SHARDS))),
+    thread_name_prefix="shard",
+)
+
+
+def shard_of(paths: Sequence[str], n: int) -> np.ndarray:
+    """Shard de chaque chemin (crc32 : stable d'un processus à l'autre)."""
+    if n <= 1:
+        return np.zeros(len(paths), dtype=np.int64)
+    return np.fromiter(
+        (zlib.crc32(p.encode("utf-8")) % n for p in paths),
+        dtype=np.int64,
+        count=len(paths),
+    )
+
+
+def split(owner: np.ndarray, n: int) -> List[np.ndarray]:
+    """Positions de chaque shard dans `owner` (ordre d'origine conservé)."""
+    if n <= 1:
+        return [np.arange(len(owner))]
+    order = np.argsort(owner, kind="stable")
+    bounds = np.searchsorted(owner[order], np.arange(n + 1))
+    return [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def fan_out(fn: Callable[[T], R], items: Sequence[T]) -> List[R]:
+    """`fn` sur chaque item, en parallèle s'il y en a plusieurs (ordre conservé).
+
+    copy_context : les spans ouverts dans `fn` comptent dans la requête.
+    Ne pas imbriquer (un shard qui fan-out à son tour pourrait attendre un
+    thread du même pool).
+    """
+    if len(items) <= 1:
+        return [fn(it) for it in items]
+    futures = [_POOL.submit(copy_context().run, fn, it) for it in items]
+    return [f.result() for f in futures]
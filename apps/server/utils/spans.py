@@ -0,0 +1,118 @@
+"""Spans légers par étape (tokenisation, BM25, HNSW, fusion, rerank, agents).
+
+Le middleware de traces ouvre un `Spans` par requête dans une ContextVar,
+associé au trace_id ; `span(nom)` / `@timed(nom)` y cumulent la durée de
+chaque étape (en ms). Hors requête tracée (ou avec LOUMINA_SPANS=0), le coût
+se limite à une lecture de ContextVar et un objet no-op partagé.
+
+Les pools de threads ne propagent pas le contexte : soumettre avec
+`contextvars.copy_context().run` pour que les étapes y soient comptées.
+"""
+
+from __future__ import annotations
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+import functools
+import os
+import threading
+import time
+
+F = TypeVar("F", bound=Callable)
+
+ENABLED = os.getenv("LOUMINA_SPANS", "1").lower() not in ("0", "false", "no")
+
+
+class Spans:
+    """Durées cumulées (ms) par étape pour une requête."""
+
+    __slots__ = ("trace_id", "stages", "_lock")
+
+    def __init__(self, trace_id: str) -> None:
+        self.trace_id = trace_id
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()  # étapes possibles sur plusieurs threads
+
+    def add(self, name: str, ms: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def server_timing(self) -> str:
+        """Valeur d'en-tête `Server-Timing` (une métrique par étape)."""
+        with self._lock:
+            return ", ".join(f"{k};dur={v:.2f}" for k, v in self.stages.items())
+
+
+_CURRENT: ContextVar[Optional[Spans]] = ContextVar("loumina_spans", default=None)
+
+
+class _Span:
+    __slots__ = ("rec", "name", "t0")
+
+    def __init__(self, rec: Spans, name: str) -> None:
+        self.rec = rec
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc) -> bool:
+        self.rec.add(self.name, (time.perf_counter() - self.t0) * 1000.0)
+        return False
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_NOOP = _Noop()
+
+
+def span(name: str):
+    """Context manager chronométrant l'étape `name` de la requête courante."""
+    rec = _CURRENT.get()
+    if rec is None:
+        return _NOOP
+    return _Span(rec, name)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Décorateur : chaque appel compte dans l'étape `name`."""
+
+    def deco(fn: F) -> F:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            rec = _CURRENT.get()
+            if rec is None:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                rec.add(name, (time.perf_counter() - t0) * 1000.0)
+
+        return wrapper  # type: ignore[return-value]
+
+    return deco
+
+
+def begin(trace_id: str) -> Tuple[Optional[Spans], Optional[Token]]:
+    """Ouvre les spans d'une requête (no-op si LOUMINA_SPANS=0)."""
+    if not ENABLED:
+        return None, None
+    rec = Spans(trace_id)
+    return rec, _CURRENT.set(rec)
+
+
+def end(token: Optional[Token]) -> None:
+    if token is not None:
+        _CURRENT.reset(token)
+
+
+def current() -> Optional[Spans]:
+    return _CURRENT.get()
@@ -0,0 +1,161 @@
+"""Tokenisation et vocabulaire partagés par les index BM25 et dense."""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import re
+import threading
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w{2,}")
+# mêmes tokens, capturés : split alterne séparateurs et tokens
+_SPLIT_RE = re.compile(r"(\w{2,})")
+SNIPPET_CHARS = 280
+
+
+def tokenize(txt: str) -> List[str]:
+    """Tokenisation simple (mots de 2+ lettres, minuscules)."""
+    return _TOKEN_RE.findall(txt.lower())
+
+
+def tokenize_spans(txt: str) -> Tuple[List[str], np.ndarray]:
+    """Tokens (comme `tokenize`) et leurs positions dans `txt`, en un passage.
+
+    Positions : tableau (3, n) int32 de (début, fin) en octets UTF-8 et
+    numéro de ligne (à partir de 1) de chaque token.
+    """
+    low = txt.lower()
+    parts = _SPLIT_RE.split(low)
+    lens = np.fromiter(map(len, parts), dtype=np.int64, count=len(parts))
+    ends = np.cumsum(lens)
+    start, end = (ends - lens)[1::2], ends[1::2]
+    if txt.isascii():
+        codes = np.frombuffer(txt.encode("ascii"), dtype=np.uint8)
+        start_b, end_b = start, end
+    else:
+        codes = np.frombuffer(txt.encode("utf-32-le"), dtype=np.uint32)
+        width = 1 + (codes >= 0x80) + (codes >= 0x800) + (codes >= 0x10000)
+        off = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(width, out=off[1:])
+        # minuscule de longueur différente (rare) : offsets approchés
+        start_b = off[np.minimum(start, len(codes))]
+        end_b = off[np.minimum(end, len(codes))]
+    lines = np.searchsorted(np.flatnonzero(codes == 10), start) + 1
+    return parts[1::2], np.stack([start_b, end_b, lines]).astype(np.int32)
+
+
+def positions(tids: np.ndarray, spans: np.ndarray) -> np.ndarray:
+    """Index positionnel d'un doc : (4, n) int32 (terme, début, fin, ligne).
+
+    Trié par (terme, début) : les occurrences d'un terme se trouvent par
+    recherche dichotomique, sans parcourir le document.
+    """
+    order = np.lexsort((spans[0], tids))
+    return np.vstack([tids[order], spans[:, order]]).astype(np.int32)
+
+
+def snippet(text: str) -> str:
+    return text[:SNIPPET_CHARS].replace("\n", " ")
+
+
+@dataclass
+class ParsedDoc:
+    """Document lu et tokenisé (flux d'ingestion).
+
+    `text` n'est gardé que jusqu'à son rangement dans un DocStore, qui pose
+    alors `store` / `doc_id` et libère le texte (cf. DocStore.put).
+    """
+
+    path: str
+    mtime: float
+    tokens: List[str]
+    text: Optional[str] = None
+    doc_id: int = -1
+    store: Any = None
+    spans: Optional[np.ndarray] = None  # cf. tokenize_spans
+
+
+@dataclass
+class TermDoc:
+    """Document réduit à ses term ids (triés) et fréquences, pour les index."""
+
+    path: str
+    mtime: float
+    tids: np.ndarray  # int32, uniques et triés
+    tfs: np.ndarray  # int32
+    text: Optional[str] = None
+    doc_id: int = -1
+    store: Any = None
+    positions: Optional[np.ndarray] = None  # cf. positions()
+
+    @property
+    def length(self) -> int:
+        return int(self.tfs.sum())
+
+
+class Vocab:
+    """Vocabulaire terme -> id, en ajout seul et thread-safe.
+
+    Les ids ne changent jamais : un index construit sur un préfixe du
+    vocabulaire reste valide quand d'autres termes sont ajoutés.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._words: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    def get(self, word: str) -> Optional[int]:
+        return self._ids.get(word)
+
+    def words(self, n: Optional[int] = None) -> List[str]:
+        return self._words[:n] if n is not None else list(self._words)
+
+    def intern(self, toks: List[str]) -> np.ndarray:
+        """Ids des tokens (dans l'ordre), en ajoutant les termes inconnus."""
+        with self._lock:
+            ids, words = self._ids, self._words
+            out = np.empty(len(toks), dtype=np.int32)
+            for i, t in enumerate(toks):
+                j = ids.get(t)
+                if j is None:
+                    j = ids[t] = len(words)
+                    words.append(t)
+                out[i] = j
+            return out
+
+    def adopt(self, words: List[str]) -> Optional[np.ndarray]:
+        """Fusionne un vocabulaire persisté ; renvoie le remapping ancien -> id.
+
+        Renvoie None quand `words` est cohérent avec les ids courants (cas
+        normal : préfixe commun), ce qui évite toute renumérotation.
+        """
+        with self._lock:
+            n = min(len(words), len(self._words))
+            same = self._words[:n] == words[:n]
+        if same:
+            self.intern(words[n:])
+            return None
+        return self.intern(words)
+
+    def term_doc(self, doc: ParsedDoc) -> TermDoc:
+        seq = self.intern(doc.tokens)
+        uniq, cnt = np.unique(seq, return_counts=True)
+        return TermDoc(
+            doc.path,
+            doc.mtime,
+            uniq.astype(np.int32),
+            cnt.astype(np.int32),
+            doc.text,
+            doc.doc_id,
+            doc.store,
+            positions(seq, doc.spans) if doc.spans is not None else None,
+        )
+
+
+# vocabulaire commun à INDEX et VSTORE
+VOCAB = Vocab()
@@ -1,158 +1,1316 @@
 from __future__ import annotations
-from typing import List, Dict, Iterable, Optional
-from dataclasses import dataclass
-from collections import Counter
+from typing import (
+    Any,
+    Callable,
+    List,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from dataclasses import dataclass, field, replace
+import threading
 import numpy as np
 import hnswlib
 import pathlib
-import os
+import hashlib
 import json
-import re
+import os
+import pickle
+import shutil
 import time
 
-from apps.server.utils.indexer import Doc, load_corpus
+from apps.server.utils.docstore import EMPTY_TABLE, DocStore, DocTable
+from apps.server.utils.filters import DocFilter, MaskCache
+from apps.server.utils.generation import PUBLISH_LOCK, next_generation, observe
+from apps.server.utils.indexer import DEFAULT_EXTS, DOCS, STATE_DIR
+from apps.server.utils.manifest import Manifest
+from apps.server.utils.packed import StringTable
+from apps.server.utils.shards import SHARDS, fan_out, shard_of
+from apps.server.utils.spans import span
+from apps.server.utils.tokens import VOCAB, ParsedDoc, TermDoc, Vocab, tokenize
+from rag.pipelines.ingest import Progress, scan
+
+# index HNSW + métadonnées en colonnes (.npy, tables de chaînes) mappables
+DENSE_DIR = STATE_DIR / "dense"
+DENSE_FORMAT_VERSION = 2
+MANIFEST_PATH = STATE_DIR / "dense_manifest.json"
+TUNING_PATH = STATE_DIR / "dense_tuning.json"
+DOCS_PATH = STATE_DIR / "dense_docs"  # textes, si le store n'est pas partagé
+
+BUILD_BATCH = int(os.getenv("LOUMINA_DENSE_BATCH", "2048"))
+# mode "hash" : chaque terme est projeté sur HASH_FANOUT dimensions signées
+HASH_FANOUT = 4
+HASH_SEED = 1337
+RECALL_K = 10
+
+HNSW_M = int(os.getenv("LOUMINA_HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("LOUMINA_HNSW_EF_CONSTRUCTION", "200"))
+# réglage de ef après construction : plus petit ef atteignant la cible de
+# recall@k, par tranche de k (0 requête : pas de réglage, ef = max(50, k))
+TUNE_QUERIES = int(os.getenv("LOUMINA_HNSW_TUNE_QUERIES", "200"))
+RECALL_TARGET = float(os.getenv("LOUMINA_HNSW_RECALL", "0.95"))
+K_BUCKETS = (1, 5, 10, 20, 50, 100)
+EF_LADDER = (16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512, 768, 1024, 1536, 2048)
+DEFAULT_EF = 50
+EF_MAX = int(os.getenv("LOUMINA_HNSW_EF_MAX", "1024"))
 
-STATE_DIR = pathlib.Path(os.getenv("LOUMINA_STATE", "/app/state"))
-STATE_DIR.mkdir(parents=True, exist_ok=True)
-INDEX_PATH = STATE_DIR / "dense.index"
-META_PATH = STATE_DIR / "dense_meta.json"
+# mises à jour incrémentales : places libres laissées à la construction,
+# compaction (reconstruction) au-delà de COMPACT_RATIO labels supprimés, et
+# reconstruction du vocabulaire (figé entre deux) quand les termes hors
+# vocabulaire insérés depuis dépassent OOV_REBUILD de la masse du corpus
+HNSW_HEADROOM = 0.25
+COMPACT_RATIO = float(os.getenv("LOUMINA_HNSW_COMPACT", "0.3"))
+OOV_REBUILD = float(os.getenv("LOUMINA_DENSE_OOV_REBUILD", "0.1"))
+# recherche filtrée : cosinus exact si le filtre admet au plus ce nombre de
+# docs (le callback `filter` de hnswlib s'effondre sur les filtres sélectifs)
+FILTER_EXACT_MAX = int(os.getenv("LOUMINA_FILTER_EXACT_MAX", "4096"))
 
-_TOKEN_RE = re.compile(r"\w{2,}")
+Counts = Dict[str, Tuple[np.ndarray, np.ndarray]]  # path -> (term ids, comptes)
 
 
-def _tok(text: str) -> List[str]:
-    return _TOKEN_RE.findall(text.lower())
+def n_threads() -> int:
+    """Cœurs réellement disponibles (affinité CPU du conteneur)."""
+    env = os.getenv("LOUMINA_THREADS")
+    if env:
+        return max(1, int(env))
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return os.cpu_count() or 1
 
 
 @dataclass
 class DenseMeta:
     dim: int
     vocab: List[str]
-    docs: List[Dict]  # [{"id":int,"path":str,"len":int,"snippet":str,"mtime":float}]
+    # label HNSW i -> chemin / id dans le DocStore ; labels jamais réutilisés,
+    # ("", -1) pour un label supprimé (marqué dans l'index)
+    paths: Sequence[str]  # StringTable une fois chargé
+    doc_ids: np.ndarray
+    embedding: str = "bow"  # "bow" | "hash"
+    seed: int = HASH_SEED
+    # masse de termes hors vocabulaire insérée depuis la construction, et
+    # masse totale (corpus construit + insertions)
+    oov_mass: float = 0.0
+    total_mass: float = 0.0
+
+    def live(self) -> Tuple[np.ndarray, List[str]]:
+        """Labels vivants (croissants) et leurs chemins."""
+        labels = np.flatnonzero(np.asarray(self.doc_ids) >= 0)
+        paths = _strings(self.paths)
+        return labels, [paths[i] for i in labels.tolist()]
+
+
+def _strings(seq: Sequence[str]) -> List[str]:
+    return seq.tolist() if isinstance(seq, StringTable) else list(seq)
+
+
+def _hash_features(term: str, dim: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Projection aléatoire creuse d'un terme : HASH_FANOUT coordonnées signées.
+
+    Hash stable (blake2b) : la même projection est recalculable au chargement
+    et pour les requêtes, sans matrice ni vocabulaire à stocker.
+    """
+    h = hashlib.blake2b(
+        term.encode("utf-8"),
+        digest_size=4 * HASH_FANOUT,
+        key=seed.to_bytes(8, "little"),
+    ).digest()
+    v = np.frombuffer(h, dtype="<u4").astype(np.int64)
+    signs = np.where(v >> 31, -1.0, 1.0).astype(np.float32)
+    return v % dim, signs
+
+
+def _ef_for(ef_table: Dict[int, int], k: int) -> int:
+    """ef réglé pour `k` : celui de la plus petite tranche >= k (0 si non réglé)."""
+    for bucket in sorted(ef_table):
+        if bucket >= k:
+            return ef_table[bucket]
+    return ef_table[max(ef_table)] if ef_table else 0
+
+
+def _ef_floor(ef_table: Dict[int, int]) -> int:
+    return min(ef_table.values()) if ef_table else DEFAULT_EF
+
+
+class ShardedHnsw:
+    """Graphe HNSW découpé en shards hnswlib (labels globaux).
+
+    L'appelant choisit le shard de chaque label à l'insertion (hash du
+    chemin, cf. `shards.shard_of`) ; `owner` retient ce choix (-1 - shard
+    pour un label supprimé). Expose le sous-ensemble de l'API hnswlib.Index
+    utilisé par DenseStore : `knn_query` interroge les shards en parallèle
+    et fusionne leurs voisins par distance.
+    """
+
+    def __init__(self, parts: List[hnswlib.Index], owner: np.ndarray) -> None:
+        self.parts = parts
+        self.owner = owner
+        self.live = np.bincount(owner[owner >= 0], minlength=len(parts))
+
+    @classmethod
+    def create(
+        cls, dim: int, capacities: Sequence[int], ef_construction: int, M: int
+    ) -> "ShardedHnsw":
+        parts = []
+        for cap in capacities:
+            part = hnswlib.Index(space="cosine", dim=dim)
+            part.init_index(
+                max_elements=max(1, cap), ef_construction=ef_construction, M=M
+            )
+            parts.append(part)
+        return cls(parts, np.zeros(0, dtype=np.int16))
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.parts)
+
+    def get_current_count(self) -> int:
+        """Labels alloués (supprimés compris) : les labels vont de 0 à count - 1."""
+        return len(self.owner)
+
+    def shard_counts(self, labels: np.ndarray) -> np.ndarray:
+        """Nombre de `labels` dans chaque shard."""
+        owner = self.owner[labels]
+        return np.bincount(
+            np.where(owner >= 0, owner, -1 - owner), minlength=self.n_shards
+        )
+
+    def grown(self, shards: np.ndarray) -> Optional["ShardedHnsw"]:
+        """Copie privée agrandie s'il faut de la place pour des labels de `shards`.
+
+        Seuls les shards trop pleins sont recopiés (capacité doublée : coût
+        amorti) ; les autres restent partagés avec l'index publié.
+        """
+        need = np.bincount(shards, minlength=self.n_shards).tolist()
+        parts = list(self.parts)
+        for s, part in enumerate(parts):
+            count = part.get_current_count() + need[s]
+            if count > part.get_max_elements():
+                part = pickle.loads(pickle.dumps(part))
+                part.resize_index(max(count, 2 * part.get_max_elements()))
+                parts[s] = part
+        if all(a is b for a, b in zip(parts, self.parts)):
+            return None
+        return ShardedHnsw(parts, self.owner)
+
+    def add_items(
+        self, data: np.ndarray, labels: np.ndarray, shards: np.ndarray, num_threads: int
+    ) -> None:
+        """Insère `data` sous `labels` ; les shards sont remplis en parallèle."""
+        sel = [np.flatnonzero(shards == s) for s in range(self.n_shards)]
+        sel = [(s, idx) for s, idx in enumerate(sel) if len(idx)]
+        threads = max(1, num_threads // max(1, len(sel)))
+        fan_out(
+            lambda it: self.parts[it[0]].add_items(
+                data[it[1]], labels[it[1]], num_threads=threads
+            ),
+            sel,
+        )
+        owner = np.full(max(len(self.owner), int(labels.max()) + 1), -1, np.int16)
+        owner[: len(self.owner)] = self.owner
+        owner[labels] = shards
+        # nouveau tableau : les lecteurs en cours gardent l'ancien
+        self.owner = owner
+        self.live = self.live + np.bincount(shards, minlength=self.n_shards)
+
+    def mark_deleted(self, label: int) -> None:
+        """Marque `label` supprimé (sans effet s'il l'est déjà)."""
+        s = int(self.owner[label])
+        if s < 0:
+            return  # owner = -1 - shard : déjà supprimé
+        self.parts[s].mark_deleted(label)
+        self.owner[label] = -1 - s
+        self.live[s] -= 1
+
+    def get_items(self, labels: np.ndarray, return_type: str = "numpy") -> np.ndarray:
+        labels = np.asarray(labels, dtype=np.int64)
+        owner = self.owner[labels]
+        out: Optional[np.ndarray] = None
+        for s, part in enumerate(self.parts):
+            idx = np.flatnonzero(owner == s)
+            if not len(idx):
+                continue
+            vecs = np.asarray(part.get_items(labels[idx], return_type="numpy"))
+            if out is None:
+                out = np.zeros((len(labels), vecs.shape[1]), dtype=vecs.dtype)
+            out[idx] = vecs
+        return out if out is not None else np.zeros((len(labels), 0), np.float32)
+
+    def set_ef(self, ef: int) -> None:
+        for part in self.parts:
+            part.set_ef(ef)
+
+    def knn_query(
+        self,
+        qmat: np.ndarray,
+        k: int,
+        num_threads: int = 1,
+        filter: Optional[Callable[[int], bool]] = None,
+        limits: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """k voisins par requête, toutes partitions confondues.
+
+        `limits` : voisins disponibles par shard (par défaut les labels
+        vivants). RuntimeError, comme hnswlib, si moins de k sont atteignables.
+        """
+        limits = self.live if limits is None else limits
+        ks = [(s, min(k, int(n))) for s, n in enumerate(limits.tolist()) if n > 0]
+        if sum(kk for _, kk in ks) < k:
+            raise RuntimeError(f"fewer than {k} elements reachable")
+        threads = max(1, num_threads // len(ks))
+        found = fan_out(
+            lambda it: self.parts[it[0]].knn_query(
+                qmat, k=it[1], num_threads=threads, filter=filter
+            ),
+            ks,
+        )
+        if len(found) == 1:
+            return found[0]
+        labels = np.concatenate([lab for lab, _ in found], axis=1)
+        dists = np.concatenate([d for _, d in found], axis=1)
+        top = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return (
+            np.take_along_axis(labels, top, axis=1),
+            np.take_along_axis(dists, top, axis=1),
+        )
+
+    def save(self, dirpath: pathlib.Path) -> None:
+        for s, part in enumerate(self.parts):
+            part.save_index(str(dirpath / f"index.{s}.bin"))
+        np.save(dirpath / "owner.npy", self.owner)
+
+    @classmethod
+    def load(cls, dirpath: pathlib.Path, dim: int, n_shards: int) -> "ShardedHnsw":
+        parts = []
+        for s in range(n_shards):
+            part = hnswlib.Index(space="cosine", dim=dim)
+            part.load_index(str(dirpath / f"index.{s}.bin"))
+            parts.append(part)
+        # copie en mémoire : mark_deleted écrit dans `owner`
+        return cls(parts, np.load(dirpath / "owner.npy"))
+
+
+def tune_ef(
+    index: ShardedHnsw,
+    n_queries: int = TUNE_QUERIES,
+    target: float = RECALL_TARGET,
+    buckets: Tuple[int, ...] = K_BUCKETS,
+    labels: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """Plus petit ef atteignant `target` en recall@k, pour chaque tranche de k.
+
+    Requêtes tenues à l'écart : des vecteurs de l'index tirés au hasard, dont
+    le doc lui-même est exclu des voisins (exacts comme approchés). Le recall
+    tolère les égalités de similarité. `labels` : labels vivants (par défaut
+    0..n-1). Modifie l'ef de `index` : à appeler avant publication.
+    """
+    if labels is None:
+        labels = np.arange(index.get_current_count())
+    n = len(labels)
+    m = min(n_queries, n)
+    buckets = tuple(b for b in buckets if b < n)
+    if m <= 0 or not buckets:
+        return {}
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(0)
+    qpos = np.sort(rng.choice(n, size=m, replace=False))
+    qids = labels[qpos]
+    qmat = np.asarray(index.get_items(qids, return_type="numpy"), dtype=np.float32)
+    keep = np.linalg.norm(qmat, axis=1) > 0  # docs sans terme du vocabulaire
+    qpos, qids, qmat = qpos[keep], qids[keep], qmat[keep]
+    m = len(qids)
+    if not m:
+        return {}
+    kmax = max(buckets)
+    rows = np.arange(m)
+    best = np.zeros((m, 0), dtype=np.float32)
+    for lo in range(0, n, BUILD_BATCH):
+        ids = labels[lo : lo + BUILD_BATCH]
+        sims = qmat @ np.asarray(index.get_items(ids, return_type="numpy")).T
+        own = (qpos >= lo) & (qpos < lo + len(ids))
+        sims[rows[own], qpos[own] - lo] = -np.inf
+        best = np.concatenate([best, sims], axis=1)
+        if best.shape[1] > kmax:
+            best = -np.partition(-best, kmax - 1, axis=1)[:, :kmax]
+    exact = -np.sort(-best, axis=1)
+
+    index.set_ef(1)  # ef effectif = max(ef, k) : piloté par le k demandé
+    ef_table: Dict[int, int] = {}
+    recall: Dict[int, float] = {}
+    threads = n_threads()
+    for k in buckets:
+        kth = exact[:, k - 1 : k]
+        top = min(EF_MAX, n - 1)
+        ladder = sorted({k, *(ef for ef in EF_LADDER if k < ef < top), top})
+        best_ef, best_r = k, -1.0
+        for ef in ladder:
+            try:
+                found, dists = index.knn_query(
+                    qmat, k=min(max(k, ef) + 1, n), num_threads=threads
+                )
+            except RuntimeError:  # graphe pas assez connexe pour k' voisins
+                continue
+            # premiers k voisins hors le doc requête lui-même
+            order = np.argsort(found == qids[:, None], axis=1, kind="stable")
+            sims = 1.0 - np.take_along_axis(dists, order[:, :k], axis=1)
+            r = float(((sims >= kth - 1e-5).sum()) / (k * m))
+            if r > best_r:
+                best_ef, best_r = ef, r
+            if r >= target:
+                break
+        # cible non atteinte : meilleur ef mesuré (le plus petit à égalité)
+        ef_table[k], recall[k] = best_ef, round(max(best_r, 0.0), 4)
+    index.set_ef(_ef_floor(ef_table))
+    return {
+        "target": target,
+        "queries": m,
+        "ef": ef_table,
+        "recall": recall,
+        "secs": round(time.perf_counter() - t0, 3),
+    }
+
+
+@dataclass(frozen=True)
+class _DenseSnapshot:
+    """Génération immuable du store dense (publiée par échange de référence).
+
+    Une mise à jour incrémentale ajoute ses labels (nouveaux, jamais
+    réutilisés) à l'index HNSW publié, qu'elle partage avec le snapshot
+    précédent (sauf agrandissement : copie) ; un snapshot ignore les labels
+    absents de ses métadonnées. Les labels morts (`dead`) ne sont marqués
+    supprimés qu'à la publication : un prepare abandonné (annulation,
+    erreur) laisse intact l'index servi. Une reconstruction crée un nouvel
+    index à côté.
+    """
+
+    index: Optional[ShardedHnsw] = None
+    meta: Optional[DenseMeta] = None
+    v2i: Dict[str, int] = field(default_factory=dict)
+    dead: Tuple[int, ...] = ()  # labels à marquer supprimés par `install`
+    # comptes de termes par doc, pour ré-embedder sans relire les fichiers :
+    # dict après un prepare, CSR (ptr, tids, cnts) par label après chargement
+    counts: Counts = field(default_factory=dict)
+    rows: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+    table: DocTable = EMPTY_TABLE  # snippets et mtimes (DocStore)
+    live: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    # table terme -> (dims, poids) pour l'embedding de cette génération
+    feat_dims: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 1), dtype=np.int64)
+    )
+    feat_w: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 1), dtype=np.float32)
+    )
+    generation: int = 0
+    # réglage HNSW : {"ef": {k: ef}, "recall": {k: r}, ...} (cf. tune_ef)
+    tuning: Dict[str, Any] = field(default_factory=dict)
+    stats: Dict[str, Any] = field(default_factory=dict, compare=False)
+
+    def term_counts(self) -> Counts:
+        """Comptes de termes par chemin (découpés dans le CSR si chargé)."""
+        if self.rows is None or self.meta is None:
+            return self.counts
+        ptr, tids, cnts = self.rows
+        b = ptr.tolist()
+        labels, paths = self.meta.live()
+        return {
+            p: (tids[b[j] : b[j + 1]], cnts[b[j] : b[j + 1]])
+            for j, p in zip(labels.tolist(), paths)
+        }
+
+    def knn(
+        self,
+        qmat: np.ndarray,
+        k: int,
+        num_threads: int = 1,
+        filter: Optional[Callable[[int], bool]] = None,
+        limits: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """knn_query avec l'ef réglé pour `k`, sans toucher l'état de l'index.
+
+        hnswlib cherche avec ef = max(ef, k) : on demande max(k, ef_k)
+        voisins puis on tronque à k. `filter` (label -> admis) est passé à
+        hnswlib ; `limits` (docs admis par shard) borne alors les voisins
+        demandés.
+        """
+        assert self.index is not None
+        n = self.index.get_current_count() if limits is None else int(limits.sum())
+        kq = min(max(k, _ef_for(self.tuning.get("ef", {}), k)), n)
+        try:
+            labels, dists = self.index.knn_query(
+                qmat, k=kq, num_threads=num_threads, filter=filter, limits=limits
+            )
+        except RuntimeError:
+            if kq == k:
+                raise
+            # kq voisins hors d'atteinte : recherche à ef = max(plancher, k)
+            labels, dists = self.index.knn_query(
+                qmat, k=k, num_threads=num_threads, filter=filter, limits=limits
+            )
+        return labels[:, :k], dists[:, :k]
+
+    def exact(
+        self, qmat: np.ndarray, labels: np.ndarray, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """k plus proches voisins exacts parmi `labels` (distances cosinus)."""
+        assert self.index is not None
+        vecs = np.asarray(self.index.get_items(labels, return_type="numpy"))
+        sims = qmat @ vecs.T  # vecteurs stockés normalisés (espace cosine)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(
+            top, np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1), axis=1
+        )
+        return labels[top], 1.0 - np.take_along_axis(sims, top, axis=1)
 
 
 class DenseStore:
-    def __init__(self) -> None:
-        self.index: Optional[hnswlib.Index] = None
-        self.meta: Optional[DenseMeta] = None
-        self.v2i: Dict[str, int] = {}
-
-    def _build_vocab(self, docs: List[Doc], max_vocab: int = 4096) -> List[str]:
-        cnt = Counter()
-        for d in docs:
-            cnt.update(_tok(d.text))
-        return [w for w, _ in cnt.most_common(max_vocab)]
-
-    def _embed(self, text: str) -> np.ndarray:
-        dim = len(self.v2i)
-        if dim <= 0:
+    """Store dense (HNSW cosinus) publié par snapshots immuables.
+
+    Les constructions se font hors service puis `install` remplace `_snap`
+    en une affectation ; les recherches lisent `_snap` une seule fois et
+    voient toujours un couple (vocabulaire, index) cohérent, sans verrou.
+
+    Un ingest incrémental n'embedde que les docs ajoutés ou modifiés
+    (cf. `prepare`) : son coût suit le changement, pas la taille du corpus.
+    """
+
+    def __init__(
+        self,
+        vocab: Optional[Vocab] = None,
+        store: Optional[DocStore] = None,
+        shards: int = SHARDS,
+    ) -> None:
+        # vocabulaire et store de documents éventuellement partagés avec BM25
+        self._vocab = vocab if vocab is not None else Vocab()
+        self._owns_store = store is None
+        self._store = store if store is not None else DocStore(DOCS_PATH, self._vocab)
+        self._store.attach(self)
+        self._load_lock = threading.Lock()
+        # un seul prepare à la fois : les labels sont alloués dans l'index partagé
+        self._write_lock = threading.Lock()
+        self._masks = MaskCache()
+        # graphe HNSW découpé par hash du chemin (cf. ShardedHnsw)
+        self.n_shards = max(1, shards)
+        self._loaded = False
+        self._snap = _DenseSnapshot()
+
+    @property
+    def index(self) -> Optional[ShardedHnsw]:
+        return self._snap.index
+
+    @property
+    def meta(self) -> Optional[DenseMeta]:
+        return self._snap.meta
+
+    @property
+    def v2i(self) -> Dict[str, int]:
+        return self._snap.v2i
+
+    @property
+    def generation(self) -> int:
+        return self._snap.generation
+
+    def _build_vocab(self, counts: Counts, max_vocab: int = 4096) -> List[str]:
+        # équivalent de Counter.most_common : fréquence décroissante,
+        # égalités dans l'ordre de première apparition
+        if not counts:
+            return []
+        tids = np.concatenate([t for t, _ in counts.values()])
+        cnts = np.concatenate([c for _, c in counts.values()])
+        freq = np.bincount(tids, weights=cnts, minlength=len(self._vocab))
+        order = np.argsort(-freq, kind="stable")
+        order = order[freq[order] > 0][:max_vocab]
+        words = self._vocab.words()
+        return [words[i] for i in order.tolist()]
+
+    @staticmethod
+    def _features(snap: _DenseSnapshot, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        meta = snap.meta
+        assert meta is not None
+        if meta.embedding == "hash":
+            return _hash_features(term, meta.dim, meta.seed)
+        i = snap.v2i.get(term)
+        if i is None:
+            return np.zeros(0, np.int64), np.zeros(0, np.float32)
+        return np.array([i]), np.ones(1, np.float32)
+
+    def _embed(self, snap: _DenseSnapshot, text: str) -> np.ndarray:
+        meta = snap.meta
+        if meta is None or meta.dim <= 0:
             return np.zeros(1, dtype=np.float32)
-        vec = np.zeros(dim, dtype=np.float32)
-        for w in _tok(text):
-            i = self.v2i.get(w)
-            if i is not None:
-                vec[i] += 1.0
+        vec = np.zeros(meta.dim, dtype=np.float32)
+        for w in tokenize(text):
+            dims, ws = self._features(snap, w)
+            np.add.at(vec, dims, ws)
         n = np.linalg.norm(vec)
         if n > 0:
             vec /= n
         return vec
 
+    def _feature_table(
+        self, embedding: str, dim: int, seed: int, v2i: Dict[str, int], start: int = 0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Table terme -> (dims, poids) pour les term ids >= `start`."""
+        words = self._vocab.words()[start:]
+        n = len(words)
+        if embedding == "hash":
+            dims = np.zeros((n, HASH_FANOUT), dtype=np.int64)
+            ws = np.zeros((n, HASH_FANOUT), dtype=np.float32)
+            for t, w in enumerate(words):
+                dims[t], ws[t] = _hash_features(w, dim, seed)
+        else:
+            dims = np.zeros((n, 1), dtype=np.int64)
+            ws = np.zeros((n, 1), dtype=np.float32)
+            for w, i in v2i.items():
+                t = self._vocab.get(w)
+                if t is not None and t >= start:
+                    dims[t - start, 0] = i
+                    ws[t - start, 0] = 1.0
+        return dims, ws
+
+    def _snap_features(self, snap: _DenseSnapshot) -> Tuple[np.ndarray, np.ndarray]:
+        """Table de `snap` complétée pour les termes internés depuis.
+
+        Vocabulaire figé : un terme nouveau n'a de dimension qu'en mode hash.
+        """
+        meta = snap.meta
+        assert meta is not None
+        start = len(snap.feat_dims)
+        if start >= len(self._vocab):
+            return snap.feat_dims, snap.feat_w
+        dims, ws = self._feature_table(
+            meta.embedding, meta.dim, meta.seed, snap.v2i, start
+        )
+        if not start:
+            return dims, ws
+        return (
+            np.concatenate([snap.feat_dims, dims]),
+            np.concatenate([snap.feat_w, ws]),
+        )
+
+    @staticmethod
+    def _embed_docs(
+        counts: Counts,
+        paths: List[str],
+        dim: int,
+        feat_dims: np.ndarray,
+        feat_w: np.ndarray,
+    ) -> np.ndarray:
+        """Embeddings L2-normalisés d'un lot de docs (un seul bincount)."""
+        lens = np.array([len(counts[p][0]) for p in paths], dtype=np.int64)
+        if not lens.sum():
+            return np.zeros((len(paths), dim), dtype=np.float32)
+        tids = np.concatenate([counts[p][0] for p in paths])
+        vals = np.concatenate([counts[p][1] for p in paths])
+        rows = np.repeat(np.arange(len(paths)), lens)
+        flat = rows[:, None] * dim + feat_dims[tids]
+        w = feat_w[tids] * vals[:, None]
+        block = np.bincount(
+            flat.ravel(), weights=w.ravel(), minlength=len(paths) * dim
+        ).astype(np.float32)
+        block = block.reshape(len(paths), dim)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        np.divide(block, norms, out=block, where=norms > 0)
+        return block
+
+    def eval_recall(self, n_queries: int) -> Dict[str, float]:
+        """Recall@k du couple (embedding, HNSW) vs cosinus BoW exact.
+
+        Les requêtes sont des documents tirés au hasard ; la vérité terrain est
+        le cosinus exact sur les comptes de termes complets (sans troncature
+        du vocabulaire ni projection).
+        """
+        snap = self._snap
+        index, meta, counts = snap.index, snap.meta, snap.term_counts()
+        if index is None or meta is None:
+            return {}
+        # snapshot rechargé depuis le disque : table recalculée à la demande
+        feat_dims, feat_w = self._snap_features(snap)
+        labels, paths = meta.live()
+        n = len(paths)
+        k = min(RECALL_K, n)
+        if n_queries <= 0 or k <= 0:
+            return {}
+        rng = np.random.default_rng(0)
+        qids = rng.choice(n, size=min(n_queries, n), replace=False)
+        # vecteurs requêtes restreints aux termes qu'elles contiennent
+        qterms = np.unique(np.concatenate([counts[paths[j]][0] for j in qids]))
+        col = np.full(len(self._vocab), -1, dtype=np.int64)
+        col[qterms] = np.arange(len(qterms))
+        qmat = np.zeros((len(qids), len(qterms) + 1), dtype=np.float32)
+        for r, j in enumerate(qids.tolist()):
+            t, c = counts[paths[j]]
+            qmat[r, col[t]] = c / (np.linalg.norm(c) or 1.0)
+        qmat[:, -1] = 0.0  # colonne puits pour les termes hors requêtes
+
+        best = np.full((len(qids), 0), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((len(qids), 0), dtype=np.int64)
+        for lo in range(0, n, BUILD_BATCH):
+            chunk = paths[lo : lo + BUILD_BATCH]
+            lens = np.array([len(counts[p][0]) for p in chunk])
+            sims = np.zeros((len(qids), len(chunk)), dtype=np.float32)
+            if lens.sum():
+                t = np.concatenate([counts[p][0] for p in chunk])
+                c = np.concatenate(
+                    [
+                        counts[p][1] / (np.linalg.norm(counts[p][1]) or 1.0)
+                        for p in chunk
+                    ]
+                )
+                rows = np.repeat(np.arange(len(chunk)), lens)
+                prod = qmat[:, col[t]] * c
+                for r in range(len(qids)):
+                    sims[r] = np.bincount(rows, weights=prod[r], minlength=len(chunk))
+            best = np.concatenate([best, sims], axis=1)
+            best_ids = np.concatenate(
+                [best_ids, np.broadcast_to(np.arange(lo, lo + len(chunk)), sims.shape)],
+                axis=1,
+            )
+            if best.shape[1] > k:
+                top = np.argpartition(-best, k - 1, axis=1)[:, :k]
+                best = np.take_along_axis(best, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+        truth = labels[best_ids]
+        approx, _ = snap.knn(
+            self._embed_docs(
+                counts, [paths[j] for j in qids.tolist()], meta.dim, feat_dims, feat_w
+            ),
+            k,
+            num_threads=n_threads(),
+        )
+        hits = [len(set(a) & set(b)) for a, b in zip(approx.tolist(), truth.tolist())]
+        return {f"recall@{k}": round(sum(hits) / (k * len(hits)), 4)}
+
+    def hnsw_recall(self, queries: List[str], k: int = RECALL_K) -> Dict[str, float]:
+        """Recall@k de HNSW seul, au `ef` utilisé par `search`.
+
+        Vérité terrain : cosinus exact sur les vecteurs stockés dans l'index.
+        """
+        self.ensure_loaded()
+        snap = self._snap
+        index, meta = snap.index, snap.meta
+        if index is None or meta is None or not queries:
+            return {}
+        n = len(snap.live)
+        k = min(k, n)
+        if k <= 0:
+            return {}
+        qmat = np.stack([self._embed(snap, q) for q in queries])
+        qmat = qmat[np.linalg.norm(qmat, axis=1) > 0]
+        if not len(qmat):
+            return {}
+        best = np.zeros((len(qmat), 0), dtype=np.float32)
+        for lo in range(0, n, BUILD_BATCH):
+            ids = snap.live[lo : lo + BUILD_BATCH]
+            sims = qmat @ np.asarray(index.get_items(ids, return_type="numpy")).T
+            best = np.concatenate([best, sims], axis=1)
+            if best.shape[1] > k:
+                best = -np.partition(-best, k - 1, axis=1)[:, :k]
+        _, dists = snap.knn(qmat, k, num_threads=n_threads())
+        # recall tolérant aux égalités : un voisin compte s'il est au moins
+        # aussi proche que le k-ième voisin exact
+        kth = best.min(axis=1, keepdims=True)
+        hits = ((1.0 - dists) >= kth - 1e-5).sum(axis=1)
+        return {f"hnsw_recall@{k}": round(float(hits.sum()) / (k * len(hits)), 4)}
+
+    def synced_manifest(self) -> Optional[Manifest]:
+        """Manifeste persistant, s'il décrit exactement l'index chargé."""
+        self.ensure_loaded()
+        prev = Manifest.load(MANIFEST_PATH)
+        meta = self._snap.meta
+        if prev is None or set(prev.files) != set(meta.live()[1] if meta else ()):
+            return None  # état persistant incomplet : ingest complet
+        return prev
+
+    def prepare(
+        self,
+        docs: Iterable[Union[ParsedDoc, TermDoc]],
+        removed: Iterable[str] = (),
+        mtimes: Optional[Dict[str, float]] = None,
+        incremental: bool = True,
+        max_vocab: int = 4096,
+        embedding: str = "bow",
+        dim: int = 256,
+        tune_queries: int = TUNE_QUERIES,
+        recall_target: Optional[float] = None,
+    ) -> _DenseSnapshot:
+        """Prépare (sans publier) la génération suivante du store dense.
+
+        Incrémental, sur un index de même embedding : les docs ajoutés ou
+        modifiés sont embeddés et insérés sous de nouveaux labels, les
+        anciennes versions et `removed` sont marqués supprimés (cf.
+        `_update`). Reconstruction complète (nouvel index, vocabulaire
+        recalculé, ef réglé pour `recall_target`) sinon, ou quand les labels
+        supprimés dépassent COMPACT_RATIO, ou quand les termes hors
+        vocabulaire insérés dépassent OOV_REBUILD.
+        `removed` et `mtimes` ne sont lus qu'après avoir consommé `docs`.
+        """
+        if incremental:
+            self.ensure_loaded()
+        elif self._owns_store:
+            self._store.reset()  # reconstruction : les anciens textes partent
+        with self._write_lock:
+            base = self._snap
+            meta = base.meta if incremental else None
+            counts: Counts = dict(base.term_counts()) if meta is not None else {}
+            ids: Dict[str, int] = {}  # chemin -> id DocStore
+            old: Dict[str, int] = {}  # chemin -> label dans l'index de base
+            if meta is not None:
+                labels, paths = meta.live()
+                kept = self._store.adopt(
+                    base.table, np.asarray(meta.doc_ids, dtype=np.int64)[labels]
+                )
+                ids = dict(zip(paths, kept.tolist()))
+                old = dict(zip(paths, labels.tolist()))
+            fresh: List[str] = []
+            for d in docs:
+                if isinstance(d, ParsedDoc):
+                    d = self._vocab.term_doc(d)
+                counts[d.path] = (d.tids, d.tfs.astype(np.float32))
+                ids.pop(d.path, None)  # nouvel ordre : en fin de liste
+                ids[d.path] = self._store.put(d, self._vocab)
+                fresh.append(d.path)
+            fresh = list(dict.fromkeys(fresh))  # un chemin vu deux fois : une version
+            gone = set(removed) - set(fresh)
+            for path in gone:
+                counts.pop(path, None)
+                ids.pop(path, None)
+            touched = [p for p in (mtimes or {}) if p in ids]
+            self._store.touch(
+                np.array([ids[p] for p in touched], dtype=np.int64),
+                np.array([mtimes[p] for p in touched]),
+            )
+            same = meta is not None and meta.embedding == embedding
+            if same and embedding == "hash":
+                same = meta.dim == max(1, dim)
+            if same:
+                state = self._update(base, counts, ids, old, fresh)
+                if state is not None:
+                    return state
+            return self._rebuild(
+                counts,
+                ids,
+                max_vocab,
+                embedding,
+                dim,
+                tune_queries,
+                RECALL_TARGET if recall_target is None else recall_target,
+            )
+
+    def _rebuild(
+        self,
+        counts: Counts,
+        ids: Dict[str, int],
+        max_vocab: int,
+        embedding: str,
+        dim: int,
+        tune_queries: int,
+        target: float,
+    ) -> _DenseSnapshot:
+        """Nouvel index (labels 0..n-1, HNSW_HEADROOM de places libres)."""
+        if embedding == "hash":
+            v2i: Dict[str, int] = {}
+            dim = max(1, dim)
+        else:
+            v2i = {w: i for i, w in enumerate(self._build_vocab(counts, max_vocab))}
+            dim = len(v2i) if v2i else 1
+        feat_dims, feat_w = self._feature_table(embedding, dim, HASH_SEED, v2i)
+
+        paths = list(ids)
+        owner = shard_of(paths, self.n_shards)
+        t0 = time.perf_counter()
+        index = ShardedHnsw.create(
+            dim,
+            (np.bincount(owner, minlength=self.n_shards) * (1.0 + HNSW_HEADROOM))
+            .astype(np.int64)
+            .tolist(),
+            ef_construction=HNSW_EF_CONSTRUCTION,
+            M=HNSW_M,
+        )
+
+        # insertion par lots : shards remplis en parallèle, et hnswlib
+        # parallélise add_items sur les threads restants
+        threads = n_threads()
+        for lo in range(0, len(paths), BUILD_BATCH):
+            block = self._embed_docs(
+                counts, paths[lo : lo + BUILD_BATCH], dim, feat_dims, feat_w
+            )
+            index.add_items(
+                block,
+                np.arange(lo, lo + len(block)),
+                owner[lo : lo + len(block)],
+                num_threads=threads,
+            )
+        secs = time.perf_counter() - t0
+        tuning = tune_ef(index, tune_queries, target) if tune_queries else {}
+        tuning.update(M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+        index.set_ef(_ef_floor(tuning.get("ef", {})))
+        meta = DenseMeta(
+            dim=dim,
+            vocab=list(v2i.keys()),
+            paths=paths,
+            doc_ids=np.array([ids[p] for p in paths], dtype=np.int64),
+            embedding=embedding,
+            seed=HASH_SEED,
+            total_mass=float(sum(float(c.sum()) for _, c in counts.values())),
+        )
+        return _DenseSnapshot(
+            index=index,
+            meta=meta,
+            v2i=v2i,
+            counts=counts,
+            table=self._store.view(),
+            live=np.arange(len(paths)),
+            feat_dims=feat_dims,
+            feat_w=feat_w,
+            tuning=tuning,
+            stats={
+                "docs": len(paths),
+                "dim": dim,
+                "embedding": embedding,
+                "hnsw": "rebuild",
+                "shards": index.n_shards,
+                "index_secs": round(secs, 3),
+                "docs_per_sec": round(len(paths) / secs, 1) if secs > 0 else 0.0,
+                "threads": threads,
+                "tuning": tuning,
+            },
+        )
+
+    def _update(
+        self,
+        base: _DenseSnapshot,
+        counts: Counts,
+        ids: Dict[str, int],
+        old: Dict[str, int],
+        fresh: List[str],
+    ) -> Optional[_DenseSnapshot]:
+        """Applique le changement à l'index de `base` ; None : à reconstruire.
+
+        Les labels des nouvelles versions suivent le dernier label de
+        l'index ; les anciennes versions (modifiées ou supprimées), et les
+        labels d'un prepare jamais publié, seront marqués supprimés par
+        `install`. L'index n'est copié que s'il faut l'agrandir (capacité
+        doublée : coût amorti).
+        """
+        meta, index = base.meta, base.index
+        assert meta is not None and index is not None
+        fresh_set = set(fresh)
+        dead = [old[p] for p in old if p not in ids or p in fresh_set]
+        t0 = time.perf_counter()
+        feat_dims, feat_w = self._snap_features(base)
+        oov, mass = meta.oov_mass, meta.total_mass
+        if meta.embedding == "bow" and fresh:
+            t = np.concatenate([counts[p][0] for p in fresh])
+            c = np.concatenate([counts[p][1] for p in fresh])
+            mass += float(c.sum())
+            oov += float(c[feat_w[t, 0] == 0].sum())
+        first = index.get_current_count()
+        dead += range(len(meta.doc_ids), first)  # orphelins d'un prepare abandonné
+        n_live = len(ids)
+        tombstones = first + len(fresh) - n_live
+        if mass and oov / mass > OOV_REBUILD:
+            return None  # vocabulaire figé trop loin du corpus
+        if tombstones > COMPACT_RATIO * max(1, first + len(fresh)):
+            return None  # compaction
+
+        owner = shard_of(fresh, index.n_shards)
+        # copie privée agrandie : le snapshot publié garde son index
+        index = index.grown(owner) or index
+        threads = n_threads()
+        for lo in range(0, len(fresh), BUILD_BATCH):
+            block = self._embed_docs(
+                counts, fresh[lo : lo + BUILD_BATCH], meta.dim, feat_dims, feat_w
+            )
+            index.add_items(
+                block,
+                np.arange(first + lo, first + lo + len(block)),
+                owner[lo : lo + len(block)],
+                num_threads=threads,
+            )
+        index.set_ef(_ef_floor(base.tuning.get("ef", {})))
+        secs = time.perf_counter() - t0
+
+        paths = _strings(meta.paths)
+        paths += [""] * (first - len(paths)) + fresh
+        doc_ids = np.full(len(paths), -1, dtype=np.int64)
+        # ids DocStore des versions gardées (recopiées si le store a changé
+        # d'époque), -1 pour les labels morts
+        doc_ids[np.fromiter(old.values(), np.int64, len(old))] = np.fromiter(
+            (-1 if p in fresh_set else ids.get(p, -1) for p in old),
+            np.int64,
+            len(old),
+        )
+        doc_ids[first:] = [ids[p] for p in fresh]
+        for label in dead:
+            paths[label] = ""
+        new_meta = replace(
+            meta, paths=paths, doc_ids=doc_ids, oov_mass=oov, total_mass=mass
+        )
+        return replace(
+            base,
+            index=index,
+            meta=new_meta,
+            dead=tuple(dead),
+            counts=counts,
+            rows=None,
+            table=self._store.view(),
+            live=np.flatnonzero(doc_ids >= 0),
+            feat_dims=feat_dims,
+            feat_w=feat_w,
+            stats={
+                "docs": n_live,
+                "dim": meta.dim,
+                "embedding": meta.embedding,
+                "hnsw": "update",
+                "upserted": len(fresh),
+                "deleted": sum(1 for p in old if p not in ids),
+                "tombstones": tombstones,
+                "oov_ratio": round(oov / mass, 4) if mass else 0.0,
+                "index_secs": round(secs, 3),
+                "threads": threads,
+                "tuning": base.tuning,
+            },
+        )
+
+    def upsert(self, docs: Iterable[Union[ParsedDoc, TermDoc]]) -> Dict[str, Any]:
+        """Ajoute ou remplace des documents (par chemin) et publie."""
+        return self._apply(docs, ())
+
+    def delete(self, paths: Iterable[str]) -> Dict[str, Any]:
+        """Supprime des documents (par chemin) et publie."""
+        return self._apply((), paths)
+
+    def _apply(
+        self, docs: Iterable[Union[ParsedDoc, TermDoc]], removed: Iterable[str]
+    ) -> Dict[str, Any]:
+        self.ensure_loaded()
+        meta = self._snap.meta
+        kw = {"embedding": meta.embedding, "dim": meta.dim} if meta else {}
+        return self.install(self.prepare(docs, removed, **kw))
+
+    def prepare_rebase(self) -> Optional[_DenseSnapshot]:
+        """Snapshot inchangé, docs recopiés dans l'époque courante du store
+        (cf. `BM25Index.prepare_rebase`) ; None si l'index est vide."""
+        self.ensure_loaded()
+        meta = self._snap.meta
+        if meta is None:
+            return None
+        return self.prepare((), embedding=meta.embedding, dim=meta.dim)
+
+    def install(
+        self,
+        state: _DenseSnapshot,
+        generation: Optional[int] = None,
+        persist: bool = True,
+    ) -> Dict[str, Any]:
+        """Publie un snapshot préparé par `prepare` (cf. BM25Index.install)."""
+        stats = dict(state.stats)
+        with PUBLISH_LOCK:
+            gen = generation if generation is not None else next_generation()
+            if state.index is not None:
+                # index éventuellement partagé avec le snapshot servi
+                for label in state.dead:
+                    state.index.mark_deleted(label)
+            self._snap = replace(state, generation=gen, dead=())
+            self._loaded = True
+        if persist:
+            self.save()
+        stats["generation"] = gen
+        return stats
+
     def build(
         self,
         root: pathlib.Path,
         exts: Optional[Iterable[str]] = None,
         max_vocab: int = 4096,
-    ) -> Dict[str, int]:
-        docs = load_corpus(root, exts)
-        vocab = self._build_vocab(docs, max_vocab=max_vocab)
-        self.v2i = {w: i for i, w in enumerate(vocab)}
-        dim = len(self.v2i) if self.v2i else 1
-
-        index = hnswlib.Index(space="cosine", dim=dim)
-        index.init_index(max_elements=max(1, len(docs)), ef_construction=200, M=16)
-        index.set_ef(100)
-
-        metas: List[Dict] = []
-        for i, d in enumerate(docs):
-            vec = self._embed(d.text)
-            index.add_items(vec, i)
-            metas.append(
-                {
-                    "id": i,
-                    "path": d.path,
-                    "len": len(d.text),
-                    "snippet": d.text[:280].replace("\n", " "),
-                    "mtime": d.mtime,
-                }
-            )
+        full: bool = False,
+        embedding: str = "bow",
+        dim: int = 256,
+        recall_queries: int = 0,
+        recall_target: Optional[float] = None,
+        progress: Optional[Progress] = None,
+    ) -> Dict[str, Any]:
+        """Ingest de `root` dans ce store (cf. `prepare`) ; `progress` : cf. `scan`.
+
+        Reconstruction sur un store partagé : cf. `DocStore.rebuild`.
+        """
+        prev = None if full else self.synced_manifest()
+        res = scan(root, exts or DEFAULT_EXTS, prev, progress=progress)
 
-        self.index = index
-        self.meta = DenseMeta(dim=dim, vocab=list(self.v2i.keys()), docs=metas)
-        self._save()
-        return {"docs": len(docs), "dim": dim}
-
-    def _save(self) -> None:
-        assert self.index is not None and self.meta is not None
-        self.index.save_index(str(INDEX_PATH))
-        with open(META_PATH, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "dim": self.meta.dim,
-                    "vocab": self.meta.vocab,
-                    "docs": self.meta.docs,
-                },
-                f,
+        def prepare() -> _DenseSnapshot:
+            return self.prepare(
+                res.changed,
+                res.removed,
+                res.mtimes,
+                incremental=res.incremental,
+                max_vocab=max_vocab,
+                embedding=embedding,
+                dim=dim,
+                recall_target=recall_target,
             )
 
+        if res.incremental or self._owns_store:
+            state = prepare()
+            res.progress.publishing()
+            stats = self.install(state)
+        else:
+            stats = self._store.rebuild(self, prepare, res.progress.publishing)
+        res.manifest.save(MANIFEST_PATH)
+        return {**stats, **self.eval_recall(recall_queries), **res.stats()}
+
+    def save(self) -> None:
+        """Écrit index + métadonnées dans DENSE_DIR (remplacé atomiquement)."""
+        snap = self._snap
+        assert snap.index is not None and snap.meta is not None
+        self._store.save()
+        if snap.rows is not None:
+            ptr, tids, cnts = snap.rows
+        else:
+            # une ligne par label (vide pour un label supprimé)
+            empty = (np.zeros(0, np.int32), np.zeros(0, np.float32))
+            counts = [
+                snap.counts[p] if i >= 0 else empty
+                for p, i in zip(_strings(snap.meta.paths), snap.meta.doc_ids.tolist())
+            ]
+            lens = np.array([len(t) for t, _ in counts], dtype=np.int64)
+            ptr = np.concatenate([[0], np.cumsum(lens)])
+            tids = np.concatenate([t for t, _ in counts] or [np.zeros(0, np.int32)])
+            cnts = np.concatenate([c for _, c in counts] or [np.zeros(0, np.float32)])
+        arrays = {
+            "doc_ids": np.asarray(snap.meta.doc_ids, dtype=np.int64),
+            "counts_ptr": ptr,
+            "counts_tids": tids,
+            "counts_cnts": cnts,
+        }
+        tables = {
+            "vocab": StringTable.from_list(snap.meta.vocab),
+            "paths": StringTable.from_list(_strings(snap.meta.paths)),
+            "terms": StringTable.from_list(self._vocab.words()),
+        }
+        meta = {
+            "version": DENSE_FORMAT_VERSION,
+            "dim": snap.meta.dim,
+            "embedding": snap.meta.embedding,
+            "seed": snap.meta.seed,
+            "generation": snap.generation,
+            "docs": len(snap.live),
+            "labels": len(snap.meta.paths),
+            "shards": snap.index.n_shards,
+            "oov_mass": snap.meta.oov_mass,
+            "total_mass": snap.meta.total_mass,
+            "docs_epoch": snap.table.epoch,
+        }
+        final = DENSE_DIR
+        tmp = final.with_name(final.name + ".tmp")
+        old = final.with_name(final.name + ".old")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        snap.index.save(tmp)
+        for name, arr in arrays.items():
+            np.save(tmp / f"{name}.npy", arr)
+        for name, table in tables.items():
+            table.save(tmp, name)
+        with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        shutil.rmtree(old, ignore_errors=True)
+        if final.exists():
+            os.replace(final, old)
+        os.replace(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+        # réglage HNSW à côté de l'index (clés JSON : k en texte)
+        with open(TUNING_PATH, "w", encoding="utf-8") as f:
+            json.dump({**snap.tuning, "generation": snap.generation}, f)
+
     def _load(self) -> bool:
-        if not INDEX_PATH.exists() or not META_PATH.exists():
+        """Recharge DENSE_DIR : colonnes et chaînes mappées, rien n'est parsé."""
+        d = DENSE_DIR
+        try:
+            with open(d / "meta.json", "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            if raw.get("version") != DENSE_FORMAT_VERSION:
+                return False
+            arrays = {
+                name: np.load(d / f"{name}.npy", mmap_mode="r")
+                for name in ("doc_ids", "counts_ptr", "counts_tids", "counts_cnts")
+            }
+            vocab = StringTable.load(d, "vocab").tolist()
+            paths = StringTable.load(d, "paths")
+            terms = StringTable.load(d, "terms")
+        except (OSError, ValueError, KeyError):
             return False
-        with open(META_PATH, "r", encoding="utf-8") as f:
-            meta = json.load(f)
-        self.meta = DenseMeta(dim=meta["dim"], vocab=meta["vocab"], docs=meta["docs"])
-        self.v2i = {w: i for i, w in enumerate(self.meta.vocab)}
-        self.index = hnswlib.Index(
-            space="cosine", dim=self.meta.dim if self.meta.dim > 0 else 1
-        )
-        self.index.load_index(str(INDEX_PATH))
-        self.index.set_ef(100)
+        doc_ids = arrays["doc_ids"]
+        self._store.ensure_loaded()
+        table = self._store.view()
+        if raw.get("docs_epoch") != table.epoch or (
+            len(doc_ids) and doc_ids.max() >= len(table)
+        ):
+            return False  # store de documents d'une autre époque
+        meta = DenseMeta(
+            dim=raw["dim"],
+            vocab=vocab,
+            paths=paths,
+            doc_ids=doc_ids,
+            embedding=raw.get("embedding", "bow"),
+            seed=raw.get("seed", HASH_SEED),
+            oov_mass=float(raw.get("oov_mass", 0.0)),
+            total_mass=float(raw.get("total_mass", 0.0)),
+        )
+        try:
+            index = ShardedHnsw.load(d, max(1, meta.dim), int(raw["shards"]))
+        except (OSError, RuntimeError, ValueError, KeyError):
+            return False
+        gen = int(raw.get("generation", 0))
+        observe(gen)
+        tuning = self._load_tuning(gen)
+        index.set_ef(_ef_floor(tuning.get("ef", {})))
+        self._snap = _DenseSnapshot(
+            index=index,
+            meta=meta,
+            v2i={w: i for i, w in enumerate(meta.vocab)},
+            rows=self._load_rows(arrays, terms, len(paths)),
+            table=table,
+            live=np.flatnonzero(doc_ids >= 0),
+            generation=gen,
+            tuning=tuning,
+        )
         return True
 
+    @staticmethod
+    def _load_tuning(generation: int) -> Dict[str, Any]:
+        try:
+            with open(TUNING_PATH, "r", encoding="utf-8") as f:
+                tuning = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if tuning.pop("generation", None) != generation:
+            return {}  # réglage d'un autre index
+        for key in ("ef", "recall"):
+            if key in tuning:
+                tuning[key] = {int(k): v for k, v in tuning[key].items()}
+        return tuning
+
+    def _load_rows(
+        self, arrays: Dict[str, np.ndarray], terms: StringTable, n_docs: int
+    ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        ptr, tids, cnts = (
+            arrays["counts_ptr"],
+            arrays["counts_tids"],
+            arrays["counts_cnts"],
+        )
+        if len(ptr) != n_docs + 1:
+            return None
+        remap = self._vocab.adopt(terms.tolist())
+        if remap is not None:
+            # vocabulaire partagé divergent : ids renumérotés puis retriés par doc
+            row = np.repeat(np.arange(n_docs), np.diff(ptr))
+            tids = remap[tids]
+            order = np.lexsort((tids, row))
+            tids, cnts = tids[order], np.asarray(cnts)[order]
+        return ptr, tids, cnts
+
     def ensure_loaded(self) -> bool:
-        if self.index is None or self.meta is None:
-            return self._load()
-        return True
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+        return self._snap.index is not None and self._snap.meta is not None
 
-    def search(self, query: str, k: int = 5) -> List[Dict]:
-        if (
-            not self.ensure_loaded()
-            or self.meta is None
-            or self.index is None
-            or self.meta.dim == 0
-        ):
-            return []
-        current = self.index.get_current_count()
-        if current <= 0:
-            return []
-        k_eff = min(max(1, k), current)
-        self.index.set_ef(max(50, k_eff))
-        q = self._embed(query)
-        labels, dists = self.index.knn_query(q, k=k_eff)
+    def _allowed(
+        self, snap: _DenseSnapshot, flt: Optional[DocFilter]
+    ) -> Optional[np.ndarray]:
+        """Masque par label des docs admis par `flt` (labels morts exclus)."""
+        meta = snap.meta
+        if flt is None or meta is None:
+            return None
+        paths = self._masks.get(
+            snap.generation, flt.path_key, lambda: flt.path_mask(_strings(meta.paths))
+        )
+        if flt.min_mtime is None and flt.max_mtime is None:
+            return paths
+        return flt.mask(paths, snap.table.mtimes(np.maximum(meta.doc_ids, 0)))
+
+    def search(
+        self, query: str, k: int = 5, flt: Optional[DocFilter] = None
+    ) -> List[Dict]:
+        return self.search_batch([query], k, flt)[0]
+
+    def search_batch(
+        self, queries: List[str], k: int = 5, flt: Optional[DocFilter] = None
+    ) -> List[List[Dict]]:
+        """Recherche d'un lot : une matrice de requêtes, un seul `knn_query`.
+
+        Avec `flt` : cosinus exact parmi les docs admis s'ils sont au plus
+        FILTER_EXACT_MAX, sinon HNSW avec le callback `filter` de hnswlib.
+        """
+        self.ensure_loaded()
+        snap = self._snap  # une seule lecture : vocab et index cohérents
+        index, meta = snap.index, snap.meta
+        if not queries or meta is None or index is None or meta.dim == 0:
+            return [[] for _ in queries]
+        if not len(snap.live):
+            return [[] for _ in queries]
+        k_eff = min(max(1, k), len(snap.live))
+        with span("filter"):
+            allowed = self._allowed(snap, flt)
+            cand = np.flatnonzero(allowed) if allowed is not None else None
+        if cand is not None:
+            k_eff = min(k_eff, len(cand))
+            if not k_eff:
+                return [[] for _ in queries]
+        # labels insérés par un prepare pas encore publié : filtrés ci-dessous
+        pending = max(0, index.get_current_count() - len(meta.doc_ids))
+        with span("embed"):
+            qmat = np.stack([self._embed(snap, q) for q in queries])
+        with span("hnsw"):
+            if cand is None:
+                labels, dists = snap.knn(
+                    qmat,
+                    k_eff + pending,
+                    num_threads=n_threads() if len(queries) > 1 else 1,
+                )
+            elif len(cand) <= FILTER_EXACT_MAX:
+                labels, dists = snap.exact(qmat, cand, k_eff)
+            else:
+                ok = allowed.tolist()
+                n_ok = len(ok)
+                # callback Python : un seul thread (le GIL sérialise de toute façon)
+                labels, dists = snap.knn(
+                    qmat,
+                    k_eff,
+                    filter=lambda label: label < n_ok and ok[label],
+                    limits=index.shard_counts(cand),
+                )
         now = time.time()
-        out: List[Dict] = []
-        for lab, dist in zip(labels[0].tolist(), dists[0].tolist()):
-            doc = self.meta.docs[lab]
-            score = 1.0 - float(dist)
-            age_days = max(0.0, (now - float(doc.get("mtime", now))) / 86400.0)
-            out.append(
-                {
-                    "doc": doc["path"],
-                    "score": score,
-                    "snippet": doc["snippet"],
-                    "age_days": age_days,
-                }
-            )
-        return out
+        results: List[List[Dict]] = []
+        for q, row_labels, row_dists in zip(queries, labels.tolist(), dists.tolist()):
+            terms = tokenize(q)
+            out: List[Dict] = []
+            for lab, dist in zip(row_labels, row_dists):
+                if lab >= len(meta.doc_ids) or meta.doc_ids[lab] < 0:
+                    continue
+                if len(out) == k_eff:
+                    break
+                sid = int(meta.doc_ids[lab])
+                text, loc = snap.table.passage(sid, terms)
+                score = 1.0 - float(dist)
+                age_days = max(0.0, (now - snap.table.mtime(sid)) / 86400.0)
+                out.append(
+                    {
+                        "doc": meta.paths[lab],
+                        "score": score,
+                        "snippet": text,
+                        "loc": loc,
+                        "age_days": age_days,
+                    }
+                )
+            results.append(out)
+        return results
 
 
-VSTORE = DenseStore()
+# vocabulaire et textes partagés avec INDEX (ingest unifié)
+VSTORE = DenseStore(vocab=VOCAB, store=DOCS)
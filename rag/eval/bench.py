@@ -0,0 +1,389 @@
+"""Banc d'essai du RAG : ingest, latence/QPS des endpoints, recall HNSW.
+
+    python -m rag.eval.bench --docs 10000 --concurrency 1,8,32 --out run.json
+    python -m rag.eval.bench --docs 10000 --baseline run.json
+
+Étapes :
+1. génération d'un corpus synthétique (cf. `synth`), réutilisé si `--workdir`
+   contient déjà le même ;
+2. ingest : `rebuild` (BM25), `DenseStore.build` et `ingest_all`, chacun dans
+   un process neuf pour mesurer docs/s et le pic de RSS propre à l'étape ;
+3. recall : recall@k de HNSW vs cosinus exact sur les mêmes vecteurs, et de
+   l'embedding complet vs cosinus BoW exact (`eval_recall`) ;
+4. requêtes : un serveur uvicorn est lancé sur l'état produit (cache de
+   résultats désactivé sauf `--cache`) et chaque endpoint est chargé à
+   plusieurs niveaux de concurrence (p50/p95/p99, QPS, erreurs).
+
+Le résultat est un JSON ; `--baseline` affiche l'écart relatif avec un run
+précédent.
+"""
+
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import pathlib
+import platform
+import queue
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from rag.eval.synth import SynthSpec, generate, queries
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+RESULTS_DIR = REPO_ROOT / "rag" / "eval" / "results"
+
+ENDPOINTS = {
+    "query": "/query",
+    "query_dense": "/query_dense",
+    "query_hybrid": "/query_hybrid",
+    "parliament_ask": "/parliament/ask",
+}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux : Kio ; macOS : octets
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _percentiles(ms: List[float]) -> Dict[str, float]:
+    if not ms:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(ms), [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+# --------- étapes exécutées dans un process neuf ---------
+
+
+def _phase(phase: str, state: str, args: Dict[str, Any], out: "mp.Queue") -> None:
+    # STATE_DIR est lu à l'import : l'environnement doit précéder les imports
+    os.environ["LOUMINA_STATE"] = state
+    root = pathlib.Path(args["corpus"])
+    dense_opts = {
+        "max_vocab": args["max_vocab"],
+        "embedding": args["embedding"],
+        "dim": args["dim"],
+    }
+    t0 = time.perf_counter()
+    if phase == "bm25":
+        from apps.server.utils.indexer import rebuild
+
+        stats = rebuild(root, full=True)
+    elif phase == "dense":
+        from apps.server.utils.vector_index import VSTORE
+
+        stats = VSTORE.build(root, full=True, **dense_opts)
+    elif phase == "ingest_all":
+        from rag.pipelines.ingest import ingest_all
+
+        stats = ingest_all(root, full=True, **dense_opts)
+    elif phase == "recall":
+        from apps.server.utils.vector_index import VSTORE
+
+        spec = SynthSpec(**args["spec"])
+        qs = queries(spec, args["recall_queries"], seed=7)
+        stats = {
+            **VSTORE.hnsw_recall(qs, args["k"]),
+            **VSTORE.eval_recall(args["recall_queries"]),
+        }
+    else:
+        raise ValueError(phase)
+    secs = time.perf_counter() - t0
+    res: Dict[str, Any] = {"secs": round(secs, 3), "peak_rss_mb": _peak_rss_mb()}
+    if phase != "recall":
+        docs = int(stats.get("docs", 0) or stats.get("bm25", {}).get("docs", 0))
+        res.update(docs=docs, docs_per_sec=round(docs / secs, 1) if secs else 0.0)
+    res["stats"] = stats
+    out.put(res)
+
+
+def run_phase(phase: str, state: pathlib.Path, args: Dict[str, Any]) -> Dict:
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    p = ctx.Process(target=_phase, args=(phase, str(state), args, q))
+    p.start()
+    while True:
+        try:
+            res = q.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not p.is_alive():
+                raise RuntimeError(f"étape {phase} : process terminé ({p.exitcode})")
+    p.join()
+    return res
+
+
+# --------- charge HTTP ---------
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(state: pathlib.Path, cache: bool) -> tuple:
+    port = _free_port()
+    env = {**os.environ, "LOUMINA_STATE": str(state)}
+    if not cache:
+        env["LOUMINA_CACHE_SIZE"] = "0"
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "apps.server.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def _wait_ready(client, url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(url + "/healthz")).status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"serveur injoignable : {url}")
+        await asyncio.sleep(0.2)
+
+
+async def _load(
+    client, url: str, payloads: List[Dict], concurrency: int
+) -> Dict[str, Any]:
+    lat: List[float] = []
+    errors = 0
+    it = iter(payloads)
+
+    async def worker():
+        nonlocal errors
+        for body in it:
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(url, json=body)
+                ok = r.status_code == 200
+            except Exception:
+                ok = False
+            lat.append((time.perf_counter() - t0) * 1000.0)
+            errors += not ok
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "qps": round(len(lat) / wall, 1) if wall else 0.0,
+        **_percentiles(lat),
+    }
+
+
+async def bench_queries(
+    base: str, qs: List[str], k: int, levels: List[int], requests: int
+) -> Dict[str, Any]:
+    import httpx
+
+    out: Dict[str, Any] = {}
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=120.0, limits=limits) as client:
+        await _wait_ready(client, base)
+        for name, path in ENDPOINTS.items():
+            # chauffe : chargement mmap des index, premiers embeddings
+            await _load(client, base + path, [{"query": q, "k": k} for q in qs[:20]], 4)
+            out[name] = {}
+            for c in levels:
+                payloads = [{"query": qs[i % len(qs)], "k": k} for i in range(requests)]
+                out[name][f"c{c}"] = await _load(client, base + path, payloads, c)
+                r = out[name][f"c{c}"]
+                print(
+                    f"  {name:<15} c={c:<3} qps={r['qps']:<8} "
+                    f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms",
+                    file=sys.stderr,
+                )
+    return out
+
+
+# --------- comparaison ---------
+
+
+def _flatten(d: Dict, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, v in d.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(v, dict):
+            flat.update(_flatten(v, name))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[name] = float(v)
+    return flat
+
+
+KEY_METRICS = ("docs_per_sec", "peak_rss_mb", "qps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def compare(new: Dict, old: Dict) -> List[str]:
+    a = _flatten({k: new[k] for k in ("ingest", "recall", "queries") if k in new})
+    b = _flatten({k: old[k] for k in ("ingest", "recall", "queries") if k in old})
+    lines = []
+    for key in sorted(set(a) & set(b)):
+        last = key.rsplit(".", 1)[-1]
+        if last not in KEY_METRICS and "recall" not in last:
+            continue
+        if b[key]:
+            delta = (a[key] - b[key]) / b[key] * 100.0
+            lines.append(f"{key:<55} {b[key]:>12.3f} -> {a[key]:>12.3f} {delta:+7.1f}%")
+    return lines
+
+
+# --------- CLI ---------
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--docs", type=int, default=1000)
+    ap.add_argument("--vocab", type=int, default=50_000)
+    ap.add_argument("--zipf", type=float, default=1.07)
+    ap.add_argument("--median-tokens", type=int, default=250)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--embedding", choices=["bow", "hash"], default="bow")
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--max-vocab", type=int, default=4096)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--concurrency", default="1,8,32")
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--recall-queries", type=int, default=200)
+    ap.add_argument("--cache", action="store_true", help="garde le cache de résultats")
+    ap.add_argument("--skip-ingest", action="store_true")
+    ap.add_argument("--skip-queries", action="store_true")
+    ap.add_argument("--workdir", type=pathlib.Path, help="corpus/état réutilisables")
+    ap.add_argument("--out", type=pathlib.Path)
+    ap.add_argument("--baseline", type=pathlib.Path)
+    a = ap.parse_args(argv)
+
+    spec = SynthSpec(
+        docs=a.docs,
+        vocab=a.vocab,
+        zipf_s=a.zipf,
+        median_tokens=a.median_tokens,
+        seed=a.seed,
+    )
+    tmp = None
+    if a.workdir is None:
+        tmp = tempfile.TemporaryDirectory(prefix="loumina-bench-")
+        work = pathlib.Path(tmp.name)
+    else:
+        work = a.workdir
+        work.mkdir(parents=True, exist_ok=True)
+    corpus = work / "corpus"
+    spec_path = work / "spec.json"
+    result: Dict[str, Any] = {
+        "meta": {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {
+                k: str(v) if isinstance(v, pathlib.Path) else v
+                for k, v in vars(a).items()
+            },
+        }
+    }
+
+    if spec_path.exists() and json.loads(spec_path.read_text())["spec"] == vars(spec):
+        result["corpus"] = json.loads(spec_path.read_text())["corpus"]
+        print(f"corpus réutilisé : {corpus}", file=sys.stderr)
+    else:
+        print(f"génération de {spec.docs} docs dans {corpus}", file=sys.stderr)
+        result["corpus"] = generate(corpus, spec)
+        spec_path.write_text(
+            json.dumps({"spec": vars(spec), "corpus": result["corpus"]})
+        )
+
+    args = {
+        "corpus": str(corpus),
+        "spec": vars(spec),
+        "max_vocab": a.max_vocab,
+        "embedding": a.embedding,
+        "dim": a.dim,
+        "k": a.k,
+        "recall_queries": a.recall_queries,
+    }
+    state = work / "state"
+    if not a.skip_ingest:
+        result["ingest"] = {}
+        for phase in ("bm25", "dense", "ingest_all"):
+            r = run_phase(phase, work / f"state_{phase}", args)
+            result["ingest"][phase] = r
+            print(
+                f"  ingest {phase:<11} {r['docs_per_sec']} docs/s "
+                f"pic RSS {r['peak_rss_mb']} Mio",
+                file=sys.stderr,
+            )
+        # l'état de l'ingest unifié sert aux étapes suivantes
+        shutil.rmtree(state, ignore_errors=True)
+        os.replace(work / "state_ingest_all", state)
+    result["recall"] = run_phase("recall", state, args)
+
+    if not a.skip_queries:
+        levels = [int(c) for c in a.concurrency.split(",") if c]
+        qs = queries(spec, max(a.requests, 100), seed=3)
+        proc, base = start_server(state, a.cache)
+        try:
+            result["queries"] = asyncio.run(
+                bench_queries(base, qs, a.k, levels, a.requests)
+            )
+        finally:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    out = a.out or RESULTS_DIR / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"résultats : {out}", file=sys.stderr)
+    if a.baseline is not None:
+        for line in compare(result, json.loads(a.baseline.read_text())):
+            print(line)
+    if tmp is not None:
+        tmp.cleanup()
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,387 @@
-def ingest(path: str) -> None:
-    # TODO: OCR, split sémantique, embeddings -> Qdrant
-    print(f"Ingestion stub: {path}")
+"""Pipeline d'ingestion en flux : parcours -> lecture -> tokenisation -> index.
+
+Le parcours (stat seulement) est fait d'abord : le nombre de fichiers et
+d'octets à lire est connu pour la progression. Lecture et tokenisation
+tournent ensuite chacune sur son pool avec un nombre borné d'éléments en
+vol : la mémoire de pointe (textes) ne dépend pas de la taille du corpus.
+L'étage d'indexation consomme `ScanResult.changed` au fil de l'eau.
+
+La tokenisation (regex, sous le GIL) tourne par défaut dans un pool de
+processus persistant : un ingest en tâche de fond ne ralentit pas les
+requêtes servies par le même processus. Ses workers sont lancés en
+"spawn" : un script qui ingère doit protéger son point d'entrée
+(`if __name__ == "__main__"`), ou utiliser LOUMINA_INGEST_POOL=thread.
+`Progress` suit l'avancement et porte l'annulation (cf. `apps.server.utils.jobs`).
+
+Fichiers texte seulement (pas d'OCR) ; un fichier est indexé comme un seul
+document, sans découpage en passages.
+"""
+
+from __future__ import annotations
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+import hashlib
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
+
+from apps.server.utils.generation import PUBLISH_LOCK, next_generation
+from apps.server.utils.indexer import DEFAULT_EXTS, iter_files
+from apps.server.utils.manifest import FileEntry, Manifest, ScanResult, decode
+from apps.server.utils.tokens import VOCAB, ParsedDoc, tokenize_spans
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+READ_WORKERS = int(os.getenv("LOUMINA_INGEST_READERS", "4"))
+TOKENIZE_WORKERS = int(os.getenv("LOUMINA_INGEST_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.getenv("LOUMINA_INGEST_QUEUE", "64"))
+# "process" (défaut) ou "thread" : la tokenisation (regex) garde le GIL
+TOKENIZE_POOL = os.getenv("LOUMINA_INGEST_POOL", "process")
+
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_PROCESS_POOL_LOCK = threading.Lock()
+
+
+class Cancelled(Exception):
+    """Ingest annulé (levé avant toute publication des index)."""
+
+
+@dataclass
+class Progress:
+    """Avancement d'un ingest, écrit par le flux et lu par `/jobs`.
+
+    Seul le thread qui consomme le flux écrit les compteurs. `cancel` peut
+    venir de n'importe quel thread : le flux lève `Cancelled` au fichier
+    suivant, et `publishing` est le dernier point d'annulation.
+    """
+
+    phase: str = "queued"  # scan -> read -> index -> publish
+    files_scanned: int = 0  # parcourus (stat)
+    files_total: int = 0  # à lire (nouveaux ou modifiés), connus après le parcours
+    bytes_total: int = 0
+    files_read: int = 0
+    bytes_read: int = 0
+    files_indexed: int = 0  # tokenisés et passés aux index
+    read_started: Optional[float] = None
+    read_ended: Optional[float] = None
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def check(self) -> None:
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def publishing(self) -> None:
+        """Dernier point d'annulation : la suite publie les nouveaux index."""
+        self.check()
+        self.phase = "publish"
+
+    def info(self) -> Dict[str, Any]:
+        """Compteurs, débit de lecture et ETA (None hors lecture)."""
+        end = self.read_ended or time.time()
+        elapsed = end - self.read_started if self.read_started else 0.0
+        rate = self.bytes_read / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.phase == "read" and rate > 0:
+            eta = round(max(0, self.bytes_total - self.bytes_read) / rate, 1)
+        return {
+            "phase": self.phase,
+            "files_scanned": self.files_scanned,
+            "files_total": self.files_total,
+            "files_read": self.files_read,
+            "files_indexed": self.files_indexed,
+            "bytes_total": self.bytes_total,
+            "bytes_read": self.bytes_read,
+            "bytes_per_sec": round(rate),
+            "files_per_sec": round(self.files_read / elapsed, 1) if elapsed else 0.0,
+            "eta_secs": eta,
+        }
+
+
+@dataclass
+class _Pending:
+    rel: str
+    path: pathlib.Path
+    size: int
+    mtime: float
+    before: Optional[FileEntry]
+
+
+@dataclass
+class _Raw:
+    item: _Pending
+    sha1: str
+    text: Optional[str]  # None : contenu identique au manifeste
+
+
+def bounded_map(
+    fn: Callable[[T], R], items: Iterable[T], pool: Executor, window: int
+) -> Iterator[R]:
+    """`pool.map` ordonné avec au plus `window` tâches en vol (backpressure).
+
+    Abandonné en cours (annulation, erreur), les tâches pas encore
+    démarrées sont annulées.
+    """
+    inflight: deque = deque()
+    try:
+        for it in items:
+            inflight.append(pool.submit(fn, it))
+            if len(inflight) >= window:
+                yield inflight.popleft().result()
+        while inflight:
+            yield inflight.popleft().result()
+    finally:
+        for f in inflight:
+            f.cancel()
+
+
+def _process_pool() -> ProcessPoolExecutor:
+    """Pool de tokenisation partagé par les ingests (démarré une fois).
+
+    "spawn" : le serveur a des threads (uvicorn, hnswlib), fork y est risqué.
+    """
+    global _PROCESS_POOL
+    with _PROCESS_POOL_LOCK:
+        # un worker mort rend le pool inutilisable : on en repart un neuf
+        if _PROCESS_POOL is None or getattr(_PROCESS_POOL, "_broken", False):
+            _PROCESS_POOL = ProcessPoolExecutor(
+                max(1, TOKENIZE_WORKERS),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _PROCESS_POOL
+
+
+def _read(item: _Pending) -> Optional[_Raw]:
+    try:
+        data = item.path.read_bytes()
+    except Exception:
+        return None
+    sha1 = hashlib.sha1(data).hexdigest()
+    if item.before is not None and item.before.sha1 == sha1:
+        return _Raw(item, sha1, None)
+    return _Raw(item, sha1, decode(data))
+
+
+def _parse(rel: str, mtime: float, text: str) -> ParsedDoc:
+    toks, spans = tokenize_spans(text)
+    return ParsedDoc(rel, mtime, toks, text, spans=spans)
+
+
+def _tokenize(raw: Optional[_Raw]):
+    if raw is None or raw.text is None:
+        return raw, None
+    return raw, _parse(raw.item.rel, raw.item.mtime, raw.text)
+
+
+def _tokenize_remote(raw: Optional[_Raw]):
+    # variante process : le texte ne revient qu'une fois (dans le ParsedDoc)
+    if raw is None or raw.text is None:
+        return raw, None
+    doc = _parse(raw.item.rel, raw.item.mtime, raw.text)
+    return _Raw(raw.item, raw.sha1, ""), doc
+
+
+def scan(
+    root: pathlib.Path,
+    exts: Iterable[str],
+    prev: Optional[Manifest] = None,
+    readers: int = READ_WORKERS,
+    workers: int = TOKENIZE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    pool: str = TOKENIZE_POOL,
+    progress: Optional[Progress] = None,
+) -> ScanResult:
+    """Compare l'arborescence au manifeste précédent, en flux.
+
+    Un fichier dont (taille, mtime) n'a pas bougé n'est pas relu. Sinon il
+    est lu et haché : si le hash est identique, seul son mtime est mis à jour.
+    Sans manifeste compatible, tout est relu (mode "full").
+
+    `changed` est un générateur de `ParsedDoc` ; `removed`, `mtimes`,
+    `counts` et `manifest` ne sont complets qu'une fois `changed` épuisé.
+    Il met `progress` à jour et lève `Cancelled` si le job est annulé.
+    """
+    progress = progress if progress is not None else Progress()
+    exts = sorted(set(exts))
+    incremental = prev is not None and prev.matches(root, exts)
+    old = prev.files if incremental else {}
+    manifest = Manifest(root=str(root), exts=exts)
+    removed: List[str] = []
+    mtimes: Dict[str, float] = {}
+    counts = {"added": 0, "modified": 0, "deleted": 0, "unchanged": 0}
+
+    def walk() -> List[_Pending]:
+        progress.phase = "scan"
+        pending: List[_Pending] = []
+        for p in iter_files(root, exts):
+            progress.check()
+            progress.files_scanned += 1
+            try:
+                rel = str(p.relative_to(root))
+                st = p.stat()
+            except Exception:
+                continue
+            before = old.get(rel)
+            if (
+                before is not None
+                and before.size == st.st_size
+                and before.mtime == st.st_mtime
+            ):
+                manifest.files[rel] = before
+                counts["unchanged"] += 1
+                continue
+            pending.append(_Pending(rel, p, st.st_size, st.st_mtime, before))
+            progress.files_total += 1
+            progress.bytes_total += st.st_size
+        return pending
+
+    def changed() -> Iterator[ParsedDoc]:
+        pending = walk()
+        progress.phase = "read"
+        progress.read_started = time.time()
+        if pool == "process":
+            tok_fn, tp = _tokenize_remote, _process_pool()
+        else:
+            tok_fn, tp = _tokenize, ThreadPoolExecutor(max(1, workers))
+        try:
+            with ThreadPoolExecutor(max(1, readers)) as rp:
+                raws = bounded_map(_read, pending, rp, queue_size)
+                yield from tokenized(bounded_map(tok_fn, raws, tp, queue_size))
+        finally:
+            progress.read_ended = time.time()
+            if tp is not _PROCESS_POOL:
+                tp.shutdown(cancel_futures=True)
+        progress.phase = "index"
+        for rel in old:
+            if rel not in manifest.files:
+                removed.append(rel)
+                counts["deleted"] += 1
+
+    def tokenized(results: Iterator) -> Iterator[ParsedDoc]:
+        for raw, doc in results:
+            progress.check()
+            if raw is None:
+                continue
+            it = raw.item
+            progress.files_read += 1
+            progress.bytes_read += it.size
+            manifest.files[it.rel] = FileEntry(it.size, it.mtime, raw.sha1)
+            if doc is None:
+                mtimes[it.rel] = it.mtime
+                counts["unchanged"] += 1
+                continue
+            if it.before is None:
+                counts["added"] += 1
+            else:
+                removed.append(it.rel)
+                counts["modified"] += 1
+            yield doc
+            progress.files_indexed += 1
+
+    return ScanResult(
+        manifest, incremental, changed(), removed, mtimes, counts, progress
+    )
+
+
+def ingest(
+    path: str, exts: Optional[Iterable[str]] = None, progress: Optional[Progress] = None
+) -> Dict:
+    """Ingestion (incrémentale) de `path` dans l'index BM25 global."""
+    from apps.server.utils.indexer import rebuild
+
+    return rebuild(
+        pathlib.Path(path).resolve(), exts or DEFAULT_EXTS, progress=progress
+    )
+
+
+def ingest_all(
+    root: pathlib.Path,
+    exts: Optional[Iterable[str]] = None,
+    full: bool = False,
+    max_vocab: int = 4096,
+    embedding: str = "bow",
+    dim: int = 256,
+    recall_queries: int = 0,
+    recall_target: Optional[float] = None,
+    progress: Optional[Progress] = None,
+) -> Dict:
+    """Ingest unifié : une lecture, une tokenisation, deux index.
+
+    Chaque fichier est lu et interné une seule fois dans le vocabulaire
+    partagé ; les mêmes tableaux de term ids alimentent INDEX et VSTORE, qui
+    sont ensuite publiés ensemble sous un même numéro de génération.
+    """
+    from apps.server.utils.indexer import BM25_MANIFEST_PATH, DOCS, INDEX
+    from apps.server.utils.vector_index import MANIFEST_PATH as DENSE_MANIFEST_PATH
+    from apps.server.utils.vector_index import VSTORE
+
+    exts = exts or DEFAULT_EXTS
+    prev = None
+    if not full:
+        bm = Manifest.load(BM25_MANIFEST_PATH)
+        dn = VSTORE.synced_manifest()
+        if bm is not None and dn is not None and bm == dn:
+            if set(bm.files) == set(INDEX.paths()):
+                prev = bm
+    res = scan(root, exts, prev, progress=progress)
+    t0 = time.perf_counter()
+    # une reconstruction écrit dans une nouvelle époque du DocStore, abandonnée
+    # si elle n'est pas publiée : le prochain save() supprimerait sinon les
+    # textes des index servis
+    with nullcontext() if res.incremental else DOCS.rebuilding():
+        docs = []
+        for d in res.changed:
+            td = VOCAB.term_doc(d)
+            # texte et positions rangés tout de suite : la liste ne garde que
+            # les term ids / tf, ce que les deux index retiennent de toute façon
+            DOCS.put(td)
+            docs.append(td)
+        ingest_secs = time.perf_counter() - t0
+        if res.incremental:
+            bm_state = INDEX.prepare_update(docs, res.removed, res.mtimes)
+        else:
+            bm_state = INDEX.prepare_build(docs)
+        dn_state = VSTORE.prepare(
+            docs,
+            res.removed,
+            res.mtimes,
+            incremental=res.incremental,
+            max_vocab=max_vocab,
+            embedding=embedding,
+            dim=dim,
+            recall_target=recall_target,
+        )
+        res.progress.publishing()
+    with PUBLISH_LOCK:
+        gen = next_generation()
+        bm_stats = INDEX.install(bm_state, gen, persist=False)
+        dn_stats = VSTORE.install(dn_state, gen, persist=False)
+    INDEX.save()
+    VSTORE.save()
+    res.manifest.save(BM25_MANIFEST_PATH)
+    res.manifest.save(DENSE_MANIFEST_PATH)
+    return {
+        "generation": gen,
+        "read_tokenize_secs": round(ingest_secs, 3),
+        "bm25": bm_stats,
+        "dense": {**dn_stats, **VSTORE.eval_recall(recall_queries)},
+        **res.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(ingest(sys.argv[1] if len(sys.argv) > 1 else "."))
@@ -0,0 +1,18 @@
+from collections import Counter
+
+from rag.eval.synth import SynthSpec, generate, queries, word
+
+
+def test_synthetic_corpus_is_zipfian_and_reproducible(tmp_path):
+    spec = SynthSpec(docs=60, vocab=2000, median_tokens=80, seed=3)
+    stats = generate(tmp_path / "a", spec)
+    generate(tmp_path / "b", spec)
+    files = sorted((tmp_path / "a").rglob("*.md"))
+    assert len(files) == 60 and stats["bytes"] > 0
+    assert [f.read_bytes() for f in files] == [
+        f.read_bytes() for f in sorted((tmp_path / "b").rglob("*.md"))
+    ]
+    freq = Counter(w for f in files for w in f.read_text().split()[3:])
+    # le mot de rang 0 domine, le rang 10 est nettement plus rare
+    assert freq[word(0)] > 5 * freq[word(10)] > 0
+    assert len(set(queries(spec, 50))) > 40
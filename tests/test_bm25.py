@@ -0,0 +1,157 @@
+from collections import Counter
+import math
+import random
+import threading
+
+import pytest
+
+from apps.server.utils.indexer import BM25Index, Doc
+from apps.server.utils.tokens import tokenize
+
+
+def _corpus(n=300, seed=7):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(400)]
+    weights = [1.0 / (i + 1) for i in range(len(words))]
+    docs = []
+    for i in range(n):
+        toks = rng.choices(words, weights=weights, k=rng.randint(0, 60))
+        docs.append(Doc(path=f"d{i}.md", text=" ".join(toks), mtime=0.0))
+    return docs
+
+
+def test_search_scores_only_matching_docs():
+    idx = BM25Index()
+    idx.build(
+        [
+            Doc("a.md", "le chat dort sur le canapé", 0.0),
+            Doc("b.md", "un chien aboie", 0.0),
+            Doc("c.md", "chat chat chat", 0.0),
+        ]
+    )
+    hits = idx.search("chat", k=2)
+    assert [h["doc"] for h in hits] == ["c.md", "a.md"]
+    assert all(h["score"] > 0 for h in hits)
+    assert idx.search("chat", k=0) == []
+
+
+def test_ranking_identical_to_bm25okapi():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    docs = _corpus()
+    idx = BM25Index()
+    idx.build(docs)
+    ref = rank_bm25.BM25Okapi([BM25Index._tok(d.text) for d in docs])
+    rng = random.Random(1)
+    for _ in range(50):
+        q = " ".join(f"w{rng.randint(0, 450)}" for _ in range(rng.randint(1, 4)))
+        k = rng.choice([1, 5, 20, 400])
+        scores = ref.get_scores(BM25Index._tok(q))
+        expected = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        hits = idx.search(q, k)
+        assert [h["doc"] for h in hits] == [docs[i].path for i in expected[:k]]
+        assert [h["score"] for h in hits] == [float(scores[i]) for i in expected[:k]]
+
+
+def test_persisted_index_reloads_with_mmap(tmp_path):
+    docs = _corpus(n=50)
+    idx = BM25Index(state_dir=tmp_path / "bm25")
+    idx.build(docs)
+    loaded = BM25Index(state_dir=tmp_path / "bm25")
+    assert loaded.paths() == [d.path for d in docs]
+    for q in ("w0 w3", "w17", "w1 w2 w5"):
+        strip = [(h["doc"], h["score"], h["snippet"]) for h in idx.search(q, 5)]
+        assert [
+            (h["doc"], h["score"], h["snippet"]) for h in loaded.search(q, 5)
+        ] == strip
+    # une mise à jour sur l'index mappé réécrit l'état sur disque
+    loaded.update([], removed=["d0.md"])
+    assert "d0.md" not in BM25Index(state_dir=tmp_path / "bm25").paths()
+
+
+def test_search_serves_during_rebuild():
+    # deux corpus disjoints : chaque réponse doit venir d'une seule génération
+    old = [Doc(f"old{i}.md", "chat " * (i + 1), 0.0) for i in range(200)]
+    new = [Doc(f"new{i}.md", "chat chien " * (i + 1), 0.0) for i in range(200)]
+    idx = BM25Index()
+    idx.build(old)
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        while not stop.is_set():
+            prefixes = {h["doc"][:3] for h in idx.search("chat", 10)}
+            if len(prefixes) != 1:
+                errors.append(prefixes)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for i in range(10):
+        idx.build(new if i % 2 else old)
+    stop.set()
+    for t in threads:
+        t.join()
+    assert not errors
+
+
+def test_search_batch_matches_single_queries():
+    idx = BM25Index()
+    idx.build(_corpus())
+    queries = ["w0 w3", "w3 w0", "w17", "absent", "w1 w2 w5 w1", "w17"]
+    batch = idx.search_batch(queries, k=7)
+    strip = [[(h["doc"], h["score"]) for h in hits] for hits in batch]
+    assert strip == [
+        [(h["doc"], h["score"]) for h in idx.search(q, 7)] for q in queries
+    ]
+
+
+def _cosine(a, b):
+    ca, cb = Counter(tokenize(a)), Counter(tokenize(b))
+    dot = sum(v * cb[t] for t, v in ca.items())
+    na = math.sqrt(sum(v * v for v in ca.values()))
+    nb = math.sqrt(sum(v * v for v in cb.values()))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def test_rerank_scores_query_passages(tmp_path):
+    docs = _corpus(n=80)
+    idx = BM25Index(state_dir=tmp_path / "bm25")
+    idx.build(docs)
+    idx.update([Doc("new.md", "w1 w1 w2 inédit", 0.0)], removed=["d3.md", "d40.md"])
+    queries = ["w0 w3", "w1 w1 w9", "inédit w2", "absent"]
+    for index in (idx, BM25Index(state_dir=tmp_path / "bm25")):
+        for q, hits in zip(queries, index.search_rerank_batch(queries, k=6)):
+            assert sorted(h["doc"] for h in hits) == sorted(
+                h["doc"] for h in index.search(q, 6)
+            )
+            for h in hits:
+                assert h["rerank"]["cosine"] == pytest.approx(_cosine(q, h["snippet"]))
+            scores = [h["rerank"]["score"] for h in hits]
+            assert scores == sorted(scores, reverse=True)
+
+
+def test_rerank_never_tokenizes_text(monkeypatch):
+    from apps.server.utils import docstore, indexer
+
+    idx = BM25Index()
+    idx.build(_corpus(n=80))
+    queries = ["w0 w3", "w1 w1 w9"]
+
+    def ranked():
+        batch = idx.search_rerank_batch(queries, k=6)
+        return [[(h["doc"], h["rerank"]) for h in hits] for hits in batch]
+
+    expected = ranked()
+    seen = []
+
+    def spy(text):
+        seen.append(text)
+        return tokenize(text)
+
+    def forbidden(text):
+        raise AssertionError("texte retokenisé")
+
+    monkeypatch.setattr(indexer, "tokenize", spy)
+    monkeypatch.setattr(docstore, "tokenize_spans", forbidden)
+    assert ranked() == expected
+    assert seen == queries  # seules les requêtes sont tokenisées
@@ -0,0 +1,44 @@
+import pytest
+
+from apps.server.utils.cache import ResultCache, normalize
+
+
+class _Store:
+    generation = 1
+
+
+def _hits():
+    return [{"doc": "a", "age_days": 0.0, "scores": {"decay": 1.0, "final": 0.8}}]
+
+
+def test_lru_eviction_and_generation_invalidation():
+    store = _Store()
+    cache = ResultCache(store, maxsize=2, ttl=60)
+    calls = []
+
+    def compute(q):
+        calls.append(q)
+        return _hits()
+
+    for q in ("a", "b", "a", "c", "b"):
+        cache.get_or_compute(q, lambda q=q: compute(q))
+    # "b" a été évincé par "c" (LRU : "a" venait d'être relu)
+    assert calls == ["a", "b", "c", "b"]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 4, 2)
+
+    store.generation = 2  # nouvelle publication d'index
+    cache.get_or_compute("a", lambda: compute("a"))
+    assert calls[-1] == "a" and cache.invalidations == 2
+
+
+def test_hit_recomputes_freshness(monkeypatch):
+    cache = ResultCache(_Store(), maxsize=4, ttl=1e9)
+    now = [1_000_000.0]
+    monkeypatch.setattr("apps.server.utils.cache.time.time", lambda: now[0])
+    cache.get_or_compute("q", _hits, half_life_days=1.0)
+    now[0] += 86400.0  # une demi-vie plus tard
+    hit = cache.get_or_compute("q", _hits, half_life_days=1.0)[0]
+    assert hit["age_days"] == pytest.approx(1.0)
+    assert hit["scores"]["decay"] == pytest.approx(0.5)
+    assert hit["scores"]["final"] == pytest.approx(0.4)
+    assert normalize("  Chat,  CHIEN! ") == normalize("chat chien")
@@ -0,0 +1,116 @@
+import pytest
+
+from apps.server.utils import vector_index as vi
+from rag.pipelines.ingest import Cancelled, Progress
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    for name in (
+        "DENSE_DIR",
+        "MANIFEST_PATH",
+        "TUNING_PATH",
+        "DOCS_PATH",
+    ):
+        monkeypatch.setattr(vi, name, tmp_path / getattr(vi, name).name)
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    topics = ["chat chien souris", "python numpy index", "pain beurre confiture"]
+    for i in range(30):
+        (corpus / f"d{i}.md").write_text(f"{topics[i % 3]} doc{i} " * (1 + i % 4))
+    return corpus
+
+
+@pytest.mark.parametrize("embedding", ["bow", "hash"])
+def test_build_and_reload(state, embedding):
+    store = vi.DenseStore()
+    stats = store.build(state, {".md"}, embedding=embedding, dim=64, recall_queries=10)
+    assert stats["docs"] == 30 and stats["embedding"] == embedding
+    assert 0.0 <= stats["recall@10"] <= 1.0
+    hits = store.search("numpy index", k=3)
+    assert len(hits) == 3
+    assert all("python numpy index" in h["snippet"] for h in hits)
+
+    reloaded = vi.DenseStore()
+    assert [h["doc"] for h in reloaded.search("numpy index", k=3)] == [
+        h["doc"] for h in hits
+    ]
+    if embedding == "hash":
+        assert reloaded.meta.dim == 64 and reloaded.meta.vocab == []
+
+
+def test_search_batch_matches_single_queries(state):
+    store = vi.DenseStore()
+    store.build(state, {".md"})
+    queries = ["numpy index", "chat", "pain beurre", "inconnu"]
+    batch = store.search_batch(queries, k=4)
+    for q, hits in zip(queries, batch):
+        single = store.search(q, k=4)
+        assert [h["doc"] for h in hits] == [h["doc"] for h in single]
+
+
+def test_ef_tuned_persisted_and_reloaded(state):
+    store = vi.DenseStore()
+    stats = store.build(state, {".md"}, recall_target=0.9)
+    tuning = stats["tuning"]
+    assert set(tuning["ef"]) == {1, 5, 10, 20}  # tranches k < 30 docs
+    for k, ef in tuning["ef"].items():
+        assert ef >= k
+        assert tuning["recall"][k] >= 0.9
+    assert vi.DenseStore()._load_tuning(store.generation)["ef"] == tuning["ef"]
+    assert vi.DenseStore()._load_tuning(store.generation + 1) == {}
+
+
+def _parsed(path, text):
+    from apps.server.utils.tokens import ParsedDoc, tokenize
+
+    return ParsedDoc(path, 0.0, tokenize(text), text)
+
+
+def test_upsert_and_delete_update_index_in_place(state, monkeypatch):
+    store = vi.DenseStore()
+    store.build(state, {".md"})
+    index = store.index
+    stats = store.upsert(
+        [_parsed("d1.md", "numpy numpy python"), _parsed("n.md", "chat")]
+    )
+    assert stats["hnsw"] == "update" and stats["upserted"] == 2
+    stats = store.delete(["d4.md"])
+    assert (stats["docs"], stats["deleted"], stats["tombstones"]) == (30, 1, 2)
+    assert store.index is index  # ni reconstruit ni copié (places libres)
+    assert "d4.md" not in [h["doc"] for h in store.search("python numpy index", 30)]
+    hits = store.search("numpy python", 30)  # ef >= 30 : recherche exhaustive
+    assert hits[0]["snippet"] == "numpy numpy python"
+
+    reloaded = vi.DenseStore()
+    assert len(reloaded.search("chat", 30)) == 30
+    assert reloaded.meta.paths[len(reloaded.meta.paths) - 1] == "n.md"
+    monkeypatch.setattr(vi, "COMPACT_RATIO", 0.2)
+    stats = reloaded.delete([f"d{i}.md" for i in range(10, 20)])
+    assert stats["hnsw"] == "rebuild" and stats["docs"] == 20  # compaction
+    assert reloaded.index.get_current_count() == 20
+
+
+class _CancelAtPublish(Progress):
+    def publishing(self) -> None:
+        self.cancel()
+        super().publishing()
+
+
+def test_cancel_at_publish_leaves_index_served(state):
+    store = vi.DenseStore()
+    store.build(state, {".md"}, embedding="hash", dim=64)
+    (state / "d1.md").write_text("pomme poire")
+    (state / "d2.md").unlink()
+    with pytest.raises(Cancelled):
+        store.build(
+            state, {".md"}, embedding="hash", dim=64, progress=_CancelAtPublish()
+        )
+    served = {h["doc"]: h["snippet"] for h in store.search("python numpy", 30)}
+    assert len(served) == 30 and "python numpy index" in served["d1.md"]
+
+    stats = store.build(state, {".md"}, embedding="hash", dim=64)
+    assert stats["hnsw"] == "update" and stats["docs"] == 29
+    hits = store.search("pomme poire", 30)  # ef >= 30 : recherche exhaustive
+    assert hits[0]["snippet"] == "pomme poire"
+    assert "d2.md" not in [h["doc"] for h in store.search("chat chien", 30)]
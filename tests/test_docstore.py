@@ -0,0 +1,128 @@
+import numpy as np
+
+from apps.server.utils.docstore import DocStore
+from apps.server.utils.indexer import BM25Index, Doc
+from apps.server.utils.tokens import snippet
+
+
+def test_add_view_persist_reload(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    a = store.add("a.md", "été " * 200, 1.0)
+    view = store.view()
+    b = store.add("b.md", "bonjour", 2.0)
+    assert len(view) == 1  # vue figée : b n'y est pas
+    assert view[a].text == "été " * 200 and view[a].chars == 800
+    assert view[a].snippet == snippet("été " * 200)
+    store.touch(np.array([a]), np.array([5.0]))
+    assert view.mtime(a) == 1.0 and store.view().mtime(a) == 5.0
+    store.save()
+    store.add("orphelin.md", "jamais sauvé", 0.0)  # ingest interrompu
+
+    loaded = DocStore(tmp_path / "docs")
+    assert len(loaded) == 2
+    doc = loaded.view()[b]
+    assert (doc.path, doc.text, doc.mtime) == ("b.md", "bonjour", 2.0)
+    assert loaded.add("c.md", "suite", 3.0) == 2
+    assert loaded.view().text(2) == "suite"
+
+
+def test_reset_keeps_old_views_and_adopt_copies(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    ids = np.array([store.add(f"d{i}.md", f"texte {i}", 0.0) for i in range(3)])
+    old = store.view()
+    assert store.adopt(old, ids) is ids
+    store.reset()
+    assert old.text(2) == "texte 2"
+    kept = store.adopt(old, ids[[0, 2]])
+    assert [store.view().text(i) for i in kept.tolist()] == ["texte 0", "texte 2"]
+    store.save()
+    assert sorted(p.name for p in (tmp_path / "docs").glob("text.*")) == [
+        f"text.{store.epoch}.bin"
+    ]
+
+
+def test_restore_abandons_new_epoch(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    store.add("a.md", "ancien", 0.0)
+    store.save()
+    prev = store.reset()
+    store.add("b.md", "reconstruction avortée", 0.0)
+    store.restore(prev)
+    store.save()
+    assert [p.name for p in (tmp_path / "docs").glob("text.*")] == [
+        f"text.{store.epoch}.bin"
+    ]
+    loaded = DocStore(tmp_path / "docs")
+    assert len(loaded) == 1 and loaded.view().text(0) == "ancien"
+    assert loaded.add("c.md", "suite", 0.0) == 1
+    assert loaded.view().text(1) == "suite"
+
+
+def test_put_releases_text_and_positions():
+    from apps.server.utils.tokens import VOCAB, ParsedDoc, tokenize_spans
+
+    toks, spans = tokenize_spans("chat noir chat")
+    td = VOCAB.term_doc(ParsedDoc("a.md", 0.0, toks, "chat noir chat", spans=spans))
+    assert td.positions is not None
+    store = DocStore()
+    i = store.put(td)
+    assert td.text is None and td.positions is None
+    assert store.view().positions(i).shape == (4, 3)
+
+
+def test_indexes_share_one_store(tmp_path):
+    store = DocStore(tmp_path / "docs")
+    idx = BM25Index(state_dir=tmp_path / "bm25", store=store)
+    idx.build([Doc(f"{c}.md", f"chat {c}", 0.0) for c in "abcd"])
+    idx.update([Doc("b.md", "chien jaune", 0.0)])
+    assert len(store) == 5  # a-d, puis la nouvelle version de b
+    reloaded = BM25Index(state_dir=tmp_path / "bm25", store=DocStore(tmp_path / "docs"))
+    assert reloaded.search("jaune", 1)[0]["snippet"] == "chien jaune"
+
+
+def test_passage_centred_on_query_terms(tmp_path):
+    text = "\n".join(["intro sans rapport"] * 40 + ["le gâteau au chocolat"] + ["fin"])
+    store = DocStore(tmp_path / "docs")
+    i = store.add("a.md", text, 0.0)
+    snip, loc = store.view().passage(i, ["chocolat", "gâteau"])
+    assert "le gâteau au chocolat" in snip and loc["lines"][1] == 42
+    a, b = loc["bytes"]
+    assert text.encode()[a:b].decode().replace("\n", " ") == snip
+    store.save()
+    assert DocStore(tmp_path / "docs").view().passage(i, ["chocolat"])[1] == loc
+
+    idx = BM25Index(store=store)
+    idx.build([Doc("a.md", text, 0.0), Doc("b.md", "autre chose", 0.0)])
+    hit = idx.search("chocolat", 1)[0]
+    assert (hit["snippet"], hit["loc"]) == (snip, loc)
+
+
+def test_full_rebuilds_keep_shared_store_size(tmp_path, monkeypatch):
+    from apps.server.utils import indexer
+    from apps.server.utils import vector_index as vi
+
+    for name in ("DENSE_DIR", "MANIFEST_PATH", "TUNING_PATH"):
+        monkeypatch.setattr(vi, name, tmp_path / getattr(vi, name).name)
+    store = DocStore(tmp_path / "docs")
+    bm25 = BM25Index(state_dir=tmp_path / "bm25", vocab=store.vocab, store=store)
+    monkeypatch.setattr(indexer, "DOCS", store)
+    monkeypatch.setattr(indexer, "INDEX", bm25)
+    monkeypatch.setattr(indexer, "BM25_MANIFEST_PATH", tmp_path / "bm25.json")
+    dense = vi.DenseStore(vocab=store.vocab, store=store)
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    for c in "abc":
+        (corpus / f"{c}.md").write_text(f"chat {c} " * 5)
+
+    sizes = []
+    for _ in range(4):
+        indexer.rebuild(corpus, {".md"}, full=True)
+        dense.build(corpus, {".md"}, full=True, embedding="hash", dim=16)
+        files = sorted((tmp_path / "docs").glob("*.bin"))
+        sizes.append((len(store), [(p.name[:4], p.stat().st_size) for p in files]))
+    assert sizes[1:] == sizes[:-1]
+    assert len(store) == 6  # les docs vivants de chaque index, sans plus
+    assert bm25.search("chat", 3)[0]["snippet"].startswith("chat")
+    assert len(dense.search("chat", 3)) == 3
+    reloaded = vi.DenseStore(vocab=store.vocab, store=DocStore(tmp_path / "docs"))
+    assert reloaded.search("chat", 3)[0]["snippet"].startswith("chat")
@@ -0,0 +1,54 @@
+import pytest
+
+from apps.server.utils import vector_index as vi
+from apps.server.utils.filters import DocFilter, MaskCache
+from apps.server.utils.indexer import BM25Index, Doc
+
+
+def _docs():
+    return [
+        Doc(f"{d}/f{i}{ext}", f"chat chien doc{i}", float(i))
+        for i, (d, ext) in enumerate(
+            [("projet", ".md"), ("projet2", ".md"), ("projet", ".py"), ("autre", ".md")]
+            * 5
+        )
+    ]
+
+
+def test_doc_filter_normalises_and_matches_directories():
+    assert DocFilter.of() is None and DocFilter.of("./", []) is None
+    flt = DocFilter.of("./projet/", ["MD", ".txt"])
+    assert flt == DocFilter("projet", (".md", ".txt"))
+    paths = ["projet/a.md", "projet2/a.md", "projet/b.py", "projet", ""]
+    assert flt.path_mask(paths).tolist() == [True, False, False, False, False]
+
+    cache, calls = MaskCache(), []
+    compute = lambda: calls.append(1) or flt.path_mask(paths)  # noqa: E731
+    assert cache.get(1, flt.path_key, compute) is cache.get(1, flt.path_key, compute)
+    cache.get(2, flt.path_key, compute)
+    assert len(calls) == 2
+
+
+def test_bm25_filters_before_top_k(tmp_path):
+    idx = BM25Index(state_dir=tmp_path / "bm25")
+    idx.build(_docs())
+    flt = DocFilter.of("projet", [".md"], min_mtime=4.0)
+    hits = idx.search("chat", 3, flt)
+    assert [h["doc"] for h in hits] == ["projet/f4.md", "projet/f8.md", "projet/f12.md"]
+    assert idx.search_rerank("chat", 10, flt=DocFilter.of("vide")) == []
+
+
+@pytest.mark.parametrize("exact_max", [4096, 0])
+def test_dense_filter_exact_and_hnsw(tmp_path, monkeypatch, exact_max):
+    for name in ("DENSE_DIR", "MANIFEST_PATH", "TUNING_PATH", "DOCS_PATH"):
+        monkeypatch.setattr(vi, name, tmp_path / getattr(vi, name).name)
+    monkeypatch.setattr(vi, "FILTER_EXACT_MAX", exact_max)
+    for d in _docs():
+        (tmp_path / d.path).parent.mkdir(exist_ok=True)
+        (tmp_path / d.path).write_text(d.text)
+    store = vi.DenseStore()
+    store.build(tmp_path, {".md", ".py"})
+    hits = store.search("chat chien", 10, DocFilter.of("projet", [".py"]))
+    assert sorted(h["doc"] for h in hits) == [
+        f"projet/f{i}.py" for i in (10, 14, 18, 2, 6)
+    ]
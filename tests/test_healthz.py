@@ -1,3 +1,6 @@
+import threading
+import time
+
 from fastapi.testclient import TestClient
 from apps.server.main import app
 
@@ -7,3 +10,50 @@ def test_healthz():
     resp = client.get("/healthz")
     assert resp.status_code == 200
     assert resp.json()["status"] == "ok"
+
+
+def test_trace_header_and_metrics():
+    client = TestClient(app)
+    resp = client.get("/healthz", headers={"x-trace-id": "abc123"})
+    assert resp.headers["x-trace-id"] == "abc123"
+    body = client.get("/metrics").text
+    assert 'loumina_http_requests_total{method="GET",route="/healthz"' in body
+    assert 'route="/healthz",status_class="2xx",quantile="0.99"' in body
+    assert "loumina_cache_hits_total" in body
+
+
+def test_latency_sketch_relative_error():
+    from apps.server.middleware.trace import LatencySketch
+
+    sk = LatencySketch()
+    values = [0.5 + i * 0.37 for i in range(2000)]
+    for v in values:
+        sk.add(v)
+    for q in (0.5, 0.95, 0.99):
+        exact = sorted(values)[int(q * (len(values) - 1))]
+        assert abs(sk.quantile(q) - exact) / exact < 0.02
+
+
+def test_healthz_not_ready_until_background_warmup_ends(monkeypatch):
+    from apps.server import main
+
+    release = threading.Event()
+
+    def warmup():
+        assert release.wait(5)
+        return {"bm25": True, "dense": False, "load_secs": 0.1, "warmup_secs": 0.0}
+
+    monkeypatch.setattr(main, "WARMUP", True)
+    monkeypatch.setattr(main, "warmup", warmup)
+    monkeypatch.setattr(main, "_WARMUP", {"state": "idle"})
+    with TestClient(app) as client:
+        resp = client.get("/healthz")  # servi pendant le warm-up
+        assert resp.status_code == 503 and resp.json()["status"] == "starting"
+        release.set()
+        deadline = time.monotonic() + 5
+        while client.get("/healthz").status_code == 503:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        body = client.get("/healthz").json()
+    assert body["status"] == "ok" and body["warmup"]["state"] == "ready"
+    assert body["warmup"]["load_secs"] == 0.1
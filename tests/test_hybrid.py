@@ -0,0 +1,31 @@
+import pytest
+
+from apps.server.utils.hybrid import fuse
+
+
+def _hit(doc, score, age=0.0):
+    return {"doc": doc, "score": score, "snippet": doc, "age_days": age}
+
+
+BM = [_hit("a", 4.0), _hit("b", 2.0), _hit("c", 1.0, age=30.0)]
+DN = [_hit("c", 0.9, age=30.0), _hit("d", 0.8), _hit("a", 0.1)]
+
+
+def test_weighted_fusion_matches_reference_formula():
+    out = fuse(BM, DN, k=10, alpha=0.6, half_life_days=30.0)
+    by = {h["doc"]: h["scores"] for h in out}
+    assert set(by) == {"a", "b", "c", "d"}
+    assert by["a"]["final"] == pytest.approx(0.6 * 1.0 + 0.4 * 0.1)
+    assert by["b"]["final"] == pytest.approx(0.6 * 0.5)
+    assert by["c"]["final"] == pytest.approx((0.6 * 0.25 + 0.4 * 0.9) * 0.5)
+    assert by["d"]["final"] == pytest.approx(0.4 * 0.8)
+    finals = [h["scores"]["final"] for h in out]
+    assert finals == sorted(finals, reverse=True)
+
+
+def test_rrf_fusion_rewards_agreement():
+    out = fuse(BM, DN, k=2, alpha=0.5, half_life_days=1e9, fusion="rrf", rrf_k=60)
+    # "a" (rangs 1 et 3) et "c" (rangs 3 et 1) devancent les docs d'une seule jambe
+    assert [h["doc"] for h in out] == ["a", "c"]
+    assert out[0]["scores"]["final"] == pytest.approx(0.5 / 61 + 0.5 / 63)
+    assert fuse([], [], k=5) == []
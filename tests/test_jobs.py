@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from apps.server.utils.jobs import Scheduler
+from rag.pipelines.ingest import Cancelled, Progress, scan
+
+
+def test_scheduler_serializes_coalesces_and_cancels():
+    jobs = Scheduler()
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(progress):
+        started.set()
+        while not release.wait(0.01):
+            progress.check()
+        return {"docs": 1}
+
+    first = jobs.submit("ingest", {"root": "/a"}, blocking)
+    assert started.wait(5) and first.status == "running"
+    # un job en cours n'absorbe rien ; les demandes en attente sont fusionnées
+    second = jobs.submit("ingest", {"root": "/a"}, lambda p: {"docs": 2})
+    assert jobs.submit("ingest", {"root": "/a"}, lambda p: {}) is second
+    other = jobs.submit("ingest", {"root": "/b"}, lambda p: {"docs": 3})
+    assert second is not first and second.coalesced == 1
+
+    assert jobs.cancel(other.id).status == "cancelled"
+    jobs.cancel(first.id)
+    assert first.done.wait(5) and first.status == "cancelled"
+    assert second.done.wait(5) and second.result == {"docs": 2}
+    assert [j.id for j in jobs.list()] == [other.id, second.id, first.id]
+    assert jobs.get("inconnu") is None
+
+
+def test_scan_reports_progress_and_stops_when_cancelled(tmp_path):
+    for i in range(5):
+        (tmp_path / f"f{i}.md").write_text("alpha beta " * (i + 1))
+    progress = Progress()
+    res = scan(tmp_path, {".md"}, progress=progress, pool="thread")
+    assert len(list(res.changed)) == 5
+    info = progress.info()
+    assert (info["files_total"], info["files_read"], info["files_indexed"]) == (5, 5, 5)
+    assert info["bytes_read"] == info["bytes_total"] == 11 * 15
+
+    progress = Progress()
+    res = scan(tmp_path, {".md"}, progress=progress, pool="thread")
+    next(res.changed)
+    progress.cancel()
+    with pytest.raises(Cancelled):
+        list(res.changed)
+    with pytest.raises(Cancelled):
+        res.progress.publishing()
@@ -0,0 +1,37 @@
+import os
+
+from apps.server.utils.indexer import BM25Index, load_corpus
+from rag.pipelines.ingest import scan
+
+
+def _hits(idx, q):
+    return sorted((h["doc"], round(h["score"], 9)) for h in idx.search(q, k=10))
+
+
+def test_incremental_update_matches_full_rebuild(tmp_path):
+    for i in range(6):
+        (tmp_path / f"f{i}.md").write_text(f"alpha beta doc{i} " * (i + 1))
+    first = scan(tmp_path, {".md"})
+    idx = BM25Index()
+    idx.build(first.changed)
+    assert not first.incremental and first.counts["added"] == 6
+
+    (tmp_path / "f1.md").write_text("gamma delta")
+    (tmp_path / "f7.md").write_text("alpha gamma")
+    os.remove(tmp_path / "f2.md")
+    st = os.stat(tmp_path / "f3.md")
+    os.utime(tmp_path / "f3.md", (st.st_atime, st.st_mtime + 5))
+
+    res = scan(tmp_path, {".md"}, first.manifest, queue_size=2)
+    assert res.incremental
+    changed = list(res.changed)  # le flux remplit removed/mtimes/counts
+    assert res.counts == {"added": 1, "modified": 1, "deleted": 1, "unchanged": 4}
+    assert {d.path for d in changed} == {"f1.md", "f7.md"}
+    assert set(res.mtimes) == {"f3.md"}
+    idx.update(changed, res.removed, res.mtimes)
+
+    ref = BM25Index()
+    ref.build(load_corpus(tmp_path, {".md"}))
+    assert sorted(idx.paths()) == sorted(ref.paths())
+    for q in ("alpha", "gamma delta", "doc3 beta"):
+        assert _hits(idx, q) == _hits(ref, q)
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+
+from agents import parliament
+from agents.parliament import Task
+
+
+def _sleep(secs, value):
+    def fn(_):
+        time.sleep(secs)
+        return value
+
+    return fn
+
+
+def test_independent_agents_run_in_parallel_and_late_ones_are_cancelled():
+    tasks = [
+        Task("a", _sleep(0.05, "A")),
+        Task("b", _sleep(0.2, "B"), deps=("a",)),
+        Task("c", _sleep(0.2, "C"), deps=("a",)),
+        Task("slow", _sleep(2.0, "S"), deps=("a",)),
+        Task("after_slow", _sleep(0.0, "X"), deps=("slow",)),
+    ]
+    t0 = time.perf_counter()
+    results, votes = asyncio.run(parliament.run(tasks, deadline_ms=500))
+    assert time.perf_counter() - t0 < 0.9  # b et c en parallèle, slow coupé
+    assert results == {"a": "A", "b": "B", "c": "C"}
+    status = {v["agent"]: v["status"] for v in votes}
+    assert status == {
+        "a": "ok",
+        "b": "ok",
+        "c": "ok",
+        "slow": "timeout",
+        "after_slow": "skipped",
+    }
+    assert 400 <= votes[3]["ms"] <= 600
+
+
+def test_budget_and_errors():
+    def boom(_):
+        raise RuntimeError("panne")
+
+    tasks = [
+        Task("a", _sleep(0.0, 1), cost=1.0),
+        Task("b", boom, cost=0.5),
+        Task("c", _sleep(0.0, 3), deps=("a",), cost=1.0),
+        Task("d", _sleep(0.0, 4), deps=("b",), cost=0.1),
+    ]
+    results, votes = asyncio.run(parliament.run(tasks, 1000, max_cost=1.6))
+    assert results == {"a": 1}
+    assert [(v["agent"], v["status"], v["cost"]) for v in votes] == [
+        ("a", "ok", 1.0),
+        ("b", "error", 0.5),
+        ("c", "over_budget", 0.0),
+        ("d", "skipped", 0.0),
+    ]
+
+
+def test_ask_reports_per_agent_votes(monkeypatch):
+    from apps.server.main import app
+
+    def sources(query, **kw):
+        return [
+            {
+                "doc": "a.md",
+                "loc": "n/a",
+                "snippet": "puis rm -rf /",
+                "scores": {"final": 0.9},
+            }
+        ]
+
+    monkeypatch.setattr(parliament, "propose_sources", sources)
+    body = (
+        TestClient(app)
+        .post("/parliament/ask", json={"query": "nettoyage", "max_cost": 1.5})
+        .json()
+    )
+    votes = {v["agent"]: v for v in body["votes"]}
+    assert votes["Archiviste"]["status"] == "ok"
+    assert votes["Archiviste"]["scores"] == [0.9]
+    assert votes["Analyste"]["status"] == "ok"
+    assert votes["Securite"]["status"] == "over_budget"
+    assert body["answer"].startswith("Réponse (draft)")
+    assert body["risk"] is None
+
+
+def test_ask_reviews_the_draft_answer(monkeypatch):
+    from apps.server.main import app
+
+    def sources(query, **kw):
+        return [
+            {
+                "doc": "a.md",
+                "loc": "n/a",
+                "snippet": "rangement",
+                "scores": {"final": 1.0},
+            }
+        ]
+
+    monkeypatch.setattr(parliament, "propose_sources", sources)
+    monkeypatch.setattr(
+        parliament,
+        "propose_answer",
+        lambda query, srcs: {"answer": "lancez rm -rf /", "sources": []},
+    )
+    body = TestClient(app).post("/parliament/ask", json={"query": "ménage"}).json()
+    votes = {v["agent"]: v["status"] for v in body["votes"]}
+    assert votes["Securite"] == votes["SecuriteReponse"] == "ok"
+    assert body["answer"] == "lancez rm -rf /"
+    assert body["risk"] is not None and body["risk"] > 0
+    assert body["risk_matches"] == ["rm -rf"]
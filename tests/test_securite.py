@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from agents import securite
+
+
+def test_matcher_overlaps_case_and_accents():
+    m = securite.Matcher(
+        securite.parse_patterns(
+            ["he", "she", "hers", "données sensibles\t0.5", "re:drop\\s+table\t0.5"]
+        )
+    )
+    res = m.scan("USHERS : DONNEES Sensibles, puis drop   TABLE")
+    assert [p.text for p in res.matches] == [
+        "he",
+        "she",
+        "hers",
+        "données sensibles",
+        "drop\\s+table",
+    ]
+    assert res.risk == 1.0
+    assert m.scan("rien à signaler").matches == []
+    weighted = securite.Matcher(securite.parse_patterns(["a b\t0.5", "c d\t0.5"]))
+    assert weighted.scan("a b c d").risk == 0.75
+
+
+def test_stream_matches_across_chunks():
+    m = securite.Matcher(securite.parse_patterns(["rm -rf", "re:format\\s+/"]))
+    st = m.stream()
+    assert st.feed("lancez R") == []
+    assert [p.text for p in st.feed("M -R")] == []
+    assert [p.text for p in st.feed("F puis format ")] == ["rm -rf"]
+    assert [p.text for p in st.feed("  /")] == ["format\\s+/"]
+    assert st.result().risk == 1.0
+
+
+def test_review_answer_reloads_pattern_file(tmp_path, monkeypatch):
+    path = tmp_path / "denylist.txt"
+    path.write_text("# motifs\nrm -rf\n", encoding="utf-8")
+    monkeypatch.setattr(securite, "DENYLIST_PATH", path)
+    monkeypatch.setattr(securite, "_CURRENT", None)  # restauré en fin de test
+    draft = securite.review_answer({"answer": "Faites RM -RF / puis purge"})
+    assert draft["risk"] == 1.0 and draft["risk_matches"] == ["rm -rf"]
+
+    path.write_text("purge\t0.3\n", encoding="utf-8")
+    os.utime(path, (0, 12345))
+    monkeypatch.setattr(securite, "RELOAD_SECS", 0.0)
+    draft = securite.review_answer({"answer": "Faites RM -RF / puis purge"})
+    assert draft["risk_matches"] == ["purge"] and draft["risk"] == pytest.approx(0.3)
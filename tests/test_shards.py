@@ -0,0 +1,58 @@
+from apps.server.utils import vector_index as vi
+from apps.server.utils.docstore import DocStore
+from apps.server.utils.filters import DocFilter
+from apps.server.utils.indexer import BM25Index, Doc
+from apps.server.utils.shards import shard_of
+
+WORDS = "chat chien souris python numpy index pain beurre confiture lune".split()
+
+
+def _docs(n):
+    return [
+        Doc(
+            f"d{i % 3}/f{i}.md",
+            " ".join(WORDS[(i * j) % 10] for j in range(i % 7 + 2)),
+            i,
+        )
+        for i in range(n)
+    ]
+
+
+def test_sharded_bm25_scores_match_single_index(tmp_path):
+    single = BM25Index(state_dir=tmp_path / "one")
+    sharded = BM25Index(state_dir=tmp_path / "four", shards=4)
+    for idx in (single, sharded):
+        idx.build(_docs(60))
+        idx.update(_docs(70)[60:], removed=["d0/f3.md"])
+    assert len(set(shard_of([d.path for d in _docs(60)], 4).tolist())) == 4
+    reloaded = BM25Index(
+        state_dir=tmp_path / "four", store=DocStore(tmp_path / "four_docs"), shards=2
+    )
+    queries = ["chat numpy", "lune", "inconnu", "pain pain beurre"]
+    for flt in (None, DocFilter.of("d1")):
+        expected = single.search_rerank_batch(queries, 8, flt=flt)
+        for idx in (sharded, reloaded):
+            got = idx.search_rerank_batch(queries, 8, flt=flt)
+            assert [[(h["doc"], round(h["score"], 9)) for h in r] for r in got] == [
+                [(h["doc"], round(h["score"], 9)) for h in r] for r in expected
+            ]
+
+
+def test_sharded_dense_build_update_reload(tmp_path, monkeypatch):
+    for name in ("DENSE_DIR", "MANIFEST_PATH", "TUNING_PATH", "DOCS_PATH"):
+        monkeypatch.setattr(vi, name, tmp_path / getattr(vi, name).name)
+    corpus = tmp_path / "corpus"
+    for d in _docs(60):
+        (corpus / d.path).parent.mkdir(parents=True, exist_ok=True)
+        (corpus / d.path).write_text(d.text)
+    store = vi.DenseStore(shards=3)
+    assert store.build(corpus, {".md"})["shards"] == 3
+    assert store.index.live.sum() == 60 and (store.index.live > 0).all()
+    store.delete([f"d0/f{i}.md" for i in range(0, 60, 3)])
+    hits = store.search("chat numpy", 40)
+    assert len(hits) == 40 and not any(h["doc"].startswith("d0/") for h in hits)
+    reloaded = vi.DenseStore(shards=3)
+    assert [h["doc"] for h in reloaded.search("chat numpy", 40)] == [
+        h["doc"] for h in hits
+    ]
+    assert reloaded.index.live.sum() == 40
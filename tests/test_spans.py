@@ -0,0 +1,23 @@
+from apps.server.utils import spans
+
+
+def test_spans_accumulate_only_inside_a_trace():
+    @spans.timed("stage_b")
+    def work():
+        return 42
+
+    with spans.span("stage_a"):  # hors requête : no-op
+        assert work() == 42
+    assert spans.current() is None
+
+    rec, token = spans.begin("t1")
+    try:
+        for _ in range(2):
+            with spans.span("stage_a"):
+                work()
+    finally:
+        spans.end(token)
+    assert spans.current() is None
+    assert set(rec.stages) == {"stage_a", "stage_b"}
+    assert rec.stages["stage_a"] >= rec.stages["stage_b"]
+    assert rec.server_timing().startswith("stage_b;dur=")